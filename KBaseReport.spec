@@ -227,4 +227,35 @@ module KBaseReport {
     funcdef render_templates(list<RenderTemplateParams> params)
         returns (list<File> output_paths) authentication required;
 
+    /*
+     * Render one template for each of a list of data records ("mail merge").
+     *
+     * Required arguments:
+     *     string template_file       -  Path to the template file to be rendered.
+     *     string output_file_pattern -  Path for each output file. Must be in the scratch
+     *                                   directory. '{index}' is replaced by the position of
+     *                                   the record in the list, and '{key}' by the value of
+     *                                   'key' in the record, e.g. 'html/{sample_id}.html'.
+     * One of the following is required:
+     *     string records_json        -  JSON list of data records (JSON objects).
+     *     string records_file        -  Path to a file with one data record per line (NDJSON).
+     */
+    typedef structure {
+        string template_file;
+        string output_file_pattern;
+        string records_json;
+        string records_file;
+    } RenderTemplateBatchParams;
+
+    /*
+     * Render a template once for each data record, compiling the template only once.
+     * Output is a list of dicts containing the path of the rendered files, in the order of
+     * the records. All output file paths must be unique.
+     *
+     * If any record fails to render, the endpoint will return an error and no output files
+     * are written.
+     */
+    funcdef render_template_batch(RenderTemplateBatchParams params)
+        returns (list<File> output_paths) authentication required;
+
 };
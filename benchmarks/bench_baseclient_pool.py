@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Compare JSON-RPC calls per second through BaseClient with and without a pooled session
+
+A local keep-alive HTTP/1.1 server answers every call with an empty result. The "unpooled"
+runs replace the client's session with the bare `requests` module, which is what _call used
+before connection pooling: every call opens a new TCP connection.
+
+    PYTHONPATH=lib python benchmarks/bench_baseclient_pool.py [calls] [threads]
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from installed_clients.baseclient import BaseClient
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send the headers and body without waiting for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = json.dumps({'version': '1.1', 'result': [{}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _run(client, url, calls, threads):
+    """ Make `calls` calls split across `threads` threads; return calls per second """
+    def worker(n):
+        for _ in range(n):
+            client._call(url, 'Bench.noop', [])
+
+    workers = [threading.Thread(target=worker, args=(calls // threads,)) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return (calls // threads) * threads / (time.perf_counter() - start)
+
+
+def main(calls=2000, threads=1):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    client = BaseClient(url, token='bench', http_pool_size=max(10, threads))
+    pooled = _run(client, url, calls, threads)
+    client._session = requests
+    unpooled = _run(client, url, calls, threads)
+    server.shutdown()
+
+    print('%d calls, %d thread(s)' % (calls, threads))
+    print('  new connection per call: %8.1f calls/s' % unpooled)
+    print('  pooled keep-alive:       %8.1f calls/s' % pooled)
+    print('  speed-up:                %8.2fx' % (pooled / unpooled))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
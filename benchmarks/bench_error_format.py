@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the time and peak memory of a validation error message for large params, printing the
+whole params (as _format_errors used to) and a bounded copy of them (as it does now)
+
+    PYTHONPATH=lib python benchmarks/bench_error_format.py [direct_html MB] [objects_created]
+"""
+import sys
+import time
+import tracemalloc
+
+from KBaseReport.utils.validation_utils import _error_message, _format_errors
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    message = str(fn())
+    elapsed = time.perf_counter() - start
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (elapsed, peak, len(message))
+
+
+def main(html_mb=50, objects=5000):
+    params = {
+        'workspace_id': 1,
+        'direct_html': '<p>' * (html_mb * 1000000 // 3),
+        'objects_created': [{'ref': '', 'description': 'object ' + str(i)}
+                            for i in range(objects)],
+    }
+    errors = {'objects_created': [{i: [{'ref': ['min length is 1']}] for i in range(objects)}]}
+    print('%d MB of direct_html, %d objects_created' % (html_mb, objects))
+    for (name, fn) in [('whole params', lambda: _error_message(errors, params)),
+                       ('bounded params', lambda: _format_errors(errors, params))]:
+        (elapsed, peak, length) = _measure(fn)
+        print('  %-15s %9.1f ms  peak %8.1f MB  message %10d characters' % (
+            name, elapsed * 1e3, peak / 1e6, length))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Compare running a batch of SDK jobs with a thread per job and with a JobMultiplexer
+
+Uses the fake callback server from bench_run_job_polling. Job durations are spread evenly
+between 10 ms and the given maximum, as for a report that owns many small shock nodes and
+uploads a few large html directories. The threaded run is limited to `workers` jobs at a time,
+as with the upload-concurrency setting; the multiplexer submits them all at once.
+
+    PYTHONPATH=lib python benchmarks/bench_job_multiplexer.py [jobs] [max duration in ms] [workers]
+"""
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_run_job_polling import _Handler, ThreadingHTTPServer
+
+from installed_clients.baseclient import BaseClient
+
+
+def _durations(jobs, max_ms):
+    step = (max_ms - 10) / max(1, jobs - 1)
+    return [(10 + i * step) / 1000.0 for i in range(jobs)]
+
+
+def _threaded(client, durations, workers):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(
+            lambda d: client.run_job('DataFileUtil.own_shock_node', [{'duration': d}]),
+            durations))
+    return time.perf_counter() - start, workers
+
+
+def _multiplexed(client, durations):
+    start = time.perf_counter()
+    with client.job_multiplexer() as multiplexer:
+        futures = [multiplexer.run_job('DataFileUtil.own_shock_node', [{'duration': d}])
+                   for d in durations]
+        for future in futures:
+            future.result()
+    return time.perf_counter() - start, 1
+
+
+def main(jobs=100, max_ms=300, workers=8):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d' % server.server_address[1]
+    durations = _durations(jobs, max_ms)
+
+    threaded, threads = _threaded(BaseClient(url, token='bench'), durations, workers)
+    multiplexed, _ = _multiplexed(BaseClient(url, token='bench'), durations)
+    server.shutdown()
+
+    print('%d jobs of 10-%d ms' % (jobs, max_ms))
+    print('  %2d threads, run_job:    %7.1f ms' % (threads, threaded * 1000))
+    print('   1 thread, multiplexer: %7.1f ms' % (multiplexed * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the JSON backends in json_codec on template data of increasing size, and the cost of
+validate_template_params when template_data_json is parsed twice (as it used to be: once by
+valid_json and again for the result) and once
+
+    PYTHONPATH=lib python benchmarks/bench_json.py [max rows]
+"""
+import json
+import sys
+import tempfile
+import time
+
+from KBaseReport.utils import json_codec, validation_utils
+
+
+def _best_of(fn, runs=3):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _template_data(rows):
+    return {
+        'title': 'Genome annotations',
+        'rows': [{'id': 'gene_%d' % i, 'start': i * 300, 'end': i * 300 + 299, 'score': i / 7,
+                  'function': 'hypothetical protein %d' % i, 'tags': ['cds', 'predicted']}
+                 for i in range(rows)],
+    }
+
+
+def _compare_backends(data, doc):
+    for backend in json_codec.available_backends():
+        json_codec.use_backend(backend)
+        loads = _best_of(lambda: json_codec.loads(doc))
+        dumps = _best_of(lambda: json_codec.dumps(data))
+        print('  %-8s loads %8.1f ms   dumps %8.1f ms' % (backend, loads * 1e3, dumps * 1e3))
+
+
+def _compare_validation(doc, scratch):
+    config = {'scratch': scratch, 'template_toolkit': {}}
+    params = {'template_file': 'views/page.tt', 'template_data_json': doc}
+
+    def parse_twice():
+        validation_utils.validate_template_params(params, config)
+        json_codec.loads(doc)
+
+    for backend in json_codec.available_backends():
+        json_codec.use_backend(backend)
+        twice = _best_of(parse_twice)
+        once = _best_of(lambda: validation_utils.validate_template_params(params, config))
+        print('  %-8s validate_template_params: parsed twice %8.1f ms   once %8.1f ms' % (
+            backend, twice * 1e3, once * 1e3))
+
+
+def main(max_rows=400000):
+    print('JSON backends available: ' + ', '.join(json_codec.available_backends()))
+    scratch = tempfile.mkdtemp()
+    rows = max(1, max_rows // 64)
+    while rows <= max_rows:
+        data = _template_data(rows)
+        doc = json.dumps(data)
+        print('%d rows, %.1f MB of JSON' % (rows, len(doc) / 1e6))
+        _compare_backends(data, doc)
+        _compare_validation(doc, scratch)
+        rows *= 4
+    json_codec.use_backend()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
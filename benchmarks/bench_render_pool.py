@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the time to render a list of templates to files serially and on the process pool
+
+    PYTHONPATH=lib python benchmarks/bench_render_pool.py [templates] [processes]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from KBaseReport.utils.TemplateUtil import TemplateUtil
+
+_TEMPLATE = """<html><body>
+[% FOREACH row IN rows %]<tr>[% FOREACH cell IN row %]<td>[% cell | html %]</td>[% END %]</tr>
+[% END %]
+</body></html>
+"""
+
+
+def _time_list(templater, param_list):
+    start = time.perf_counter()
+    templater.render_template_list_to_files(param_list)
+    return time.perf_counter() - start
+
+
+def main(templates=200, processes=os.cpu_count() or 1):
+    work_dir = tempfile.mkdtemp()
+    template_file = os.path.join(work_dir, 'table.tt')
+    with open(template_file, 'w') as f:
+        f.write(_TEMPLATE)
+    rows = [['cell %d.%d' % (r, c) for c in range(10)] for r in range(100)]
+    config = {
+        'scratch': work_dir,
+        'template_toolkit': {'ABSOLUTE': 1, 'RELATIVE': 1, 'INCLUDE_PATH': work_dir},
+    }
+
+    def param_list(name):
+        return [{
+            'template_file': template_file,
+            'template_data': {'rows': rows},
+            'output_file': os.path.join(work_dir, name, '%d.html' % n),
+        } for n in range(templates)]
+
+    try:
+        serial = TemplateUtil(dict(config, **{'template-render-processes': 1}))
+        serial_time = _time_list(serial, param_list('serial'))
+        pooled = TemplateUtil(dict(config, **{'template-render-processes': processes}))
+        # the first list starts the worker processes
+        pool_start_time = _time_list(pooled, param_list('pool-start'))
+        pool_time = _time_list(pooled, param_list('pool'))
+        if pooled._render_pool is not None:
+            pooled._render_pool.shutdown()
+    finally:
+        shutil.rmtree(work_dir)
+
+    print('%d templates, each a table of 1000 cells' % templates)
+    print('  serial:                 %7.3f s' % serial_time)
+    print('  %2d processes, cold pool: %6.3f s' % (processes, pool_start_time))
+    print('  %2d processes, warm pool: %6.3f s' % (processes, pool_time))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
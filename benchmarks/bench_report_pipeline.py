@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Compare uploading the rendered html_links of an extended report stage by stage and through
+the render -> pack -> upload pipeline in file_utils.fetch_or_upload_links
+
+Every page is a template rendered with TemplateUtil. Jobs are run by a DataFileUtil client
+whose BaseClient is replaced by an in-process fake of the callback server: a
+file_to_shock_mass job finishes a fixed latency plus a time per file after it was submitted,
+and jobs run in parallel. The stage-by-stage run renders every page to a scratch file, then
+zips every page, then uploads them all in one job, which is the order in which
+create_extended_report used to work. The pipeline is run with rendered pages kept in memory
+and, with 'render-spill-bytes' set to 0, with every page written to a file before it is zipped.
+
+    PYTHONPATH=lib python benchmarks/bench_report_pipeline.py [pages] [upload ms per page]
+"""
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from installed_clients.baseclient import BaseClient
+from installed_clients.DataFileUtilClient import DataFileUtil
+from KBaseReport.utils import file_utils
+from KBaseReport.utils.TemplateUtil import TemplateUtil
+
+_TEMPLATE = """<html><body><table>
+[% FOREACH row IN rows %]<tr>[% FOREACH cell IN row %]<td>[% cell | html %]</td>[% END %]</tr>
+[% END %]</table></body></html>
+"""
+
+
+class _FakeCallbackServer(BaseClient):
+
+    def __init__(self, latency, per_file):
+        super(_FakeCallbackServer, self).__init__('http://localhost:1', token='bench',
+                                                  async_job_check_time_ms=10)
+        self.latency = latency
+        self.per_file = per_file
+        self._ids = itertools.count()
+        self._jobs = {}
+
+    def _submit_job(self, service_method, args, service_ver=None, context=None):
+        job_id = str(next(self._ids))
+        files = len(args[0])
+        self._jobs[job_id] = (time.time() + self.latency + self.per_file * files, files)
+        return job_id
+
+    def _check_job(self, service, job_id):
+        (finish, files) = self._jobs[job_id]
+        if time.time() < finish:
+            return {'finished': 0}
+        return {'finished': 1, 'result': [[self._shock() for _ in range(files)]]}
+
+    def _shock(self):
+        node = 'node%d' % next(self._ids)
+        return {'shock_id': node, 'handle': {'hid': 'KBH_' + node, 'id': node,
+                                             'url': 'http://shock'}}
+
+
+def _dfu(upload_ms):
+    dfu = DataFileUtil('http://localhost:1', token='bench')
+    dfu._client = _FakeCallbackServer(0.05, upload_ms / 1000.0)
+    return dfu
+
+
+def _html_links(template_file, pages):
+    rows = [['cell %d.%d' % (i, j) for j in range(10)] for i in range(200)]
+    return [{'name': 'page%d.html' % i,
+             'template': {'template_file': template_file,
+                          'template_data_json': json.dumps({'rows': rows})}}
+            for i in range(pages)]
+
+
+def _stage_by_stage(dfu, templater, html_links):
+    scratch = templater.config['scratch']
+    work_dir = os.path.join(scratch, 'stage_by_stage')
+    for link in html_links:
+        link['path'] = templater.render_template_to_scratch_file(link.pop('template'))['path']
+    archives = [file_utils._zip_link(link, work_dir) for link in html_links]
+    dfu.file_to_shock_mass([{'file_path': path, 'make_handle': 1} for (path, _) in archives])
+    shutil.rmtree(work_dir)
+
+
+def main(pages=40, upload_ms=10):
+    scratch = tempfile.mkdtemp()
+    template_file = os.path.join(scratch, 'page.tt')
+    with open(template_file, 'w') as f:
+        f.write(_TEMPLATE)
+    config = {'scratch': scratch, 'template_toolkit': {'ABSOLUTE': 1, 'RELATIVE': 1}}
+    templater = TemplateUtil(config)
+    spilling_templater = TemplateUtil(dict(config, **{'render-spill-bytes': 0}))
+
+    try:
+        # separate clients, so that job durations from one run don't set polling for the other
+        dfu = _dfu(upload_ms)
+        start = time.perf_counter()
+        _stage_by_stage(dfu, templater, _html_links(template_file, pages))
+        stage_by_stage = time.perf_counter() - start
+
+        dfu = _dfu(upload_ms)
+        start = time.perf_counter()
+        file_utils.fetch_or_upload_links(dfu, [], _html_links(template_file, pages), templater,
+                                         max_workers=8)
+        pipelined = time.perf_counter() - start
+
+        dfu = _dfu(upload_ms)
+        start = time.perf_counter()
+        file_utils.fetch_or_upload_links(dfu, [], _html_links(template_file, pages),
+                                         spilling_templater, max_workers=8)
+        spilled = time.perf_counter() - start
+    finally:
+        shutil.rmtree(scratch)
+
+    print('%d rendered pages, %d ms upload per page' % (pages, upload_ms))
+    print('  stage by stage: %7.1f ms' % (stage_by_stage * 1000))
+    print('  pipelined:      %7.1f ms' % (pipelined * 1000))
+    print('  pipelined, rendered pages written to files: %7.1f ms' % (spilled * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the latency of BaseClient.run_job with fixed and adaptive job polling
+
+A local server stands in for the SDK callback server: each submitted job finishes a fixed
+time after it was submitted. Jobs are run one after another, as in sequential report
+creation; a job may also ask for its own duration in seconds with a 'duration' parameter.
+The "fixed" runs disable the per-method duration estimates, so polling starts at
+async_job_check_time and backs off by 150%, which is how run_job behaved before.
+
+    PYTHONPATH=lib python benchmarks/bench_run_job_polling.py [jobs] [job duration in ms]
+"""
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from installed_clients.baseclient import BaseClient
+
+_jobs = {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    job_duration = 0.02
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if req['method'].endswith('_submit'):
+            job_id = str(uuid.uuid4())
+            duration = req['params'][0].get('duration', self.job_duration)
+            _jobs[job_id] = time.time() + duration
+            result = [job_id]
+        else:
+            finished = time.time() >= _jobs[req['params'][0]]
+            result = [{'finished': int(finished), 'result': [{}] if finished else None}]
+        body = json.dumps({'version': '1.1', 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _NoEstimates(object):
+    """ JobStats stand-in that never learns, giving the fixed polling schedule """
+
+    def shortest_duration(self, service_method):
+        return None
+
+    def record(self, *args):
+        pass
+
+
+def _run(client, jobs):
+    start = time.perf_counter()
+    for _ in range(jobs):
+        client.run_job('DataFileUtil.file_to_shock', [{}])
+    return (time.perf_counter() - start) / jobs
+
+
+def main(jobs=50, duration_ms=20):
+    _Handler.job_duration = duration_ms / 1000.0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d' % server.server_address[1]
+
+    fixed_client = BaseClient(url, token='bench')
+    fixed_client.job_stats = _NoEstimates()
+    fixed = _run(fixed_client, jobs)
+
+    adaptive_client = BaseClient(url, token='bench')
+    adaptive = _run(adaptive_client, jobs)
+    metrics = adaptive_client.job_stats.metrics()['DataFileUtil.file_to_shock']
+    server.shutdown()
+
+    print('%d sequential jobs of %d ms' % (jobs, duration_ms))
+    print('  fixed schedule:    %7.1f ms per job' % (fixed * 1000))
+    print('  adaptive schedule: %7.1f ms per job' % (adaptive * 1000))
+    print('  adaptive polls per job:       %5.2f' % (metrics['polls'] / metrics['jobs']))
+    print('  adaptive wasted wait per job: %5.1f ms' % (
+        metrics['wasted_wait'] / metrics['jobs'] * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
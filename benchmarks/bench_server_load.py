@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Load test for the server modes in wsgi_server: the single-threaded wsgiref server ('simple'),
+a thread pool ('threaded') and prefork workers each with a thread pool ('prefork')
+
+The application stands in for KBaseReport: each request waits 20 ms, as if for a DataFileUtil
+call, and encodes a JSON result; one client in ten makes a slow 1 s request first, as a long
+create_extended_report would. Each client thread keeps its connection alive between requests.
+
+    PYTHONPATH=lib python benchmarks/bench_server_load.py [clients] [requests per client]
+"""
+import http.client
+import json
+import multiprocessing
+import sys
+import threading
+import time
+
+from KBaseReport.utils.wsgi_server import run_server
+
+_RESULT = {'report_name': 'report_1234', 'report_ref': '1/2/3',
+           'objects': [{'ref': '1/%d/1' % i, 'description': 'object %d' % i} for i in range(50)]}
+
+
+def _app(environ, start_response):
+    body_size = int(environ.get('CONTENT_LENGTH') or 0)
+    request = json.loads(environ['wsgi.input'].read(body_size) or b'{}')
+    time.sleep(request.get('wait', 0.02))
+    body = json.dumps({'result': [_RESULT]}).encode('utf-8')
+    start_response('200 OK', [('Content-Type', 'application/json'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def _client(port, requests, slow_first, latencies):
+    connection = http.client.HTTPConnection('localhost', port, timeout=120)
+    for n in range(requests):
+        body = json.dumps({'wait': 1.0 if slow_first and n == 0 else 0.02})
+        start = time.perf_counter()
+        connection.request('POST', '/', body, {'Content-Type': 'application/json'})
+        connection.getresponse().read()
+        if not (slow_first and n == 0):
+            latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def _run(mode, clients, requests):
+    context = multiprocessing.get_context('fork')
+    ports = context.Queue()
+    server = context.Process(target=run_server, args=(_app, 'localhost', 0), kwargs={
+        'mode': mode, 'workers': 4, 'threads': 16, 'ready': ports.put})
+    server.start()
+    port = ports.get(timeout=10)
+    latencies = []
+    threads = [threading.Thread(target=_client, args=(port, requests, n % 10 == 0, latencies))
+               for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    server.terminate()
+    server.join()
+    latencies.sort()
+    print('%-9s %7.1f requests/s   p50 %7.1f ms   p99 %8.1f ms   total %6.2f s' % (
+        mode, len(latencies) / elapsed, latencies[len(latencies) // 2] * 1e3,
+        latencies[int(len(latencies) * 0.99)] * 1e3, elapsed))
+
+
+def main(clients=20, requests=25):
+    print('%d clients, %d requests each' % (clients, requests))
+    for mode in ['simple', 'threaded', 'prefork']:
+        _run(mode, clients, requests)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
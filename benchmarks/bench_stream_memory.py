@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Compare peak memory when rendering a large table to a file as one string and streamed to the
+file with template_stream.process_to_file
+
+The table repeats the same 1000 rows, so the template data stays the same size while the output
+grows. Peak memory is the peak of Python allocations during the render, measured by tracemalloc.
+
+    PYTHONPATH=lib python benchmarks/bench_stream_memory.py [max repeats]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from template import Template
+
+from KBaseReport.utils.template_stream import process_to_file
+
+_TEMPLATE = ('<table>\n[% FOREACH rep IN [1..repeats] %][% FOREACH row IN rows %]<tr>'
+             '[% FOREACH cell IN row %]<td>[% cell | html %]</td>[% END %]</tr>\n'
+             '[% END %][% END %]</table>\n')
+
+
+def _render_string(engine, data, output_file):
+    with open(output_file, 'w') as f:
+        f.write(engine.process('table.tt', data))
+
+
+def _render_stream(engine, data, output_file):
+    with open(output_file, 'w') as f:
+        process_to_file(engine, 'table.tt', data, f)
+
+
+def _measure(render, engine, data, output_file):
+    tracemalloc.start()
+    start = time.perf_counter()
+    render(engine, data, output_file)
+    elapsed = time.perf_counter() - start
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (peak, elapsed, os.path.getsize(output_file))
+
+
+def main(max_repeats=40):
+    work_dir = tempfile.mkdtemp()
+    with open(os.path.join(work_dir, 'table.tt'), 'w') as f:
+        f.write(_TEMPLATE)
+    engine = Template({'INCLUDE_PATH': work_dir})
+    rows = [['cell %d.%d' % (r, c) for c in range(10)] for r in range(1000)]
+    output_file = os.path.join(work_dir, 'table.html')
+
+    print('%8s %10s  %22s  %22s' % ('repeats', 'output', 'string: peak / time',
+                                    'streamed: peak / time'))
+    try:
+        # compile the template before measuring
+        _render_stream(engine, {'rows': rows, 'repeats': 1}, output_file)
+        repeats = max(1, max_repeats // 8)
+        while repeats <= max_repeats:
+            data = {'rows': rows, 'repeats': repeats}
+            (string_peak, string_time, size) = _measure(_render_string, engine, data,
+                                                        output_file)
+            (stream_peak, stream_time, _) = _measure(_render_stream, engine, data, output_file)
+            print('%8d %7.1f MB  %9.1f MB / %6.2f s  %9.2f MB / %6.2f s' % (
+                repeats, size / 1e6, string_peak / 1e6, string_time,
+                stream_peak / 1e6, stream_time))
+            repeats *= 2
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
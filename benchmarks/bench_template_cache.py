@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Compare render times with Template Toolkit's default provider and with the compiled-template
+cache in TemplateUtil
+
+The page uses a wrapper and several INCLUDEs, so it is made of more templates than the
+default provider cache (two) can hold. The first render in a new TemplateUtil, as in a new
+async job process, is timed with and without a persistent store of compiled templates, and
+after TemplateUtil.warm_up, as the KBaseReport constructor runs it.
+
+    PYTHONPATH=lib python benchmarks/bench_template_cache.py [renders]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from template import Template
+
+from KBaseReport.utils.TemplateUtil import TemplateUtil
+
+_INCLUDE = """<div class="[% name %]">
+[% FOREACH item IN items %][% IF item.value > 5 %]<b>[% item.name | html %]</b>[% ELSE %]
+<i>[% item.name | html %]</i>[% END %][% END %]
+</div>
+""" * 20
+
+
+def _write_templates(template_dir, includes):
+    for i in range(includes):
+        with open(os.path.join(template_dir, 'inc%d.tt' % i), 'w') as f:
+            f.write(_INCLUDE.replace('[% name %]', 'inc%d' % i))
+    with open(os.path.join(template_dir, 'wrapper.tt'), 'w') as f:
+        f.write('<html><body>[% content %]</body></html>')
+    with open(os.path.join(template_dir, 'page.tt'), 'w') as f:
+        f.write('[% WRAPPER wrapper.tt %]'
+                + ''.join('[%% INCLUDE inc%d.tt %%]' % i for i in range(includes))
+                + '[% END %]')
+
+
+def _time_renders(render, renders):
+    start = time.perf_counter()
+    for _ in range(renders):
+        render()
+    return (time.perf_counter() - start) / renders
+
+
+def main(renders=50, includes=5):
+    template_dir = tempfile.mkdtemp()
+    _write_templates(template_dir, includes)
+    tt_config = {'ABSOLUTE': 1, 'RELATIVE': 1, 'INCLUDE_PATH': template_dir}
+    data = {'items': [{'name': 'item %d' % i, 'value': i % 10} for i in range(20)]}
+    page = os.path.join(template_dir, 'page.tt')
+
+    try:
+        engine = Template(dict(tt_config))
+        default = _time_renders(lambda: engine.process(page, data), renders)
+
+        config = {'scratch': template_dir, 'template_toolkit': tt_config}
+        templater = TemplateUtil(config)
+        cached = _time_renders(lambda: templater._render_template(page, data), renders)
+
+        cold = _time_renders(lambda: TemplateUtil(config)._render_template(page, data), 1)
+        store_config = dict(config, **{'template-store-dir': os.path.join(template_dir, 'ttc')})
+        TemplateUtil(store_config).precompile_templates(template_dir)
+        stored = _time_renders(lambda: TemplateUtil(store_config)._render_template(page, data), 1)
+        warm_templater = TemplateUtil(config)
+        start = time.perf_counter()
+        warm_templater.warm_up()
+        warm_up = time.perf_counter() - start
+        warmed = _time_renders(lambda: warm_templater._render_template('page.tt', data), 1)
+    finally:
+        shutil.rmtree(template_dir)
+
+    print('%d renders of a page with a wrapper and %d includes' % (renders, includes))
+    print('  default provider: %7.2f ms per render' % (default * 1000))
+    print('  template cache:   %7.2f ms per render' % (cached * 1000))
+    print('  %s' % templater.template_cache.stats())
+    print('first render in a new process')
+    print('  no store:         %7.2f ms' % (cold * 1000))
+    print('  precompiled store: %6.2f ms' % (stored * 1000))
+    print('  after warm-up:    %7.2f ms (warm-up took %.2f ms)' % (warmed * 1000, warm_up * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
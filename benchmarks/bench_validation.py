@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Compare three ways of validating report and template parameters: a new cerberus Validator per
+call (as validation_utils used to), a re-used cerberus Validator, and the compiled checks from
+fast_validation that validation_utils now tries first
+
+    PYTHONPATH=lib python benchmarks/bench_validation.py [objects_created entries] [calls]
+"""
+import sys
+import tempfile
+import time
+
+from cerberus import Validator
+
+from KBaseReport.utils import validation_utils
+
+
+def _time_calls(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls
+
+
+def _compare(title, make_schema, validate, calls):
+    def new_validator():
+        Validator(make_schema()).validate(validate.params)
+
+    def cerberus():
+        validation_utils.USE_FAST_CHECKS = False
+        try:
+            validate()
+        finally:
+            validation_utils.USE_FAST_CHECKS = True
+
+    print(title)
+    print('  new validator:       %9.3f ms' % (_time_calls(new_validator, calls) * 1e3))
+    print('  re-used validator:   %9.3f ms' % (_time_calls(cerberus, calls) * 1e3))
+    print('  compiled check:      %9.3f ms' % (_time_calls(validate, calls) * 1e3))
+
+
+def main(objects=10000, calls=10):
+    scratch = tempfile.gettempdir()
+    config = {'scratch': scratch, 'template_toolkit': {}}
+    objects_created = [{'ref': '1/%d/1' % i, 'description': 'object %d' % i}
+                       for i in range(objects)]
+    file_links = [{'name': 'file%d.txt' % i, 'shock_id': 'node%d' % i, 'label': 'file'}
+                  for i in range(objects // 2)]
+
+    def report(params):
+        def validate():
+            validation_utils.validate_extended_report_params(params)
+        validate.params = params
+        return validate
+
+    _compare('create_extended_report params, %d objects_created' % objects,
+             validation_utils._extended_report_schema,
+             report({'workspace_id': 1, 'objects_created': objects_created}), calls)
+    _compare('create_extended_report params, %d file_links' % len(file_links),
+             validation_utils._extended_report_schema,
+             report({'workspace_id': 1, 'file_links': file_links}), calls)
+    _compare('create_extended_report params, 2 objects_created',
+             validation_utils._extended_report_schema,
+             report({'workspace_id': 1, 'message': 'done',
+                     'objects_created': objects_created[:2]}), calls * 100)
+
+    template = {'template_file': 'page.tt', 'template_data_json': '{"a": 1}',
+                'output_file': scratch + '/page.html'}
+
+    def render():
+        validation_utils.validate_template_params(dict(template), config, with_output_file=True,
+                                                  config_validated=True)
+    render.params = template
+    _compare('render_template params',
+             lambda: validation_utils._template_schema(scratch, True), render, calls * 100)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -1,11 +1,18 @@
 # -*- coding: utf-8 -*-
 #BEGIN_HEADER
 from installed_clients.DataFileUtilClient import DataFileUtil
-from .utils import report_utils
+from .utils import json_codec, report_utils
 from .utils.TemplateUtil import TemplateUtil
+from .utils.shared_cache import SharedCache
+from .utils.upload_cache import UploadCache
+from .utils.workspace_cache import WorkspaceIdCache
 from .utils.validation_utils import validate_simple_report_params, validate_extended_report_params
+import logging
 import os
+import time
 from configparser import ConfigParser
+
+logger = logging.getLogger(__name__)
 #END_HEADER
 
 
@@ -29,6 +36,24 @@ class KBaseReport:
     GIT_COMMIT_HASH = "f5bc602a97236420844d03782549055d9ecbf2f0"
 
     #BEGIN_CLASS_HEADER
+    def warm_up_templates(self):
+        """
+        Compile the templates in the INCLUDE_PATH, so that first renders do not have to
+        The server entry point, server.py, calls this if template-warmup is set in the config.
+        """
+        start = time.time()
+        result = self.templater.warm_up()
+        logger.info('Template warm-up compiled %d templates in %.3fs',
+                    len(result['compiled']), time.time() - start)
+        for (name, error) in result['failed'].items():
+            logger.warning('Template warm-up could not compile %s: %s', name, error)
+        return result
+
+    def shared_namespace(self, name, max_entries):
+        """ A namespace of the shared cache, or None if there is no shared cache """
+        if self.shared_cache is None:
+            return None
+        return self.shared_cache.namespace(name, max_entries)
     #END_CLASS_HEADER
 
     # config contains contents of config file in a hash or None if it couldn't
@@ -38,7 +63,16 @@ class KBaseReport:
 
         self.config = config
         self.callback_url = os.environ['SDK_CALLBACK_URL']
-        self.dfu = DataFileUtil(self.callback_url)
+        # JSON backend for DataFileUtil calls and template data
+        json_codec.use_backend(config.get('json-backend', 'auto'))
+        # maximum number of report links to zip or hash at once per report
+        self.upload_concurrency = int(config.get('upload-concurrency', 8))
+        # keep a pooled connection open for each concurrent task. DFU jobs are often short,
+        # so start polling quickly; later jobs are polled based on observed job durations
+        self.dfu = DataFileUtil(self.callback_url,
+                                http_pool_size=max(10, self.upload_concurrency),
+                                async_job_check_time_ms=10,
+                                json_codec=json_codec)
 
         config_parser = ConfigParser()
         config_file = os.environ.get('KB_DEPLOYMENT_CONFIG', None)
@@ -52,9 +86,29 @@ class KBaseReport:
             template_toolkit_config[config_item[0]] = config_item[1]
 
         self.config['template_toolkit'] = template_toolkit_config
+        # shared by all requests; each render takes a template engine from the templater's pool
         self.templater = TemplateUtil(self.config)
 
         self.scratch = config['scratch']
+        # second level for the auth, workspace ID and upload caches, shared by the server's
+        # worker processes; disabled unless shared-cache-dir is set
+        self.shared_cache = None
+        if config.get('shared-cache-dir'):
+            self.shared_cache = SharedCache(
+                os.path.join(config['shared-cache-dir'], 'shared_cache.sqlite'))
+        # index of previously uploaded file contents; set upload-cache-entries to 0 to disable
+        self.upload_cache = None
+        upload_cache_entries = int(config.get('upload-cache-entries', 10000))
+        if upload_cache_entries > 0:
+            self.upload_cache = UploadCache(
+                os.path.join(self.scratch, 'upload_cache'), upload_cache_entries,
+                shared=self.shared_namespace('uploads', upload_cache_entries))
+        # workspace name -> ID lookups, shared by all reports
+        workspace_id_cache_entries = int(config.get('workspace-id-cache-entries', 1000))
+        self.workspace_ids = WorkspaceIdCache(
+            workspace_id_cache_entries,
+            float(config.get('workspace-id-cache-ttl', 300)),
+            shared=self.shared_namespace('workspace_ids', workspace_id_cache_entries))
 
         #END_CONSTRUCTOR
         pass
@@ -121,7 +175,7 @@ class KBaseReport:
         if 'template' in params['report']:
             # render template and set content as 'direct_html'
             params['report'] = self.templater.render_template_to_direct_html(params['report'])
-        info = report_utils.create_report(params, self.dfu)
+        info = report_utils.create_report(params, self.dfu, self.workspace_ids)
         #END create
 
         # At some point might do deeper type checking...
@@ -255,7 +309,9 @@ class KBaseReport:
         if 'template' in params:
             # render template and set content as 'direct_html'
             params = self.templater.render_template_to_direct_html(params)
-        info = report_utils.create_extended(params, self.dfu, self.templater)
+        info = report_utils.create_extended(params, self.dfu, self.templater,
+                                            self.upload_concurrency, self.upload_cache,
+                                            self.workspace_ids)
         #END create_extended_report
 
         # At some point might do deeper type checking...
@@ -373,12 +429,51 @@ class KBaseReport:
                              'output_paths is not type dict as required.')
         # return the results
         return [output_paths]
+
+    def render_template_batch(self, ctx, params):
+        """
+        Render a template once for each data record, compiling the template only once.
+        Output is a list of dicts containing the path of the rendered files, in the order of
+        the records. All output file paths must be unique.
+        If any record fails to render, the endpoint will return an error and no output files
+        are written.
+        :param params: instance of type "RenderTemplateBatchParams" (*
+           Render one template for each of a list of data records ("mail
+           merge"). * * Required arguments: *     string template_file       -
+           Path to the template file to be rendered. *     string
+           output_file_pattern -  Path for each output file. Must be in the
+           scratch *                                   directory. '{index}'
+           is replaced by the position of *
+           the record in the list, and '{key}' by the value of *
+           'key' in the record, e.g. 'html/{sample_id}.html'. * One of the
+           following is required: *     string records_json        -  JSON
+           list of data records (JSON objects). *     string records_file
+           -  Path to a file with one data record per line (NDJSON).) ->
+           structure: parameter "template_file" of String, parameter
+           "output_file_pattern" of String, parameter "records_json" of
+           String, parameter "records_file" of String
+        :returns: instance of list of type "File"
+        """
+        # ctx is the context object
+        # return variables are: output_paths
+        #BEGIN render_template_batch
+        output_paths = self.templater.render_template_batch(params)
+        #END render_template_batch
+
+        # At some point might do deeper type checking...
+        if not isinstance(output_paths, list):
+            raise ValueError('Method render_template_batch return value ' +
+                             'output_paths is not type list as required.')
+        # return the results
+        return [output_paths]
     def status(self, ctx):
         #BEGIN_STATUS
         returnVal = {'state': "OK",
                      'message': "",
                      'version': self.VERSION,
                      'git_url': self.GIT_URL,
-                     'git_commit_hash': self.GIT_COMMIT_HASH}
+                     'git_commit_hash': self.GIT_COMMIT_HASH,
+                     # DataFileUtil job durations and polling, by method
+                     'dfu_jobs': self.dfu._client.job_stats.metrics()}
         #END_STATUS
         return [returnVal]
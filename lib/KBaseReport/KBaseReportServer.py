@@ -354,6 +354,10 @@ class Application(object):
                              name='KBaseReport.render_templates',
                              types=[dict])
         self.method_authentication['KBaseReport.render_templates'] = 'required'  # noqa
+        self.rpc_service.add(impl_KBaseReport.render_template_batch,
+                             name='KBaseReport.render_template_batch',
+                             types=[dict])
+        self.method_authentication['KBaseReport.render_template_batch'] = 'required'  # noqa
         self.rpc_service.add(impl_KBaseReport.status,
                              name='KBaseReport.status',
                              types=[dict])
@@ -491,7 +495,7 @@ class Application(object):
         return json.dumps(error)
 
     def now_in_utc(self):
-        # noqa Taken from http://stackoverflow.com/questions/3401428/how-to-get-an-isoformat-datetime-string-including-the-default-timezone @IgnorePep8
+        # Taken from https://stackoverflow.com/questions/3401428
         dtnow = datetime.datetime.now()
         dtutcnow = datetime.datetime.utcnow()
         delta = dtnow - dtutcnow
@@ -9,50 +9,84 @@ import time as _time
 import requests as _requests
 import threading as _threading
 import hashlib
+from collections import OrderedDict as _OrderedDict
+from concurrent.futures import Future as _Future
 
 
 class TokenCache(object):
-    ''' A basic cache for tokens. '''
+    '''
+    A cache for tokens. Least recently used tokens are evicted first, and entries expire: valid
+    tokens after _MAX_TIME_SEC, tokens the auth service rejected after _INVALID_TIME_SEC.
+    An optional shared cache (e.g. a KBaseReport.utils.shared_cache.SharedCacheNamespace, with
+    get(key) and set(key, value, ttl)) is a second level, shared with other processes.
+    '''
 
     _MAX_TIME_SEC = 5 * 60  # 5 min
+    _INVALID_TIME_SEC = 30
 
-    _lock = _threading.RLock()
-
-    def __init__(self, maxsize=2000):
-        self._cache = {}
+    def __init__(self, maxsize=2000, clock=_time.monotonic, shared=None):
+        self._lock = _threading.Lock()
+        # token hash -> (user or None, error message or None, expiry time)
+        self._cache = _OrderedDict()
         self._maxsize = maxsize
-        self._halfmax = maxsize / 2  # int division to round down
+        self._clock = clock
+        self._shared = shared
 
     def get_user(self, token):
-        token = hashlib.sha256(token.encode('utf-8')).hexdigest()
-        with self._lock:
-            usertime = self._cache.get(token)
-        if not usertime:
-            return None
+        ''' The user for a cached valid token, or None '''
+        return self.get(token)[0]
 
-        user, intime = usertime
-        if _time.time() - intime > self._MAX_TIME_SEC:
-            return None
-        return user
+    def get_error(self, token):
+        ''' The error message for a cached rejected token, or None '''
+        return self.get(token)[1]
+
+    def get(self, token, shared=True):
+        '''
+        A tuple of (user, error) for a cached token: the user if it is valid, or the error
+        message if it was rejected. (None, None) if the token is not cached.
+        shared - whether to look in the shared cache if the token is not cached in this process.
+        '''
+        token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        with self._lock:
+            entry = self._cache.get(token_hash)
+            if entry is not None and entry[2] <= self._clock():
+                del self._cache[token_hash]
+                entry = None
+            if entry is not None:
+                self._cache.move_to_end(token_hash)
+                return entry[:2]
+        if self._shared is None or not shared:
+            return (None, None)
+        shared = self._shared.get(token_hash)
+        if shared is None:
+            return (None, None)
+        # keep it here until it expires in the shared cache
+        result = (shared['user'], shared['error'])
+        self._add(token, result, shared['expires'] - _time.time(), False)
+        return result
 
     def add_valid_token(self, token, user):
         if not token:
             raise ValueError('Must supply token')
         if not user:
             raise ValueError('Must supply user')
+        self._add(token, (user, None), self._MAX_TIME_SEC, True)
+
+    def add_invalid_token(self, token, error):
+        if not token:
+            raise ValueError('Must supply token')
+        self._add(token, (None, error), self._INVALID_TIME_SEC, True)
+
+    def _add(self, token, result, time_sec, share):
         token = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        if share and self._shared is not None:
+            self._shared.set(token, {'user': result[0], 'error': result[1],
+                                     'expires': _time.time() + time_sec}, time_sec)
         with self._lock:
-            self._cache[token] = [user, _time.time()]
-            if len(self._cache) > self._maxsize:
-                sorted_items = sorted(
-                    list(self._cache.items()),
-                    key=(lambda v: v[1][1])
-                )
-                for i, (t, _) in enumerate(sorted_items):
-                    if i <= self._halfmax:
-                        del self._cache[t]
-                    else:
-                        break
+            self._cache[token] = result + (self._clock() + time_sec,)
+            self._cache.move_to_end(token)
+            while len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
 
 
 class KBaseAuth(object):
@@ -62,22 +96,64 @@ class KBaseAuth(object):
 
     _LOGIN_URL = 'https://kbase.us/services/auth/api/legacy/KBase/Sessions/Login'
 
-    def __init__(self, auth_url=None):
+    def __init__(self, auth_url=None, shared_cache=None):
         '''
         Constructor
+        :param shared_cache: optional second-level token cache shared with other processes;
+            see TokenCache
         '''
         self._authurl = auth_url
         if not self._authurl:
             self._authurl = self._LOGIN_URL
-        self._cache = TokenCache()
+        self._cache = TokenCache(shared=shared_cache)
+        # token -> Future for the auth service call in progress for that token
+        self._in_flight = {}
+        self._in_flight_lock = _threading.Lock()
 
     def get_user(self, token):
         if not token:
             raise ValueError('Must supply token')
-        user = self._cache.get_user(token)
+        # most requests are for a token cached in this process
+        (user, error) = self._cache.get(token, shared=False)
+        if not (user or error):
+            # threads asking for the same token wait for a single lookup in the shared cache
+            # and the auth service. The local cache is checked again under the same lock, so a
+            # lookup that has just finished is not repeated.
+            with self._in_flight_lock:
+                (user, error) = self._cache.get(token, shared=False)
+                if not (user or error):
+                    call = self._in_flight.get(token)
+                    waiting = call is not None
+                    if not waiting:
+                        call = self._in_flight[token] = _Future()
+        if user:
+            return user
+        if error:
+            raise ValueError(error)
+        if waiting:
+            return call.result()
+        try:
+            user = self._lookup_user(token)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(user)
+            return user
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[token]
+
+    def _lookup_user(self, token):
+        ''' Look the token up in the shared cache, if there is one, or the auth service '''
+        (user, error) = self._cache.get(token)
         if user:
             return user
+        if error:
+            raise ValueError(error)
+        return self._fetch_user(token)
 
+    def _fetch_user(self, token):
         d = {'token': token, 'fields': 'user_id'}
         ret = _requests.post(self._authurl, data=d)
         if not ret.ok:
@@ -85,9 +161,13 @@ class KBaseAuth(object):
                 err = ret.json()
             except Exception as e:
                 ret.raise_for_status()
-            raise ValueError('Error connecting to auth service: {} {}\n{}'
-                             .format(ret.status_code, ret.reason,
-                                     err['error']['message']))
+            error = ('Error connecting to auth service: {} {}\n{}'
+                     .format(ret.status_code, ret.reason, err['error']['message']))
+            if ret.status_code in (401, 403):
+                # the token was rejected; don't ask again for a while. Other errors, such as
+                # 429 Too Many Requests, say nothing about the token
+                self._cache.add_invalid_token(token, error)
+            raise ValueError(error)
 
         user = ret.json()['user_id']
         self._cache.add_valid_token(token, user)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import sys
+from getopt import getopt, GetoptError
+
+from KBaseReport.KBaseReportServer import AUTH, application, config, impl_KBaseReport
+from KBaseReport.authclient import KBaseAuth
+from KBaseReport.utils.wsgi_server import MODES, run_server
+
+"""
+Entry point for the KBaseReport service
+KBaseReportServer.py is generated by kb-sdk compile, so it is left as generated and the changes
+to how the service is run live here. This module exports the generated `application`, for uwsgi:
+    uwsgi --http :5000 --wsgi-file lib/KBaseReport/server.py
+Run as a script, it serves the application with one of the wsgi_server modes:
+    python lib/KBaseReport/server.py [--host HOST] [--port PORT] [--mode MODE]
+                                     [--workers N] [--threads N]
+The mode, worker and thread counts default to server-mode, server-workers and server-threads in
+the config.
+"""
+
+
+def warm_up():
+    """
+    Compile the templates before the first request, if template-warmup is set in the config and
+    KBASE_REPORT_SKIP_WARMUP is not set in the environment. One-off jobs, which run
+    KBaseReportServer.py, compile them as they are used instead.
+    """
+    skip = os.environ.get('KBASE_REPORT_SKIP_WARMUP', '').lower() not in ('', '0', 'false', 'no')
+    if config and int(config.get('template-warmup', 0)) and not skip:
+        impl_KBaseReport.warm_up_templates()
+
+
+# under uwsgi, the application is ready once this module is loaded; run directly, main() warms
+# up once logging is configured
+if __name__ != '__main__':
+    warm_up()
+
+# tokens checked by any worker process are shared, if a shared cache is configured
+application.auth_client = KBaseAuth(config.get(AUTH) if config else None,
+                                    impl_KBaseReport.shared_namespace('auth_tokens', 2000))
+
+
+def server_options(mode=None, workers=None, threads=None):
+    """ Options for wsgi_server.run_server; those that are not given are read from the config """
+    def option(name, value, default, convert=int):
+        if value is not None:
+            return value
+        if config is not None and config.get(name):
+            return convert(config[name])
+        return default
+
+    options = {
+        'mode': option('server-mode', mode, 'simple', str),
+        'workers': option('server-workers', workers, 0),
+        'threads': option('server-threads', threads, 8),
+        'keepalive': option('server-keepalive', None, 5, float),
+        'graceful_timeout': option('server-graceful-timeout', None, 30, float),
+    }
+    if options['mode'] not in MODES:
+        raise ValueError('Unknown server mode ' + repr(options['mode']))
+    return options
+
+
+def main(argv):
+    try:
+        opts, args = getopt(argv, '', ['port=', 'host=', 'mode=', 'workers=', 'threads='])
+    except GetoptError as err:
+        print(str(err))
+        return 2
+    host = 'localhost'
+    port = 9999
+    overrides = {}
+    for o, a in opts:
+        if o == '--port':
+            port = int(a)
+        elif o == '--host':
+            host = a
+        elif o == '--mode':
+            overrides['mode'] = a
+        else:
+            overrides[o[2:]] = int(a)
+
+    # the service's own messages, such as the template warm-up time, go to stderr
+    logging.basicConfig(level=logging.INFO)
+    warm_up()
+
+    def ready(listening_port):
+        print('Listening on port %s' % listening_port)
+
+    run_server(application, host, port, ready=ready, **server_options(**overrides))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,12 +1,30 @@
 # -*- coding: utf-8 -*-
 
+import math
+import multiprocessing
 import os.path
+import threading
+from contextlib import contextmanager
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
 from template import Template
 from uuid import uuid4
-from .validation_utils import validate_template_params, validate_template_util_config, _format_errors
+from . import json_codec
+from .concurrency_utils import gevent_patched
+from .template_cache import CachingProvider, CompiledTemplateStore, TemplateCache
+from .template_stream import can_stream, process_to_file
+from .validation_utils import (validate_template_batch_params, validate_template_params,
+                               validate_template_util_config, _format_errors)
 
 """ Class for rendering from a template """
 
+# lists of at least this many templates are rendered on the process pool
+MIN_PARALLEL_RENDERS = 16
+
+# the TemplateUtil used by a render pool worker process; see _render_chunk
+_worker_templater = None
+
 
 class TemplateUtil:
 
@@ -16,24 +34,124 @@ class TemplateUtil:
         # config should have keys 'template_toolkit' and 'scratch'
         validated_config = validate_template_util_config(config)
         self.config = validated_config
-        self._template = None
+        # Template Toolkit engines are not thread-safe, so each render takes an engine from this
+        # pool for itself; there are only ever as many engines as renders that ran at once
+        self._engines = []
+        self._engines_lock = threading.Lock()
+        # compiled templates, shared by every engine this TemplateUtil creates
+        self.template_cache = TemplateCache(
+            int(validated_config.get('template-cache-entries', 256)),
+            int(validated_config.get('template-cache-bytes', 64 * 1024 * 1024)))
+        # compiled templates that persist between processes (optional)
+        self.template_store = None
+        if validated_config.get('template-store-dir'):
+            self.template_store = CompiledTemplateStore(validated_config['template-store-dir'])
+        # whether rendered files can be written as the output is produced; see template_stream
+        self._stream_output = can_stream(self._engine_config())
+        # processes for rendering long lists of templates; 0 means one per CPU
+        self.render_processes = (int(validated_config.get('template-render-processes', 0))
+                                 or os.cpu_count() or 1)
+        self._render_pool = None
+        # requests on different threads must not each start a pool
+        self._render_pool_lock = threading.Lock()
+
+    def template_engine(self, tt_config=None):
+        """ Create a template engine, which shares compiled templates with this TemplateUtil
+
+        :param tt_config:   (dict)  Template Toolkit configuration (optional; defaults to the
+                                    'template_toolkit' config)
 
-    def template_engine(self):
-        if not self._template:
-            self._init_template_engine()
-
-        return self._template
+        :return:
+        a Template, for the caller's use only
 
-    def _init_template_engine(self, tt_config=None):
+        """
+        uc_tt_config = self._engine_config(tt_config)
+        uc_tt_config['LOAD_TEMPLATES'] = [
+            CachingProvider(uc_tt_config, self.template_cache, self.template_store)]
+        return Template(uc_tt_config)
 
+    def _engine_config(self, tt_config=None):
         if not tt_config:
             tt_config = self.config['template_toolkit']
 
         # TTP requires the config keys be uppercase
-        uc_tt_config = {key.upper(): value for key, value in tt_config.items()}
-        self._template = Template(uc_tt_config)
+        return {key.upper(): value for key, value in tt_config.items()}
+
+    @contextmanager
+    def _engine(self):
+        """ Take an engine from the pool, or create one, and put it back when done """
+        with self._engines_lock:
+            engine = self._engines.pop() if self._engines else None
+        if engine is None:
+            engine = self.template_engine()
+        try:
+            yield engine
+        finally:
+            with self._engines_lock:
+                self._engines.append(engine)
+
+    def precompile_templates(self, template_dir, extensions=('.tt',)):
+        """ Compile every template file under a directory ahead of time
+
+        Compiled templates go into the in-memory cache and, if 'template-store-dir' is set in
+        the config, into the persistent store, so that later processes can skip compilation.
+
+        :param template_dir:    (string)  directory to search for template files
+        :param extensions:      (tuple)   file extensions of the templates to compile
+
+        :return:
+        list of the paths of the compiled template files
 
-        return self._template
+        """
+        compiled = []
+        provider = CachingProvider(self._engine_config(), self.template_cache, self.template_store)
+        for (root, dirs, files) in os.walk(template_dir):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(extensions):
+                    path = os.path.join(root, name)
+                    provider.precompile(path)
+                    compiled.append(path)
+        return compiled
+
+    def warm_up(self, extensions=('.tt',)):
+        """ Get ready for the first render: create a template engine for the pool, and compile
+        every template file in the INCLUDE_PATH directories
+
+        Templates are compiled under the names that renders fetch them by, relative to their
+        INCLUDE_PATH directory, so that renders find them in the cache. A template that fails to
+        compile is skipped; rendering it raises the error as usual.
+
+        :param extensions:      (tuple)   file extensions of the templates to compile
+
+        :return:
+        dict with keys 'compiled', a list of the template names compiled, and 'failed', a dict
+        of template name to error message
+
+        """
+        with self._engine():
+            pass
+        provider = CachingProvider(self._engine_config(), self.template_cache, self.template_store)
+        compiled = []
+        failed = {}
+        # a name that is in more than one directory is fetched from the first, as in a render
+        seen = set()
+        for include_dir in provider.paths():
+            for (root, dirs, files) in os.walk(include_dir):
+                dirs.sort()
+                for name in sorted(files):
+                    if not name.endswith(extensions):
+                        continue
+                    template_name = os.path.relpath(os.path.join(root, name), include_dir)
+                    if template_name in seen:
+                        continue
+                    seen.add(template_name)
+                    try:
+                        provider.fetch(template_name)
+                        compiled.append(template_name)
+                    except Exception as err:
+                        failed[template_name] = str(err)
+        return {'compiled': compiled, 'failed': failed}
 
     def render_template_to_direct_html(self, params):
         """ Render a template and save the resulting content as the 'direct_html' key in 'params'
@@ -54,14 +172,26 @@ class TemplateUtil:
         if 'template' not in params:
             raise KeyError(_format_errors({'template': ['required field']}, params))
 
-        validated_params = validate_template_params(params['template'], self.config)
-        template_string = self._render_template(validated_params['template_file'],
-                                                validated_params['template_data'],)
-
-        params['direct_html'] = template_string
+        params['direct_html'] = self.render_template_to_string(params['template'])
         del params['template']
         return params
 
+    def render_template_to_string(self, params):
+        """ Render a template and return the resulting content, without writing any files
+
+        :param params:  (dict)  dict with keys
+
+            template_file:      # the template file to render
+            template_data_json: # data to be rendered in the template (optional)
+
+        :return:
+        the rendered template (string)
+
+        """
+        validated_params = validate_template_params(params, self.config, config_validated=True)
+        return self._render_template(validated_params['template_file'],
+                                     validated_params['template_data'],)
+
     def render_template_list_to_files(self, param_list):
         """ Render a list of templates, saving the contents to the specified output files
 
@@ -76,19 +206,88 @@ class TemplateUtil:
 
         """
 
-        # check for any identical output_file paths
+        # check for any identical output_file paths, however they are written
         output_file_set = set()
         for p in param_list:
             if 'output_file' in p:
-                if p['output_file'] in output_file_set:
+                output_file = os.path.normpath(p['output_file'])
+                if output_file in output_file_set:
                     raise ValueError(_format_errors(
                             {'output_file': ['output_file paths must be unique']},
                             param_list
                         ))
                 else:
-                    output_file_set.add(p['output_file'])
+                    output_file_set.add(output_file)
+
+        # worker processes are not used under gevent, whose patched threads and pipes the
+        # process pool does not work with
+        if (self.render_processes > 1 and len(param_list) >= MIN_PARALLEL_RENDERS
+                and not gevent_patched()):
+            rendered = self._render_on_pool(param_list)
+        else:
+            rendered = _render_list_to_temp_files(self, param_list)
+
+        # every template has rendered, so the outputs can be moved into place
+        return [_move_into_place(temp_file, output_file) for (temp_file, output_file) in rendered]
+
+    def render_template_batch(self, params):
+        """ Render one template once for each of a list of data records ("mail merge")
+
+        The template is compiled once and the records are rendered in a streaming loop;
+        records from a records_file are read one line at a time.
+
+        :param params:  (dict)  dict with keys
 
-        return [self.render_template_to_file(_) for _ in param_list]
+            template_file:          # the template file to render
+            output_file_pattern:    # output path pattern; '{index}' is replaced by the
+                                    # position of the record and '{key}' by record[key]
+            records_json:           # JSON list of data records, or
+            records_file:           # path to a file with one JSON record per line (NDJSON)
+
+        :return:
+        [{ 'path': '/path/to/output_file' }, { 'path': '/path/to_file_2' }, ... ]
+
+        """
+        validated_params = validate_template_batch_params(params, self.config,
+                                                          config_validated=True)
+        if 'records' in validated_params:
+            records = validated_params['records']
+        else:
+            records = _read_records_file(validated_params['records_file'], params)
+
+        pattern = validated_params['output_file_pattern']
+        scratch_dir = os.path.join(os.path.normpath(self.config['scratch']), '')
+        rendered = []
+        output_file_set = set()
+        # the compiled template belongs to this engine, so every record is rendered with it
+        with self._engine() as engine:
+            engine.context().reset()
+            document = engine.context().template(validated_params['template_file'])
+            try:
+                for (index, record) in enumerate(records):
+                    # normalized, so that different spellings of a path are seen to be the same
+                    output_file = os.path.normpath(
+                        _format_output_file(pattern, index, record, params))
+                    if not output_file.startswith(scratch_dir):
+                        raise ValueError(_format_errors(
+                            {'output_file_pattern': [output_file +
+                                                     ' is not in the scratch directory']},
+                            params))
+                    if output_file in output_file_set:
+                        raise ValueError(_format_errors(
+                            {'output_file_pattern': ['output_file paths must be unique']},
+                            params))
+                    output_file_set.add(output_file)
+
+                    rendered.append(_write_temp_file(
+                        partial(self._render_template_to_stream, document, record, engine=engine),
+                        output_file))
+            except Exception:
+                _remove_temp_files(rendered)
+                raise
+
+        # every record has rendered, so the outputs can be moved into place
+        return [_move_into_place(temp_file, output_file) for (temp_file, output_file) in rendered]
 
     def render_template_to_file(self, params):
         """ Render a template and save the resulting content to a file
@@ -104,20 +303,7 @@ class TemplateUtil:
 
         """
 
-        validated_params = validate_template_params(params, self.config, with_output_file=True)
-        template_string = self._render_template(validated_params['template_file'],
-                                                validated_params['template_data'],)
-
-        output_file = validated_params['output_file']
-        # ensure any subdirs are created
-        dir_path = os.path.dirname(output_file)
-        if not os.path.isdir(dir_path):
-            os.makedirs(dir_path)
-
-        with open(output_file, 'w') as f:
-            f.write(template_string)
-
-        return {'path': output_file}
+        return _move_into_place(*self._render_to_temp_file(params))
 
     def render_template_to_scratch_file(self, params):
         """ Render a template and save the resulting content to a scratch file
@@ -128,6 +314,72 @@ class TemplateUtil:
         params['output_file'] = os.path.join(self.config['scratch'], str(uuid4()) + '.txt')
         return self.render_template_to_file(params)
 
+    def _render_to_temp_file(self, params):
+        """ Render a template to a temporary file next to the output_file
+
+        :param params:  (dict)  as for render_template_to_file
+
+        :return:
+        tuple of (temporary file path, output_file path)
+
+        """
+        validated_params = validate_template_params(params, self.config, with_output_file=True,
+                                                    config_validated=True)
+        write = partial(self._render_template_to_stream, validated_params['template_file'],
+                        validated_params['template_data'])
+        return _write_temp_file(write, validated_params['output_file'])
+
+    def _render_on_pool(self, param_list):
+        """ Render a list of templates to temporary files on the process pool
+
+        The list is split into chunks, which are rendered by worker processes with their own
+        template engines. If any template fails, the chunks that have not started are
+        cancelled, the other temporary files are removed, and the error from the earliest
+        failed chunk is raised.
+
+        :return:
+        list of (temporary file path, output_file path) tuples, in the same order as param_list
+
+        """
+        with self._render_pool_lock:
+            if self._render_pool is None:
+                # the server handles requests on several threads, any of which may hold a lock
+                # when this runs; a forked worker would inherit the lock held, and could wait on
+                # it forever. Workers are started by a forkserver process, which has no other
+                # threads.
+                self._render_pool = ProcessPoolExecutor(
+                    self.render_processes, mp_context=multiprocessing.get_context('forkserver'))
+            pool = self._render_pool
+        chunk_size = math.ceil(len(param_list) / (self.render_processes * 4))
+        futures = [
+            pool.submit(_render_chunk, self.config, param_list[i:i + chunk_size])
+            for i in range(0, len(param_list), chunk_size)
+        ]
+        (_, not_done) = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in not_done:
+            future.cancel()
+        # let the running chunks finish, so that their temporary files can be removed
+        wait(futures)
+
+        rendered = []
+        error = None
+        for future in futures:
+            if future.cancelled():
+                continue
+            if future.exception() is not None:
+                error = error or future.exception()
+            else:
+                rendered.extend(future.result())
+        if error is not None:
+            if isinstance(error, BrokenProcessPool):
+                with self._render_pool_lock:
+                    # another request may already have replaced it
+                    if self._render_pool is pool:
+                        self._render_pool = None
+            _remove_temp_files(rendered)
+            raise error
+        return rendered
+
     def _render_template(self, template_file, template_data={}, template_config=None):
         """ Render template_name using template_data
 
@@ -139,10 +391,119 @@ class TemplateUtil:
         template_string (string)   the rendered template
 
         """
-        if template_config and template_config.items() > 0:
-            self._init_template_engine(template_config)
+        if template_config:
+            # an engine with its own config is used once rather than pooled
+            return self.template_engine(template_config).process(template_file, template_data)
 
-        # raises a TemplateException if there is an issue anywhere
-        template_string = self.template_engine().process(template_file, template_data)
+        with self._engine() as engine:
+            # raises a TemplateException if there is an issue anywhere
+            template_string = engine.process(template_file, template_data)
 
         return template_string
+
+    def _render_template_to_stream(self, template, template_data, fileobj, engine=None):
+        """ Render a template, writing the output to fileobj as it is produced
+
+        Output is only streamed if the Template Toolkit config allows it; otherwise the rendered
+        template is written in one piece.
+
+        :param template:        (string or Document)  the template file, or a compiled template
+        :param template_data:   (dict)    data to be rendered in the template
+        :param fileobj:         (file)    text file object to write to
+        :param engine:          (Template)  engine to render with (optional; by default one is
+                                            taken from the pool)
+
+        """
+        if engine is None:
+            with self._engine() as engine:
+                return self._render_template_to_stream(template, template_data, fileobj, engine)
+
+        if self._stream_output:
+            process_to_file(engine, template, template_data, fileobj)
+        else:
+            fileobj.write(engine.process(template, template_data))
+
+
+def _render_list_to_temp_files(templater, param_list):
+    """ Render a list of templates in turn; on error, remove the files rendered so far """
+    rendered = []
+    try:
+        for params in param_list:
+            rendered.append(templater._render_to_temp_file(params))
+    except Exception:
+        _remove_temp_files(rendered)
+        raise
+    return rendered
+
+
+def _render_chunk(config, param_list):
+    """ Render a chunk of a template list in a pool worker process """
+    global _worker_templater
+    if _worker_templater is None:
+        _worker_templater = TemplateUtil(config)
+    return _render_list_to_temp_files(_worker_templater, param_list)
+
+
+def _read_records_file(records_file, params):
+    """ Yield the data records in an NDJSON file, one line at a time """
+    with open(records_file) as f:
+        for (line_number, line) in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json_codec.loads(line)
+            except ValueError as err:
+                raise TypeError(_format_errors(
+                    {'records_file': ['Invalid JSON on line ' + str(line_number) + ': ' +
+                                      str(err)]}, params))
+            if not isinstance(record, dict):
+                raise TypeError(_format_errors(
+                    {'records_file': ['line ' + str(line_number) + ' is not a JSON object']},
+                    params))
+            yield record
+
+
+def _format_output_file(pattern, index, record, params):
+    """ Fill in the output_file_pattern for a record """
+    try:
+        return pattern.format(**dict(record, index=index))
+    except (KeyError, IndexError, ValueError) as err:
+        raise ValueError(_format_errors(
+            {'output_file_pattern': ['cannot be filled in for record ' + str(index) + ': ' +
+                                     repr(err)]}, params))
+
+
+def _write_temp_file(write, output_file):
+    """ Write rendered output to a temporary file next to output_file
+
+    :param write:       (callable)  writes the rendered output to the file object it is given
+    :param output_file: (string)    path of the output file
+
+    :return:
+    tuple of (temporary file path, output_file path)
+
+    """
+    # ensure any subdirs are created
+    dir_path = os.path.dirname(output_file)
+    os.makedirs(dir_path, exist_ok=True)
+
+    temp_file = os.path.join(dir_path, '.' + os.path.basename(output_file) + '.' +
+                             str(uuid4()) + '.tmp')
+    try:
+        with open(temp_file, 'w') as f:
+            write(f)
+    except Exception:
+        _remove_temp_files([(temp_file, output_file)])
+        raise
+    return (temp_file, output_file)
+
+
+def _move_into_place(temp_file, output_file):
+    os.replace(temp_file, output_file)
+    return {'path': output_file}
+
+
+def _remove_temp_files(rendered):
+    for (temp_file, _) in rendered:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import itertools
+
+"""
+Bounded representations of params, for error messages and logs
+Report params can hold very large values: tens of MB of direct_html or template_data_json, or
+thousands of objects_created and file_links. Printing all of them in an error message costs
+far more than the validation that failed, and floods the logs. `bounded` makes a copy that
+keeps the shape of the params but cuts long strings and long lists and dicts short, and stops
+after a fixed number of values, so its cost does not depend on the size of the params.
+"""
+
+# characters kept from a long string
+MAX_STRING_CHARS = 500
+# items kept from a long list, or keys from a long dict
+MAX_ITEMS = 20
+# values kept in all, at any depth; later values are elided
+MAX_VALUES = 1000
+
+
+class _Elided:
+    """ Stands in for the part of a value that was left out; printed as its description """
+
+    def __init__(self, description):
+        self.description = description
+
+    def __repr__(self):
+        return '<' + self.description + '>'
+
+
+class _Truncated:
+    """ The start of a long string or bytes value """
+
+    def __init__(self, head, omitted):
+        self.head = head
+        self.omitted = omitted
+
+    def __repr__(self):
+        return repr(self.head) + ' <+' + str(self.omitted) + ' characters>'
+
+
+def bounded(value, max_string_chars=MAX_STRING_CHARS, max_items=MAX_ITEMS,
+            max_values=MAX_VALUES):
+    """
+    Make a copy of a JSON-like value that is small enough to print
+    :param value: value to copy; dicts, lists, tuples and sets are copied, strings and bytes
+                  longer than max_string_chars are cut short, and anything else is kept as is
+    :param max_string_chars: characters (or bytes) kept from a string
+    :param max_items: items kept from a list, tuple or set, or keys from a dict
+    :param max_values: values kept in all
+    :return: the copy, which pprint prints with markers where values were left out
+    """
+    budget = [max_values]
+    return _bounded(value, budget, max_string_chars, max_items)
+
+
+def _bounded(value, budget, max_chars, max_items):
+    budget[0] -= 1
+    if budget[0] < 0:
+        return _Elided('...')
+    if isinstance(value, (str, bytes)):
+        if len(value) > max_chars:
+            return _Truncated(value[:max_chars], len(value) - max_chars)
+        return value
+    if isinstance(value, dict):
+        copy = {}
+        for (key, item) in itertools.islice(value.items(), max_items):
+            copy[_bounded(key, [1], max_chars, max_items)] = _bounded(item, budget, max_chars,
+                                                                      max_items)
+        if len(value) > max_items:
+            copy[_Elided(str(len(value) - max_items) + ' more keys')] = _Elided('...')
+        return copy
+    if isinstance(value, (list, tuple, set, frozenset)):
+        copy = [_bounded(item, budget, max_chars, max_items)
+                for item in itertools.islice(value, max_items)]
+        if len(value) > max_items:
+            copy.append(_Elided(str(len(value) - max_items) + ' more items'))
+        return type(value)(copy) if isinstance(value, tuple) else copy
+    return value
+
+
+class LazyMessage:
+    """
+    Exception message that is only built when it is first printed, and then kept
+    It prints, and pickles, as the message string.
+    """
+
+    def __init__(self, build, *args):
+        self._build = build
+        self._args = args
+        self._message = None
+
+    def __str__(self):
+        if self._message is None:
+            self._message = self._build(*self._args)
+            self._build = self._args = None
+        return self._message
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __reduce__(self):
+        return (str, (str(self),))
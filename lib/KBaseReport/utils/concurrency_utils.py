@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import queue
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import Future, FIRST_EXCEPTION, wait
+
+""" Utilities for running report creation tasks concurrently """
+
+
+# A stage of a pipeline for run_pipeline
+#   fn - function from an item to the input for the next stage or, if batch_size is set, from a
+#       list of up to batch_size items to a list with one output per item
+#   workers - number of threads running the stage
+#   batch_size - maximum number of items to pass to fn at once (optional)
+#   discard - called with each item dropped from the stage's input after a failure (optional)
+Stage = namedtuple('Stage', ['fn', 'workers', 'batch_size', 'discard'])
+Stage.__new__.__defaults__ = (1, None, None)
+
+# end of input marker for a pipeline stage
+_DONE = object()
+
+
+def run_pipeline(items, stages, queue_size=2):
+    """
+    Pass items through a sequence of stages, each run by its own worker threads, so that the
+    stages work on different items at the same time
+    :param items: iterable of inputs to the first stage
+    :param stages: list of Stage tuples
+    :param queue_size: number of items per worker that can wait for a stage, or a full batch
+        if that is more; a stage that gets this far ahead of the next one blocks until it
+        catches up
+    :return: list of outputs from the last stage, in the same order as `items`
+
+    Batched stages are given whatever items are waiting when a worker becomes free, so they
+    never wait for a batch to fill. If any stage raises, the items still in the pipeline are
+    discarded and the first exception is re-raised once every worker has stopped.
+    """
+    inboxes = [queue.Queue(max(queue_size * stage.workers, stage.batch_size or 0))
+               for stage in stages]
+    running = [stage.workers for stage in stages]
+    results = {}
+    errors = []
+    failed = threading.Event()
+    lock = threading.Lock()
+
+    def take_batch(inbox, batch_size):
+        """ Get the next item, then as many waiting items as fit in the batch """
+        batch = [inbox.get()]
+        while batch[-1] is not _DONE and len(batch) < (batch_size or 1):
+            try:
+                batch.append(inbox.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def work(k):
+        stage = stages[k]
+        try:
+            finished = False
+            while not finished:
+                batch = take_batch(inboxes[k], stage.batch_size)
+                if batch[-1] is _DONE:
+                    finished = True
+                    batch.pop()
+                if not batch:
+                    continue
+                if failed.is_set():
+                    if stage.discard is not None:
+                        for (_, item) in batch:
+                            stage.discard(item)
+                    continue
+                try:
+                    if stage.batch_size:
+                        outputs = stage.fn([item for (_, item) in batch])
+                    else:
+                        outputs = [stage.fn(batch[0][1])]
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+                    failed.set()
+                    continue
+                for ((index, _), output) in zip(batch, outputs):
+                    if k + 1 < len(stages):
+                        inboxes[k + 1].put((index, output))
+                    else:
+                        results[index] = output
+        finally:
+            with lock:
+                running[k] -= 1
+                last_worker = running[k] == 0
+            if last_worker and k + 1 < len(stages):
+                for _ in range(stages[k + 1].workers):
+                    inboxes[k + 1].put(_DONE)
+
+    threads = [threading.Thread(target=work, args=(k,), daemon=True)
+               for (k, stage) in enumerate(stages) for _ in range(stage.workers)]
+    for thread in threads:
+        thread.start()
+    count = 0
+    try:
+        for item in items:
+            if failed.is_set():
+                break
+            inboxes[0].put((count, item))
+            count += 1
+    finally:
+        for _ in range(stages[0].workers):
+            inboxes[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return [results[index] for index in range(count)]
+
+
+def gevent_patched():
+    """
+    Whether gevent has patched the threading module, as the server does when
+    gevent_monkeypatch_all is set in the config
+    Threads are then greenlets, which only switch when they wait for the network or sleep.
+    """
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+def run_blocking(fn, *args):
+    """
+    Call fn(*args), which does local work that blocks, such as reading, hashing or zipping files
+    Under gevent the call runs on the hub's pool of native threads, so that the other greenlets
+    keep running while it waits on the disk; otherwise it runs on the calling thread.
+    :return: the return value of fn
+    """
+    if gevent_patched():
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+
+def wait_all(values):
+    """
+    Wait for every Future in a list of values; other values are passed through unchanged
+    :param values: list of Futures and plain values
+    :return: list of results, in the same order as `values`
+
+    If any Future fails, the others are cancelled and the exception from the earliest failed
+    Future in the list is re-raised.
+    """
+    futures = [value for value in values if isinstance(value, Future)]
+    done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+    failed = [f for f in futures
+              if f in done and not f.cancelled() and f.exception() is not None]
+    if failed:
+        for future in not_done:
+            future.cancel()
+        raise failed[0].exception()
+
+    return [value.result() if isinstance(value, Future) else value for value in values]
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Fast validity checks compiled from the cerberus schemas in validation_utils
+The schemas mirror the KIDL types in KBaseReport.spec. Each one is compiled into straight-line
+Python that answers a single question: would cerberus accept this document? A check only
+returns True when it is sure of that; anything unusual - a failed rule, a value that is not a
+plain JSON type, None where a custom validator would run - gives False, and the document is
+then validated by cerberus, which produces the error messages. Checks hold no state and can be
+shared between threads.
+"""
+
+# cerberus rules that the compiler understands; schemas using any other rule are rejected
+SUPPORTED_RULES = frozenset([
+    'type', 'required', 'nullable', 'minlength', 'min', 'excludes', 'dependencies',
+    'validator', 'check_with', 'schema',
+])
+# custom validator rules; cerberus renames 'validator' to 'check_with' when it expands a schema
+_VALIDATOR_RULES = ('validator', 'check_with')
+
+# types accepted by the checks: the JSON types that cerberus accepts for each rule
+_TYPES = {
+    'string': 'str',
+    'integer': 'int',
+    'dict': 'dict',
+    'list': 'list',
+}
+
+
+def compile_check(schema, allow_unknown=False, purge_unknown=False):
+    """
+    Compile a cerberus schema into a function that checks documents against it
+    :param schema: cerberus schema (dict of field -> rules), using only SUPPORTED_RULES
+    :param allow_unknown: as the cerberus Validator option
+    :param purge_unknown: as the cerberus Validator option; unknown fields are ignored
+    :return: function taking a document and returning True if cerberus would accept it
+    """
+    compiler = _CheckCompiler()
+    name = compiler.mapping(schema, allow_unknown or purge_unknown)
+    source = '\n'.join(compiler.lines)
+    namespace = dict(compiler.constants, _run_validator=_run_validator)
+    exec(compile(source, '<compiled cerberus schema>', 'exec'), namespace)
+    check = namespace[name]
+    check.source = source
+    check.fields = frozenset(schema)
+    return check
+
+
+def _run_validator(validator, field, value):
+    """ Run a cerberus custom validator; True if it reports no errors """
+    errors = []
+    try:
+        validator(field, value, lambda *args: errors.append(args))
+    except Exception:
+        # let cerberus deal with it
+        return False
+    return not errors
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+class _CheckCompiler:
+    """ Writes the source code for the check functions of a schema and its nested schemas """
+
+    def __init__(self):
+        self.lines = []
+        self.constants = {}
+        self.functions = 0
+
+    def function_name(self):
+        self.functions += 1
+        return '_check%d' % self.functions
+
+    def constant(self, value):
+        """ Make a value available to the generated code; returns its name """
+        name = '_const%d' % len(self.constants)
+        self.constants[name] = value
+        return name
+
+    def mapping(self, schema, allow_unknown):
+        """ Write a function checking a mapping against a schema; returns its name """
+        unsupported = set(rule for rules in schema.values() for rule in rules) - SUPPORTED_RULES
+        if unsupported:
+            raise ValueError('Cannot compile cerberus rules: ' + ', '.join(sorted(unsupported)))
+
+        name = self.function_name()
+        body = [
+            'def %s(document):' % name,
+            '    if not isinstance(document, dict):',
+            '        return False',
+        ]
+        if not allow_unknown:
+            body += [
+                '    for field in document:',
+                '        if field not in %s:' % self.constant(frozenset(schema)),
+                '            return False',
+            ]
+        body += self.required(schema)
+        for (field, rules) in schema.items():
+            body += [
+                '    if %r in document:' % field,
+                '        value = document[%r]' % field,
+            ]
+            body += ['        ' + line for line in self.field(field, rules, allow_unknown)]
+        body.append('    return True')
+
+        # nested checks have been written by now, so they are defined before this one
+        self.lines += body + ['']
+        return name
+
+    def required(self, schema):
+        """ Lines checking that required fields are present """
+        lines = []
+        for (field, rules) in schema.items():
+            if not rules.get('required'):
+                continue
+            # a required field can be left out if a required field that excludes it is given
+            alternatives = [other for (other, other_rules) in schema.items()
+                            if other_rules.get('required')
+                            and field in _as_list(other_rules.get('excludes'))]
+            if not alternatives and not rules.get('excludes'):
+                lines += [
+                    '    if %r not in document:' % field,
+                    '        return False',
+                ]
+            else:
+                # cerberus then wants one of the group to have a value
+                lines += [
+                    '    if document.get(%r) is None and all(document.get(other) is None '
+                    'for other in %r):' % (field, tuple(alternatives)),
+                    '        return False',
+                ]
+        return lines
+
+    def field(self, field, rules, allow_unknown):
+        """ Lines checking `value`, the value of a field that is in the document """
+        lines = ['if value is None:']
+        if not rules.get('nullable'):
+            lines.append('    return False')
+        else:
+            lines += ['    ' + line for line in self.relations(rules)]
+            if any(rule in rules for rule in _VALIDATOR_RULES):
+                # cerberus runs custom validators on None; leave that to cerberus
+                lines.append('    return False')
+            lines.append('    pass')
+
+        lines.append('else:')
+        body = []
+        if 'type' in rules:
+            if rules['type'] not in _TYPES:
+                raise ValueError('Cannot compile cerberus type: ' + repr(rules['type']))
+            body += [
+                'if not isinstance(value, %s):' % _TYPES[rules['type']],
+                '    return False',
+            ]
+        if 'minlength' in rules:
+            body += [
+                'if not isinstance(value, (str, list)) or len(value) < %d:' % rules['minlength'],
+                '    return False',
+            ]
+        if 'min' in rules:
+            body += [
+                'if not isinstance(value, (int, float)) or value < %r:' % rules['min'],
+                '    return False',
+            ]
+        body += self.relations(rules)
+        for rule in _VALIDATOR_RULES:
+            if rule in rules:
+                body += [
+                    'if not _run_validator(%s, %r, value):' % (self.constant(rules[rule]), field),
+                    '    return False',
+                ]
+        if 'schema' in rules:
+            body += self.nested(rules, allow_unknown)
+        lines += ['    ' + line for line in body or ['pass']]
+        return lines
+
+    def item(self, rules, allow_unknown):
+        """ Write a function checking a list item against a rules set; returns its name """
+        unsupported = (set(rules) - SUPPORTED_RULES) | (set(rules) & {'excludes', 'dependencies',
+                                                                       'required'})
+        if unsupported:
+            raise ValueError('Cannot compile cerberus rules for list items: ' +
+                             ', '.join(sorted(unsupported)))
+        name = self.function_name()
+        body = ['def %s(value):' % name]
+        body += ['    ' + line for line in self.field('item', rules, allow_unknown)]
+        body.append('    return True')
+        self.lines += body + ['']
+        return name
+
+    def relations(self, rules):
+        """ Lines checking the excludes and dependencies of a field """
+        lines = []
+        excluded = _as_list(rules.get('excludes'))
+        if excluded:
+            lines += [
+                'if %s:' % ' or '.join('%r in document' % other for other in excluded),
+                '    return False',
+            ]
+        for dependency in _as_list(rules.get('dependencies')):
+            lines += [
+                'if %r not in document:' % dependency,
+                '    return False',
+            ]
+        return lines
+
+    def nested(self, rules, allow_unknown):
+        """ Lines checking a value against the schema rule of its field """
+        schema = rules['schema']
+        if rules.get('type') == 'list':
+            # the schema is the rules set for every item
+            return [
+                'for item in value:',
+                '    if not %s(item):' % self.item(schema, allow_unknown),
+                '        return False',
+            ]
+        if rules.get('type') == 'dict':
+            return [
+                'if not %s(value):' % self.mapping(schema, allow_unknown),
+                '    return False',
+            ]
+        raise ValueError('Cannot compile a schema rule for type ' + repr(rules.get('type')))
@@ -1,13 +1,118 @@
 # -*- coding: utf-8 -*-
+import copy
 import os
 import shutil
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import partial
 from uuid import uuid4
+from installed_clients.baseclient import ServerError
+from .concurrency_utils import Stage, run_blocking, run_pipeline, wait_all
+from .upload_cache import file_sha256
+from .zip_utils import pack_entries, walk_directory
 
 """
 Utilities for fetching/uploading files
 We use an instance of DataFileUtil here
+Local file work - writing, hashing and zipping - goes through run_blocking, so that under gevent
+it does not hold up the other requests; DataFileUtil calls already yield on the network.
 """
 
+# maximum number of local files to upload in one file_to_shock_mass job
+UPLOAD_BATCH_SIZE = 100
+# number of file_to_shock_mass jobs to run at the same time; while one job uploads, the next
+# batch of files is packed
+UPLOAD_JOBS = 2
+# rendered templates up to this many bytes, encoded as UTF-8, are kept in memory until they are
+# packed; larger ones are written straight to a file. Set by 'render-spill-bytes' in the config.
+RENDER_SPILL_BYTES = 16 * 1024 * 1024
+
+
+def fetch_or_upload_links(dfu, file_links, html_links, templater, max_workers=1,
+                          upload_cache=None):
+    """
+    Fetch by shock ID or upload all of the `file_links` and `html_links` for an extended report
+    Plain files in `file_links`, which need no rendering or packing, are uploaded together in one
+    job. Other local links go through a pipeline - render templates, pack archives, upload - in
+    which each stage works on different links at the same time, alongside that job. Up to
+    `max_workers` links are packed at once; the links that are ready when an upload job starts are
+    uploaded together in that job.
+    :param dfu: DataFileUtil client instance
+    :param file_links: list of file dictionaries for the `file_links` parameter
+    :param html_links: list of file dictionaries for the `html_links` parameter
+    :param templater: TemplateUtil instance
+    :param max_workers: maximum number of links to pack concurrently
+    :param upload_cache: UploadCache instance (optional); large files in `file_links` whose
+        contents have been uploaded before are re-used rather than uploaded again
+    :return: tuple of (file links, html links); each is a list of file dictionaries that can be
+        uploaded to the workspace for the report, in the same order as the input
+    """
+    # Archives are written under scratch, which DataFileUtil can also read
+    work_dir = os.path.join(templater.config['scratch'], str(uuid4()))
+
+    links = []
+    for (link_type, files) in [('file_links', file_links), ('html_links', html_links)]:
+        for each_file in files:
+            link = {
+                'file': each_file,
+                'html': link_type == 'html_links',
+                # Large files are looked up in the upload cache individually
+                'cached': (upload_cache is not None and link_type == 'file_links'
+                           and 'path' in each_file and upload_cache.accepts(each_file['path'])),
+            }
+            link['direct'] = (link_type == 'file_links' and 'path' in each_file
+                              and not link['cached'] and not os.path.isdir(each_file['path']))
+            links.append(link)
+
+    direct_links = [link for link in links if link['direct']]
+    direct_shocks = []
+    try:
+        with _async_client(dfu) as async_dfu:
+            try:
+                # Having a 'shock_id' means it is already uploaded. These jobs run in the
+                # background, tracked by one polling thread.
+                for link in links:
+                    if 'shock_id' in link['file']:
+                        link['shock'] = async_dfu.own_shock_node({
+                            'shock_id': link['file']['shock_id'], 'make_handle': 1
+                        })
+                # file_to_shock_mass returns results in the same order as its input
+                if direct_links:
+                    direct_shocks = async_dfu.file_to_shock_mass([
+                        {'file_path': link['file']['path'], 'make_handle': 1}
+                        for link in direct_links
+                    ])
+
+                spill_bytes = int(templater.config.get('render-spill-bytes', RENDER_SPILL_BYTES))
+                stages = [
+                    # rendering is CPU-bound, so one worker is enough
+                    Stage(partial(_render_link, templater, spill_bytes, work_dir)),
+                    Stage(partial(_pack_link, dfu, upload_cache, work_dir), max(1, max_workers)),
+                    Stage(partial(_upload_links, dfu), UPLOAD_JOBS, UPLOAD_BATCH_SIZE,
+                          discard=_discard_link),
+                ]
+                local_links = [link for link in links
+                               if 'shock' not in link and not link['direct']]
+                for (link, shock) in zip(local_links, run_pipeline(local_links, stages)):
+                    link['shock'] = shock
+                for (link, shock) in zip(direct_links, wait_all([direct_shocks])[0]):
+                    link['shock'] = shock
+                shocks = wait_all([link['shock'] for link in links])
+            except BaseException:
+                # stop polling for the jobs of a failed report, so that closing the
+                # multiplexer does not wait for them
+                _cancel_futures([direct_shocks] + [link.get('shock') for link in links])
+                raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if upload_cache is not None and any(link['cached'] for link in links):
+            run_blocking(upload_cache.save)
+
+    return (
+        [_create_file_link(f, shock) for (f, shock) in zip(file_links, shocks)],
+        [_create_file_link(f, shock) for (f, shock) in zip(html_links, shocks[len(file_links):])],
+    )
+
 
 def fetch_or_upload_file_links(dfu, files, templater):
     """
@@ -18,24 +123,7 @@ def fetch_or_upload_file_links(dfu, files, templater):
     :param files: list of file dictionaries (having the File type from the KIDL spec)
     :return: list of file dictionaries that that can be uploaded to the workspace for the report
     """
-    out_files = []
-    for each_file in files:
-        if 'template' in each_file:
-            each_file = _render_template_add_path(templater, each_file)
-
-        if 'path' in each_file:
-            # Only zip if the path is a directory
-            isdir = os.path.isdir(each_file['path'])
-            shock = dfu.file_to_shock({
-                'file_path': each_file['path'],
-                'make_handle': 1,
-                'pack': 'zip' if isdir else None
-            })
-        elif 'shock_id' in each_file:
-            # Having a 'shock_id' means it is already uploaded
-            shock = dfu.own_shock_node({'shock_id': each_file['shock_id'], 'make_handle': 1})
-        out_files.append(_create_file_link(each_file, shock))
-    return out_files
+    return fetch_or_upload_links(dfu, files, [], templater)[0]
 
 
 def fetch_or_upload_html_links(dfu, files, templater):
@@ -47,41 +135,155 @@ def fetch_or_upload_html_links(dfu, files, templater):
     :param files: list of file dictionaries (having the File type from the KIDL spec)
     :return: list of file dictionaries that that can be uploaded to the workspace for the report
     """
-    out_files = []
-    for each_file in files:
-        if 'template' in each_file:
-            each_file = _render_template_add_path(templater, each_file)
-
-        if 'path' in each_file:
-            # Having a 'path' key means we have to upload to shock
-            if os.path.isfile(each_file['path']):
-                # If it is not a directory, we have to move it into one before zipping
-                new_dir = os.path.join(os.path.dirname(each_file['path']), str(uuid4()))
-                os.makedirs(new_dir)
-                os.chmod(new_dir, 0o775)
-                # Move the file to dir/name
-                new_path = os.path.join(new_dir, each_file['name'])
-                shutil.copy2(each_file['path'], new_path)
-                each_file['path'] = new_dir
-            shock = dfu.file_to_shock({
-                'file_path': each_file['path'],
-                'make_handle': 1,
-                'pack': 'zip'  # Always zip for HTML
-            })
-
-        elif 'shock_id' in each_file:
-            # Having a 'shock_id' means it is already uploaded
-            shock = dfu.own_shock_node({'shock_id': each_file['shock_id'], 'make_handle': 1})
-        out_files.append(_create_file_link(each_file, shock))
-    return out_files
-
-
-def _render_template_add_path(templater, file_data):
-    # render the template to a temporary file and set the 'path' attribute
-    rendered_file = templater.render_template_to_scratch_file(file_data['template'])
-    file_data['path'] = rendered_file['path']
-    del file_data['template']
-    return file_data
+    return fetch_or_upload_links(dfu, [], files, templater)[1]
+
+
+def _render_link(templater, spill_bytes, work_dir, link):
+    """
+    Pipeline stage: render the template for a link, if it has one
+    The output is encoded and kept in memory as link['content'], unless it is larger than
+    spill_bytes; then it is written to a file in work_dir, which becomes the link's path.
+    """
+    file_data = link['file']
+    if 'template' in file_data:
+        content = templater.render_template_to_string(file_data.pop('template')).encode('utf-8')
+        if len(content) > spill_bytes:
+            file_data['path'] = run_blocking(_write_rendered_file, content, work_dir)
+        else:
+            link['content'] = content
+    return link
+
+
+def _pack_link(dfu, upload_cache, work_dir, link):
+    """
+    Pipeline stage: get a link ready to upload
+    Cached files are resolved here, as hashing them is local work.
+    """
+    file_data = link['file']
+    content = link.pop('content', None)
+    if link['cached']:
+        link['shock'] = _upload_cached_file(dfu, upload_cache, file_data)
+    # Always zip for HTML; file_links are only zipped if the path is a directory
+    elif link['html'] or (content is None and os.path.isdir(file_data['path'])):
+        link['archive'] = run_blocking(_zip_link, file_data, work_dir, content)
+    elif content is not None:
+        # DataFileUtil uploads from the shared filesystem, so unzipped files must be on disk
+        file_data['path'] = run_blocking(_write_rendered_file, content, work_dir)
+    return link
+
+
+def _upload_links(dfu, links):
+    """ Pipeline stage: upload a batch of links in one DFU job """
+    uploads = [link for link in links if 'shock' not in link]
+    try:
+        if uploads:
+            # file_to_shock_mass returns results in the same order as its input
+            shocks = dfu.file_to_shock_mass([
+                {'file_path': link['archive'][0] if 'archive' in link else link['file']['path'],
+                 'make_handle': 1}
+                for link in uploads
+            ])
+            for (link, shock) in zip(uploads, shocks):
+                if 'archive' in link:
+                    _check_md5(shock, link['archive'][1])
+                link['shock'] = shock
+    finally:
+        for link in uploads:
+            _discard_link(link)
+    return [link['shock'] for link in links]
+
+
+def _discard_link(link):
+    """ Remove the archive for a link, if it has one """
+    if 'archive' in link:
+        shutil.rmtree(os.path.dirname(link['archive'][0]), ignore_errors=True)
+
+
+def _zip_link(file_data, work_dir, content=None):
+    """
+    Zip the file or directory for a link into a new subdirectory of work_dir
+    A directory is zipped under its own name; a single file, or the rendered content of a
+    template, goes straight into the archive under the link's 'name'
+    :param content: rendered template (bytes) to pack instead of the link's path
+    :return: tuple of (zip file path, hex MD5 of the zip file)
+    """
+    if content is not None:
+        entries = [(content, file_data['name'])]
+        zip_name = os.path.splitext(file_data['name'])[0] + '.zip'
+    elif os.path.isfile(file_data['path']):
+        entries = [(file_data['path'], file_data['name'])]
+        zip_name = os.path.splitext(file_data['name'])[0] + '.zip'
+    else:
+        entries = walk_directory(file_data['path'])
+        zip_name = os.path.basename(os.path.normpath(file_data['path'])) + '.zip'
+    zip_dir = os.path.join(work_dir, str(uuid4()))
+    os.makedirs(zip_dir)
+    zip_path = os.path.join(zip_dir, zip_name)
+    return (zip_path, pack_entries(entries, zip_path))
+
+
+def _check_md5(shock, md5):
+    """ Make sure that shock received the same bytes that were packed """
+    remote_md5 = shock['handle'].get('remote_md5')
+    if remote_md5 and remote_md5 != md5:
+        raise ValueError(f"MD5 mismatch for uploaded archive {shock['handle'].get('file_name')}: "
+                         f"expected {md5}, shock has {remote_md5}")
+
+
+def _upload_cached_file(dfu, upload_cache, file_data):
+    """ Re-use the shock node for a previous upload of the same contents, or upload the file """
+    digest = run_blocking(file_sha256, file_data['path'])
+    cached = upload_cache.get(digest)
+    if cached is not None:
+        try:
+            return dfu.own_shock_node({'shock_id': cached['shock_id'], 'make_handle': 1})
+        except ServerError:
+            # the node has been deleted or is no longer readable; upload the file again
+            upload_cache.discard(digest)
+
+    shock = dfu.file_to_shock({'file_path': file_data['path'], 'make_handle': 1})
+    upload_cache.add(digest, shock)
+    return shock
+
+
+def _cancel_futures(values):
+    """ Cancel the Futures in a list of values; the jobs behind them keep running """
+    for value in values:
+        if isinstance(value, Future):
+            value.cancel()
+
+
+@contextmanager
+def _async_client(client):
+    """
+    Yield a copy of an SDK client whose methods submit their jobs through a JobMultiplexer and
+    return futures; the multiplexer is closed on exit
+    Clients without a BaseClient to multiplex, such as test doubles, are yielded unchanged.
+    """
+    base_client = getattr(client, '_client', None)
+    if not hasattr(base_client, 'job_multiplexer'):
+        yield client
+        return
+    with base_client.job_multiplexer() as multiplexer:
+        async_client = copy.copy(client)
+        async_client._client = multiplexer
+        yield async_client
+
+
+def _write_rendered_file(content, work_dir):
+    """
+    Write a rendered template (string or bytes) to a new file in work_dir
+    :return: path of the file
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, str(uuid4()) + '.txt')
+    if isinstance(content, bytes):
+        with open(path, 'wb') as f:
+            f.write(content)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+    return path
 
 
 def _create_file_link(file_data, shock):
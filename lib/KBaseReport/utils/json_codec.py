@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+JSON encoding and decoding for the server, the SDK clients and parameter validation
+The standard library json module is used unless a faster backend is installed and selected.
+Anything the fast backend rejects is handed to json, so every document is decoded to the same
+value, and every error is the same JSONDecodeError, whichever backend is in use. Encoded output
+is equivalent JSON, but not byte for byte the same: orjson writes compact UTF-8, and writes NaN
+and infinities as null.
+Documents with a run of 19 or more digits are always decoded by json: orjson decodes integers
+outside the 64-bit range as floats instead of rejecting them.
+"""
+import json
+import re
+
+# backends in order of preference; 'json' is always available
+BACKENDS = ('orjson', 'json')
+
+
+# a number this long may be an integer outside the 64-bit range. Digits inside strings match
+# too, which only costs a slower decode
+_LONG_NUMBER = re.compile(r'[0-9]{19}')
+_LONG_NUMBER_BYTES = re.compile(rb'[0-9]{19}')
+
+
+def _load_orjson():
+    import orjson
+
+    def loads(s):
+        long_number = _LONG_NUMBER if isinstance(s, str) else _LONG_NUMBER_BYTES
+        if long_number.search(s):
+            return json.loads(s)
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # NaN, lone surrogates or a real error: json decides
+            return json.loads(s)
+
+    def dumps(obj, default=None):
+        try:
+            return orjson.dumps(obj, default=default).decode('utf-8')
+        except orjson.JSONEncodeError:
+            # non-string keys, integers over 64 bits, or a real error: json decides
+            return json.dumps(obj, default=default)
+
+    return (loads, dumps)
+
+
+def _load_json():
+    def dumps(obj, default=None):
+        return json.dumps(obj, default=default)
+
+    return (json.loads, dumps)
+
+
+_LOADERS = {
+    'orjson': _load_orjson,
+    'json': _load_json,
+}
+
+_backend = 'json'
+(_loads, _dumps) = _load_json()
+
+
+def available_backends():
+    """ Names of the backends that can be used here, in order of preference """
+    available = []
+    for name in BACKENDS:
+        try:
+            _LOADERS[name]()
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+def use_backend(name='auto'):
+    """
+    Select the JSON backend used by loads and dumps
+    :param name: one of BACKENDS, or 'auto' for the first available one
+    :return: name of the backend in use
+    """
+    global _backend, _loads, _dumps
+    if name == 'auto':
+        name = available_backends()[0]
+    if name not in _LOADERS:
+        raise ValueError('Unknown JSON backend ' + repr(name) + '; use one of ' +
+                         ', '.join(BACKENDS) + ' or auto')
+    (_loads, _dumps) = _LOADERS[name]()
+    _backend = name
+    return name
+
+
+def backend():
+    """ Name of the backend in use """
+    return _backend
+
+
+def loads(s):
+    """ Decode a JSON document (str or bytes) """
+    return _loads(s)
+
+
+def dumps(obj, default=None):
+    """
+    Encode obj as a JSON string
+    :param default: function returning a serializable version of an object that cannot otherwise
+                    be serialized, as for json.dumps
+    """
+    return _dumps(obj, default=default)
+
+
+use_backend()
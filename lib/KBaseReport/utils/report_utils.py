@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
-from .file_utils import fetch_or_upload_file_links, fetch_or_upload_html_links
+from .file_utils import fetch_or_upload_links
+from concurrent.futures import ThreadPoolExecutor
 import time as _time
 from installed_clients.baseclient import ServerError as _DFUError
 from uuid import uuid4
@@ -7,15 +8,16 @@ from uuid import uuid4
 """ Utilities for creating reports using DataFileUtil """
 
 
-def create_report(params, dfu):
+def create_report(params, dfu, workspace_ids=None):
     """
     Create a simple report
     :param params: see the KIDL spec for the create() parameters
     :param dfu: instance of DataFileUtil
+    :param workspace_ids: instance of WorkspaceIdCache (optional)
     :return: report data
     """
     report_name = "report_" + str(uuid4())
-    workspace_id = _get_workspace_id(dfu, params)
+    workspace_id = _get_workspace_id(dfu, params, workspace_ids)
     # Empty defaults for merging
     report_data = {
         'objects_created': [],
@@ -37,18 +39,28 @@ def create_report(params, dfu):
     return {'ref': ref, 'name': report_name}
 
 
-def create_extended(params, dfu, templater):
+def create_extended(params, dfu, templater, max_workers=1, upload_cache=None,
+                    workspace_ids=None):
     """
     Create an extended report
     This will upload files to shock if you provide scratch paths instead of shock_ids
     :param params: see the KIDL spec for create_extended_report() parameters
     :param dfu: instance of DataFileUtil
+    :param templater: instance of TemplateUtil
+    :param max_workers: maximum number of links to zip or hash at the same time
+    :param upload_cache: instance of UploadCache (optional)
+    :param workspace_ids: instance of WorkspaceIdCache (optional)
     :return: uploaded report data - {'ref': r, 'name': n}
     """
     file_links = params.get('file_links', [])
     html_links = params.get('html_links', [])
-    files = fetch_or_upload_file_links(dfu, file_links, templater)  # see ./file_utils.py
-    html_files = fetch_or_upload_html_links(dfu, html_links, templater)
+    # The workspace ID is looked up while the files are uploading
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        workspace_id = executor.submit(_get_workspace_id, dfu, params, workspace_ids)
+        # see ./file_utils.py
+        (files, html_files) = fetch_or_upload_links(dfu, file_links, html_links, templater,
+                                                    max_workers, upload_cache)
+        workspace_id = workspace_id.result()
     report_data = {
         'text_message': params.get('message'),
         'file_links': files,
@@ -61,7 +73,6 @@ def create_extended(params, dfu, templater):
         'summary_window_height': params.get('summary_window_height')
     }
     report_name = params.get('report_object_name', 'report_' + str(uuid4()))
-    workspace_id = _get_workspace_id(dfu, params)
     save_object_params = {
         'id': workspace_id,
         'objects': [{
@@ -77,14 +88,17 @@ def create_extended(params, dfu, templater):
     return {'ref': ref, 'name': report_name}
 
 
-def _get_workspace_id(dfu, params):
+def _get_workspace_id(dfu, params, workspace_ids=None):
     """
     Get the workspace ID from the params, which may either have 'workspace_id'
     or 'workspace_name'. Workspace ID is immutable so should take precedence.
+    Names are resolved through `workspace_ids`, a WorkspaceIdCache, if given.
     """
     if 'workspace_id' in params:
         return params.get('workspace_id')
 
+    if workspace_ids is not None:
+        return workspace_ids.get_id(dfu, params['workspace_name'])
     return dfu.ws_name_to_id(params['workspace_name'])
 
 
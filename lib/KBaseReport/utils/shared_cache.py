@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import threading
+import time
+
+from . import json_codec
+
+"""
+Cache shared by the processes of a server, stored in a local SQLite file
+Under uwsgi each worker process has its own in-process caches (auth tokens, workspace IDs,
+uploaded files), so every worker pays for its own cold misses. A SharedCache is a second level
+for those caches: a value one worker looked up is found by the others.
+Each update is a single SQLite transaction, so readers never see half an update and concurrent
+writers cannot push a namespace over its size limits. The file is opened in WAL mode, so reads
+do not wait for writes, and reads go through a memory map. Errors from SQLite, such as a lock
+that is held too long, are treated as misses: the caller falls back to looking the value up.
+"""
+
+# bytes of the database file to memory-map for reads
+MMAP_SIZE = 64 * 1024 * 1024
+# entries are marked as used at most this often, in seconds, to avoid a write for every read
+TOUCH_INTERVAL = 1.0
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS entries (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        expires REAL,
+        used REAL NOT NULL,
+        PRIMARY KEY (namespace, key)
+    )""",
+    'CREATE INDEX IF NOT EXISTS entries_used ON entries (namespace, used)',
+    """CREATE TABLE IF NOT EXISTS namespaces (
+        namespace TEXT PRIMARY KEY,
+        entries INTEGER NOT NULL,
+        bytes INTEGER NOT NULL
+    )""",
+]
+
+
+class SharedCache:
+    """
+    Key -> JSON value store in a SQLite file, divided into namespaces with their own limits
+    """
+
+    def __init__(self, path, timeout=1.0, clock=time.time):
+        """
+        :param path: path to the database file; its directory is created if it does not exist
+        :param timeout: seconds to wait for another process's write before giving up
+        :param clock: function returning the current time in seconds, the same in all processes
+        """
+        self.path = path
+        self.timeout = timeout
+        self._clock = clock
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connection() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+
+    def namespace(self, name, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        """
+        Get a view of one namespace of the cache
+        :param name: namespace name, e.g. the name of the cache using it
+        :param max_entries: maximum number of entries; the least recently used are evicted
+        :param max_bytes: maximum total size of the encoded values
+        """
+        return SharedCacheNamespace(self, name, max_entries, max_bytes)
+
+    def _connection(self):
+        """ This thread's connection; connections are not shared by threads or processes """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # isolation_level=None: transactions are started explicitly
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA mmap_size=%d' % MMAP_SIZE)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _get(self, namespace, key):
+        conn = self._connection()
+        row = conn.execute('SELECT value, expires, used FROM entries '
+                           'WHERE namespace = ? AND key = ?', (namespace, key)).fetchone()
+        if row is None:
+            return None
+        (value, expires, used) = row
+        now = self._clock()
+        if expires is not None and expires <= now:
+            self._delete(namespace, key)
+            return None
+        if now - used > TOUCH_INTERVAL:
+            conn.execute('UPDATE entries SET used = ? WHERE namespace = ? AND key = ?',
+                         (now, namespace, key))
+        return json_codec.loads(value)
+
+    def _set(self, namespace, key, value, ttl, max_entries, max_bytes):
+        encoded = json_codec.dumps(value)
+        now = self._clock()
+        expires = None if ttl is None else now + ttl
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            old = conn.execute('SELECT length(value) FROM entries WHERE namespace = ? AND key = ?',
+                               (namespace, key)).fetchone()
+            conn.execute('INSERT OR REPLACE INTO entries (namespace, key, value, expires, used) '
+                         'VALUES (?, ?, ?, ?, ?)', (namespace, key, encoded, expires, now))
+            (added, added_bytes) = (1, len(encoded)) if old is None else (0, len(encoded) - old[0])
+            conn.execute('INSERT OR IGNORE INTO namespaces (namespace, entries, bytes) '
+                         'VALUES (?, 0, 0)', (namespace,))
+            conn.execute('UPDATE namespaces SET entries = entries + ?, bytes = bytes + ? '
+                         'WHERE namespace = ?', (added, added_bytes, namespace))
+            self._evict(conn, namespace, max_entries, max_bytes)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _evict(self, conn, namespace, max_entries, max_bytes):
+        """ Remove least recently used entries until the namespace is within its limits """
+        while True:
+            (entries, total_bytes) = conn.execute(
+                'SELECT entries, bytes FROM namespaces WHERE namespace = ?', (namespace,)
+            ).fetchone()
+            # always keep the entry that was just written
+            if entries <= 1 or (entries <= max_entries and total_bytes <= max_bytes):
+                return
+            rows = conn.execute('SELECT key, length(value) FROM entries WHERE namespace = ? '
+                                'ORDER BY used LIMIT ?',
+                                (namespace, max(1, entries - max_entries))).fetchall()
+            conn.executemany('DELETE FROM entries WHERE namespace = ? AND key = ?',
+                             [(namespace, key) for (key, _) in rows])
+            conn.execute('UPDATE namespaces SET entries = entries - ?, bytes = bytes - ? '
+                         'WHERE namespace = ?',
+                         (len(rows), sum(size for (_, size) in rows), namespace))
+
+    def _delete(self, namespace, key):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT length(value) FROM entries WHERE namespace = ? AND key = ?',
+                               (namespace, key)).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM entries WHERE namespace = ? AND key = ?',
+                             (namespace, key))
+                conn.execute('UPDATE namespaces SET entries = entries - 1, bytes = bytes - ? '
+                             'WHERE namespace = ?', (row[0], namespace))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _stats(self, namespace):
+        row = self._connection().execute('SELECT entries, bytes FROM namespaces '
+                                         'WHERE namespace = ?', (namespace,)).fetchone()
+        return {'entries': row[0] if row else 0, 'bytes': row[1] if row else 0}
+
+
+class SharedCacheNamespace:
+    """
+    One namespace of a SharedCache, with its size limits
+    Methods never raise SQLite errors: a failed get is a miss, and a failed set or delete is
+    skipped.
+    """
+
+    def __init__(self, cache, name, max_entries, max_bytes):
+        self.cache = cache
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        """ The value stored for key, or None if there is none or it has expired """
+        try:
+            return self.cache._get(self.name, key)
+        except sqlite3.Error:
+            return None
+
+    def set(self, key, value, ttl=None):
+        """
+        Store a value
+        :param value: value that can be encoded as JSON
+        :param ttl: number of seconds the value stays valid, or None to keep it until evicted
+        """
+        try:
+            self.cache._set(self.name, key, value, ttl, self.max_entries, self.max_bytes)
+        except sqlite3.Error:
+            pass
+
+    def delete(self, key):
+        try:
+            self.cache._delete(self.name, key)
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        """ Number of entries in the namespace and total size of their values """
+        return self.cache._stats(self.name)
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import io
+import marshal
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from importlib.util import MAGIC_NUMBER
+from uuid import uuid4
+from template.config import Config
+from template.document import Document, PYEVAL_NAMESPACE, write_python_doc
+from template.provider import Provider
+
+"""
+In-memory cache of compiled Template Toolkit templates
+Template Toolkit's own provider cache holds two templates by default, so a page that uses a
+wrapper and a few INCLUDEs is re-parsed on every render. INCLUDEd, PROCESSed and WRAPPER
+templates are fetched through the provider like any other template, so each of them gets its
+own cache entry; a change to an include only invalidates that include.
+Compiled templates can also be kept in a directory that outlives the process, so that a new
+process does not have to parse them again.
+"""
+
+
+class TemplateCache:
+    """
+    Thread-safe LRU cache of compiled templates, keyed by resolved file path and template name
+    Each entry records the mtime and size of its source file, and is only returned while they
+    still match. Entries are evicted least-recently-used first once there are more than
+    `max_entries` of them or their source files add up to more than `max_bytes`.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        """
+        :param max_entries: maximum number of compiled templates to keep
+        :param max_bytes: maximum total size of the source files of the cached templates
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # key -> (signature, compiled template, size in bytes)
+        self._entries = OrderedDict()
+
+    def get(self, key, signature):
+        """
+        Get a compiled template
+        :param key: cache key
+        :param signature: (mtime, size) of the template file now
+        :return: compiled template, or None if there is no entry or it is out of date
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != signature:
+                self.misses += 1
+                self.invalidations += 1
+                self._remove(key)
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, signature, document, size):
+        """ Store a compiled template for the file with the given signature and size """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (signature, document, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """ Remove all entries """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """ Hit, miss and eviction counts since this cache was created """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+    def _remove(self, key):
+        (_, _, size) = self._entries.pop(key)
+        self._bytes -= size
+
+
+def file_signature(path):
+    """
+    Get the signature used to tell whether a template file has changed
+    :return: tuple of (mtime in nanoseconds, size in bytes), or None if there is no such file
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class CompiledTemplateStore:
+    """
+    Directory of compiled templates that persists between processes
+    Templates are stored as marshalled Python code objects, so loading one needs neither a
+    Template Toolkit parse nor a Python compile. Each file records the Python bytecode version
+    and the sha256 of the template source, and is ignored if either has changed.
+    Loaded code is executed, so the directory must only be writable by trusted users.
+    """
+
+    def __init__(self, store_dir):
+        """
+        :param store_dir: directory for the compiled templates; created if it does not exist
+        """
+        self.store_dir = store_dir
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def load(self, key, source):
+        """
+        Get the compiled code for a template
+        :param key: string identifying the template file and parser options
+        :param source: template source, as bytes
+        :return: code object, or None if the store has no up-to-date code for the template
+        """
+        header = MAGIC_NUMBER + hashlib.sha256(source).digest()
+        try:
+            with open(self._path(key), 'rb') as f:
+                content = f.read()
+            code = marshal.loads(content[len(header):]) if content.startswith(header) else None
+        except (OSError, ValueError, EOFError, TypeError):
+            code = None
+        with self._lock:
+            if code is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return code
+
+    def save(self, key, source, code):
+        """
+        Store the compiled code for a template, replacing any previous version atomically
+        A store that cannot be written to is left as it is; templates are compiled as usual.
+        """
+        path = self._path(key)
+        tmp_path = path + '.' + str(uuid4())
+        try:
+            os.makedirs(self.store_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(MAGIC_NUMBER + hashlib.sha256(source).digest() + marshal.dumps(code))
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self._lock:
+            self.writes += 1
+
+    def stats(self):
+        """ Hit, miss and write counts since this store was created """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'writes': self.writes}
+
+    def _path(self, key):
+        file_name = hashlib.sha256(key.encode('utf-8')).hexdigest() + '.ttc'
+        return os.path.join(self.store_dir, file_name)
+
+
+class CachingProvider(Provider):
+    """
+    Template Toolkit provider that keeps compiled templates in a TemplateCache
+    The provider's own cache is disabled; the TemplateCache may be shared between providers.
+    Only templates in the INCLUDE_PATH directories go into the CompiledTemplateStore: others,
+    such as templates written to scratch for a single report, would fill it up.
+    """
+
+    def __init__(self, params, cache, store=None):
+        """
+        :param params: Template Toolkit configuration, with uppercase keys
+        :param cache: TemplateCache instance
+        :param store: CompiledTemplateStore instance (optional)
+        """
+        self._params = dict(params, CACHE_SIZE=0)
+        super().__init__(self._params)
+        self.cache = cache
+        self.template_store = store
+        self._store_dirs = tuple(os.path.join(os.path.abspath(d), '') for d in self.paths())
+        self._parser = params.get('PARSER')
+        # compiled templates depend on the parser options as well as the source file
+        self._config_key = repr(sorted((key, repr(value)) for (key, value) in params.items()))
+        # this provider's copies of the documents in the cache; see _own_copy
+        self._copies = weakref.WeakKeyDictionary()
+
+    def _fetch(self, name, t_name=None):
+        """ Fetch the compiled template for a file path, from the cache if it is up to date """
+        path = os.path.abspath(name)
+        signature = file_signature(path)
+        if signature is None:
+            # let Template Toolkit keep track of missing files
+            return super()._fetch(name, t_name)
+
+        # the name a template was requested by is compiled into it as `template.name`
+        key = (self._config_key, path, t_name or name)
+        document = self.cache.get(key, signature)
+        if document is None:
+            if self.template_store is None or not path.startswith(self._store_dirs):
+                document = super()._fetch(name, t_name)
+            else:
+                document = self._load_document(name, t_name)
+            if document is not None:
+                self.cache.put(key, signature, document, signature[1])
+        return None if document is None else self._own_copy(document)
+
+    def _own_copy(self, document):
+        """
+        This provider's copy of a document from the cache, sharing its compiled code
+        A Document marks itself while it is processed, to catch a template that includes itself;
+        with a copy for each provider, engines rendering at once do not see each other's marks.
+        """
+        copy = self._copies.get(document)
+        if copy is None:
+            copy = Document({
+                'METADATA': document._Document__meta,
+                'DEFBLOCKS': document.blocks(),
+                'BLOCK': document.block(),
+            })
+            self._copies[document] = copy
+        return copy
+
+    def precompile(self, path):
+        """
+        Compile a template file into the cache, if it is not there already
+        Files in the INCLUDE_PATH directories are also written to the store.
+        """
+        return self._fetch(path)
+
+    def _load_document(self, name, t_name=None):
+        """ Load a template file, using compiled code from the store if the source is unchanged """
+        data = self._load(name, t_name)
+        if data is None:
+            return super()._fetch(name, t_name)
+
+        key = self._config_key + ':' + os.path.abspath(name)
+        source = data.text.encode('utf-8')
+        code = self.template_store.load(key, source)
+        if code is None:
+            code = self._compile_code(data)
+            self.template_store.save(key, source, code)
+
+        namespace = PYEVAL_NAMESPACE.copy()
+        exec(code, namespace)
+        # stored code is shared by every name the file is requested by
+        metadata = dict(namespace['metadata'], name=data.name, modtime=data.time)
+        return Document({
+            'METADATA': metadata,
+            'DEFBLOCKS': namespace['blocks'],
+            'BLOCK': namespace['block'],
+        })
+
+    def _compile_code(self, data):
+        """ Parse a template and compile the resulting Python source """
+        if self._parser is None:
+            self._parser = Config.parser(self._params)
+        parsedoc = self._parser.parse(data.text, data)
+        source = io.StringIO()
+        write_python_doc(source, parsedoc['METADATA'], parsedoc.get('DEFBLOCKS', {}),
+                         parsedoc['BLOCK'])
+        return compile(source.getvalue(), data.path, 'exec')
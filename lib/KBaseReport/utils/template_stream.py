@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import types
+from template.document import Document
+from template.util import StringBuffer
+
+"""
+Streaming output for Template Toolkit
+A compiled template collects its output in a Buffer and returns it as one string, so a render
+normally holds the whole output in memory, more than once while it is joined and written.
+Here the main block of a template runs with a Buffer that writes straight to a file: output from
+the main template, including every iteration of a FOREACH, goes to the file as it is produced.
+The output of an INCLUDE, PROCESS, WRAPPER or FILTER directive is still built up in memory, one
+directive at a time, before it is written.
+"""
+
+# Template Toolkit options that process or replace output around the main template; the output
+# cannot be streamed when any of them is set
+_SERVICE_OPTIONS = ('PRE_PROCESS', 'POST_PROCESS', 'PROCESS', 'WRAPPER', 'ERROR', 'ERRORS', 'TRIM')
+
+
+def can_stream(tt_config):
+    """ Whether templates processed with a Template Toolkit config can stream their output """
+    return not any(tt_config.get(option) for option in _SERVICE_OPTIONS)
+
+
+def process_to_file(engine, template, data, fileobj):
+    """
+    Process a template, writing the output to a file as it is produced
+    A template that CLEARs its output cannot be streamed; it is processed again and its output
+    is written in one piece.
+    :param engine: template.Template instance, with a config for which can_stream is true
+    :param template: template name or compiled template (template.document.Document)
+    :param data: template variables (dict)
+    :param fileobj: text file object, open for writing
+    """
+    start = fileobj.tell()
+    # as Template.process does, so that BLOCKs from earlier templates are not found by name
+    engine.context().reset()
+    document = engine.context().template(template)
+    if not isinstance(document, Document):
+        fileobj.write(engine.process(document, data))
+        return
+    try:
+        remainder = engine.process(_streaming_document(document, fileobj), data)
+    except _RewindRequired:
+        fileobj.seek(start)
+        fileobj.truncate()
+        remainder = engine.process(document, data)
+    fileobj.write(remainder)
+
+
+class _RewindRequired(Exception):
+    """ Raised when a template tries to take back output that has already been written """
+
+
+class _StreamBuffer:
+    """ Buffer for the main block of a template, which writes straight to a file """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def write(self, *args):
+        for arg in args:
+            self._fileobj.write(str(arg))
+
+    def get(self):
+        # everything has been written already
+        return ''
+
+    def clear(self):
+        raise _RewindRequired()
+
+    def reset(self, *args):
+        raise _RewindRequired()
+
+    def __bool__(self):
+        # there is no buffered text for context.catch to attach to an error
+        return False
+
+
+def _streaming_document(document, fileobj):
+    """
+    Make a copy of a compiled template whose main block writes its output to fileobj
+    The generated code creates the Buffer for the main block before anything else, so the
+    first Buffer made is the one to stream; nested blocks get ordinary buffers.
+    """
+    block = document.block()
+    buffers = [_StreamBuffer(fileobj)]
+
+    def make_buffer():
+        return buffers.pop() if buffers else StringBuffer()
+
+    streaming_block = types.FunctionType(block.__code__,
+                                         dict(block.__globals__, Buffer=make_buffer),
+                                         block.__name__, block.__defaults__, block.__closure__)
+    return Document({
+        'METADATA': document._Document__meta,
+        'DEFBLOCKS': document.blocks(),
+        'BLOCK': streaming_block,
+    })
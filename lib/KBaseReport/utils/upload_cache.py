@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from uuid import uuid4
+
+"""
+Content-addressed index of files that have already been uploaded to shock
+Files with identical contents map to the same shock node, which can then be re-used via
+DataFileUtil.own_shock_node rather than being uploaded again
+"""
+
+# read files in chunks of this many bytes when hashing them
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def file_sha256(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Calculate the sha256 digest of a file without reading it all into memory
+    :param file_path: path to the file
+    :param chunk_size: number of bytes to hash at a time
+    :return: hex digest string
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        # empty files cannot be memory-mapped
+        if size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, chunk_size):
+                    digest.update(view[offset:offset + chunk_size])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """
+    Persistent sha256 -> shock node index, stored as a JSON file in a cache directory
+    Entries are evicted least-recently-used first once there are more than `max_entries`
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, cache_dir, max_entries=10000, min_file_size=1024 * 1024, shared=None):
+        """
+        :param cache_dir: directory for the index file; created if it does not exist
+        :param max_entries: maximum number of entries to keep in the index
+        :param min_file_size: files smaller than this are not worth caching; they are
+            cheaper to upload in a batch than to fetch individually
+        :param shared: SharedCacheNamespace (optional); entries are shared with other processes
+            as soon as they are added, rather than when the index is next loaded
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.min_file_size = min_file_size
+        self._shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._index_path = os.path.join(cache_dir, self.INDEX_FILE)
+        self._entries = self._load()
+
+    def accepts(self, file_path):
+        """ Whether the file at file_path should go through the cache """
+        return os.path.isfile(file_path) and os.path.getsize(file_path) >= self.min_file_size
+
+    def get(self, digest):
+        """
+        Look up the shock node for a content digest
+        :return: dict with keys 'shock_id' and 'handle', or None if there is no entry
+        """
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(digest)
+                return entry
+        entry = self._shared.get(digest) if self._shared is not None else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._put(digest, entry)
+            return entry
+
+    def add(self, digest, shock):
+        """
+        Record the shock node for a content digest
+        :param shock: output from DataFileUtil.file_to_shock or own_shock_node
+        """
+        entry = {'shock_id': shock['shock_id'], 'handle': shock['handle']}
+        if self._shared is not None:
+            self._shared.set(digest, entry)
+        with self._lock:
+            self._put(digest, entry)
+
+    def _put(self, digest, entry):
+        self._entries[digest] = entry
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, digest):
+        """ Remove a stale entry, e.g. one whose shock node no longer exists """
+        if self._shared is not None:
+            self._shared.delete(digest)
+        with self._lock:
+            self._entries.pop(digest, None)
+
+    def stats(self):
+        """ Hit and miss counts since this cache was created """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+    def save(self):
+        """ Write the index to disk, replacing the previous version atomically """
+        with self._lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self._index_path + '.' + str(uuid4())
+            with open(tmp_path, 'w') as f:
+                json.dump(list(self._entries.items()), f)
+            os.replace(tmp_path, self._index_path)
+
+    def _load(self):
+        """ Read the index from disk; a missing or unreadable index gives an empty cache """
+        try:
+            with open(self._index_path) as f:
+                return OrderedDict(json.load(f)[-self.max_entries:])
+        except (OSError, ValueError, TypeError):
+            return OrderedDict()
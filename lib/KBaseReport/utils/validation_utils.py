@@ -1,19 +1,139 @@
 # -*- coding: utf-8 -*-
 import os
+import threading
 from cerberus import Validator
+from . import json_codec
+from .bounded_repr import LazyMessage, bounded
+from .fast_validation import compile_check
 import pprint
 from json import JSONDecodeError
-import json
 
 """
 Utilities for validating parameters
 We use the `cerberus` schema validation library: http://docs.python-cerberus.org
+Creating a cerberus Validator checks and normalises its schema, which costs more than validating
+most inputs, so validators are created once and re-used. A Validator holds the state of the
+document it is validating, so each thread has its own.
+Before cerberus runs, params are checked by code compiled from the same schema (see
+fast_validation), which takes microseconds; cerberus only validates params that fail the
+compiled check, and so produces the same error messages as it always has.
+JSON strings in params are parsed once: valid_json hands what it parses back to the function
+validating the params, which passes it on with the validated params. Report params keep the
+parsed template data in each template, for validate_template_params when it is rendered.
 """
 
+# whether to try the compiled checks before cerberus
+USE_FAST_CHECKS = True
+
+_thread_validators = threading.local()
+# compiled checks hold no state, so they are shared between threads
+_fast_checks = {}
+
+# JSON parsed by valid_json during the validation running on this thread; see _validate
+_thread_parsed_json = threading.local()
+# key of the parsed template data in a template in report params. It is not a string, so it
+# cannot come from a JSON request, and it is not seen by the schemas.
+_TEMPLATE_DATA = object()
+
+
+def _validate(key, make_schema, params, parsed_json=None, **options):
+    """
+    Validate params against a schema, raising a TypeError with the cerberus errors if invalid
+    :param key: hashable key identifying the schema and options
+    :param make_schema: function returning the schema
+    :param params: (dict) input to be validated
+    :param parsed_json: (dict) filled in by valid_json with (string, value) for each JSON string
+                        it parses, keyed by id of the string (optional)
+    :param options: options for the Validator
+    :return: the validated document; unknown fields are removed if purge_unknown is set
+    """
+    _thread_parsed_json.values = parsed_json
+    try:
+        return _run_validation(key, make_schema, params, **options)
+    finally:
+        _thread_parsed_json.values = None
+
+
+def _run_validation(key, make_schema, params, **options):
+    if USE_FAST_CHECKS:
+        check = _fast_checks.get(key)
+        if check is None:
+            check = _fast_checks[key] = compile_check(make_schema(), **options)
+        if check(params):
+            if options.get('purge_unknown'):
+                return {field: value for (field, value) in params.items() if field in check.fields}
+            return dict(params)
+
+    validator = _get_validator(key, make_schema, **options)
+    if not validator.validate(params):
+        raise TypeError(_format_errors(validator.errors, params))
+    return validator.document
+
+
+def _get_validator(key, make_schema, **options):
+    """
+    Get this thread's validator for a schema, creating it on first use
+    :param key: hashable key identifying the schema and options
+    :param make_schema: function returning the schema; only called when creating the validator
+    :param options: options for the Validator
+    """
+    validators = _thread_validators.__dict__
+    validator = validators.get(key)
+    if validator is None:
+        validator = validators[key] = Validator(make_schema(), **options)
+    return validator
+
 
 def validate_simple_report_params(params):
     """ Validate all parameters to KBaseReportImpl#create """
-    validator = Validator({
+    _require_workspace_id_or_name(params)
+    parsed_json = {}
+    _validate('simple_report', _simple_report_schema, params, parsed_json)
+    if not parsed_json:
+        return params
+    report = dict(params['report'])
+    report['template'] = _with_template_data(report['template'], parsed_json)
+    return dict(params, report=report)
+
+
+def validate_extended_report_params(params):
+    """ Validate all parameters to KBaseReportImpl#create_extended_report """
+    _require_workspace_id_or_name(params)
+    _validate_html_index(params.get('html_links', []), params.get('direct_html_link_index'))
+
+    parsed_json = {}
+    _validate('extended_report', _extended_report_schema, params, parsed_json)
+    if not parsed_json:
+        return params
+    params = dict(params)
+    if 'template' in params:
+        params['template'] = _with_template_data(params['template'], parsed_json)
+    for link_type in ['file_links', 'html_links']:
+        if link_type in params:
+            params[link_type] = [
+                dict(link, template=_with_template_data(link['template'], parsed_json))
+                if 'template' in link else link
+                for link in params[link_type]
+            ]
+    return params
+
+
+def _with_template_data(template, parsed_json):
+    """
+    Copy of a template from report params, holding the template data parsed while validating
+    the params; the params passed in are not changed
+    """
+    string = template.get('template_data_json') if isinstance(template, dict) else None
+    entry = parsed_json.get(id(string))
+    if entry is None or entry[0] is not string:
+        return template
+    template = dict(template)
+    template[_TEMPLATE_DATA] = entry
+    return template
+
+
+def _simple_report_schema():
+    return {
         'workspace_name': {'type': 'string', 'minlength': 1},
         'workspace_id': {'type': 'integer', 'min': 0},
         'report': {
@@ -43,16 +163,11 @@ def validate_simple_report_params(params):
                 },
             }
         }
-    })
-    _require_workspace_id_or_name(params)
-    if not validator.validate(params):
-        raise TypeError(_format_errors(validator.errors, params))
-    return params
+    }
 
 
-def validate_extended_report_params(params):
-    """ Validate all parameters to KBaseReportImpl#create_extended_report """
-    validator = Validator({
+def _extended_report_schema():
+    return {
         'workspace_name': {'type': 'string', 'minlength': 1},
         'workspace_id': {'type': 'integer', 'min': 0},
         'message': {'type': 'string', 'nullable': True},
@@ -94,37 +209,49 @@ def validate_extended_report_params(params):
             'excludes': ['direct_html', 'direct_html_link_index'],
             'schema': template_schema,
         },
-    })
-    _require_workspace_id_or_name(params)
-    _validate_html_index(params.get('html_links', []), params.get('direct_html_link_index'))
-
-    if not validator.validate(params):
-        raise TypeError(_format_errors(validator.errors, params))
-    return params
+    }
 
 
-def validate_template_params(params, config, with_output_file=False):
+def validate_template_params(params, config, with_output_file=False, config_validated=False):
     """ Validate all parameters to KBaseReportImpl#render_template
 
     :param params:  (dict)  input to be validated
     :param config:  (dict)  app config
     :param with_output_file: (bool) whether or not the output_file param should be validated
+    :param config_validated: (bool) whether config has already been through
+                                    validate_template_util_config
 
     :return:
     params (dict) - validated params
     """
 
     # ensure that the supplied config has the required values
-    validated_config = validate_template_util_config(config)
+    validated_config = config if config_validated else validate_template_util_config(config)
 
     scratch_path = validated_config['scratch']
+    # template data parsed while validating report params, or by valid_json below
+    parsed_json = {}
+    if _TEMPLATE_DATA in params:
+        entry = params[_TEMPLATE_DATA]
+        parsed_json[id(entry[0])] = entry
+        params = {key: value for (key, value) in params.items() if key is not _TEMPLATE_DATA}
+    validated_params = _validate(('template', scratch_path, with_output_file),
+                                 lambda: _template_schema(scratch_path, with_output_file),
+                                 params, parsed_json, purge_unknown=True)
 
-    def path_contains_scratch(field, file_path, error):
-        if file_path.find(scratch_path) != 0:
-            error(field, 'is not in the scratch directory')
+    if 'template_data_json' in validated_params:
+        string = validated_params.pop('template_data_json')
+        entry = parsed_json.get(id(string))
+        # the entry holds its string, so the id cannot have been re-used by another one
+        validated_params['template_data'] = (entry[1] if entry is not None and entry[0] is string
+                                             else json_codec.loads(string))
+    else:
+        validated_params['template_data'] = {}
+
+    return validated_params
 
-    validator = Validator(purge_unknown=True)
 
+def _template_schema(scratch_path, with_output_file):
     tmpl_validation_schema = {
         'template_file': {
             'type': 'string',
@@ -142,23 +269,80 @@ def validate_template_params(params, config, with_output_file=False):
             'type': 'string',
             'minlength': len(scratch_path) + 2,
             'required': True,
-            'validator': path_contains_scratch,
+            'validator': _path_in_dir_validator(scratch_path),
         }
+    return tmpl_validation_schema
 
-    if not validator.validate(params, tmpl_validation_schema):
-        raise TypeError(_format_errors(validator.errors, params))
 
-    validated_params = validator.document
+def validate_template_batch_params(params, config, config_validated=False):
+    """ Validate all parameters to KBaseReportImpl#render_template_batch
 
-    if 'template_data_json' in validated_params:
-        validated_params['template_data'] = json.loads(validated_params['template_data_json'])
-        del validated_params['template_data_json']
-    else:
-        validated_params['template_data'] = {}
+    :param params:  (dict)  input to be validated
+    :param config:  (dict)  app config
+    :param config_validated: (bool) whether config has already been through
+                                    validate_template_util_config
+
+    :return:
+    params (dict) - validated params; records_json is parsed into the list 'records'
+    """
+
+    validated_config = config if config_validated else validate_template_util_config(config)
+
+    scratch_path = validated_config['scratch']
+    validated_params = _validate(('template_batch', scratch_path),
+                                 lambda: _template_batch_schema(scratch_path),
+                                 params, purge_unknown=True)
+
+    if 'records_json' in validated_params:
+        # parse the records here rather than in a cerberus validator, so they are only parsed once
+        try:
+            records = json_codec.loads(validated_params.pop('records_json'))
+        except JSONDecodeError as err:
+            raise TypeError(_format_errors(
+                {'records_json': ['Invalid JSON: ' + err.msg + ' ' + str(err.pos)]}, params))
+        if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+            raise TypeError(_format_errors(
+                {'records_json': ['must be a list of JSON objects']}, params))
+        validated_params['records'] = records
 
     return validated_params
 
 
+def _template_batch_schema(scratch_path):
+    return {
+        'template_file': {
+            'type': 'string',
+            'minlength': 3,
+            'required': True,
+        },
+        'output_file_pattern': {
+            'type': 'string',
+            'minlength': len(scratch_path) + 2,
+            'required': True,
+            'validator': _path_in_dir_validator(scratch_path),
+        },
+        'records_json': {
+            'type': 'string',
+            'required': True,
+            'excludes': 'records_file',
+        },
+        'records_file': {
+            'type': 'string',
+            'required': True,
+            'excludes': 'records_json',
+            'validator': valid_file_path,
+        },
+    }
+
+
+def _path_in_dir_validator(dir_path):
+    """ Make a cerberus validator that checks that a path is inside dir_path """
+    def path_contains_scratch(field, file_path, error):
+        if file_path.find(dir_path) != 0:
+            error(field, 'is not in the scratch directory')
+    return path_contains_scratch
+
+
 def validate_template_util_config(config):
     """ Ensure that TemplateUtil has the necessary config parameters
 
@@ -167,9 +351,12 @@ def validate_template_util_config(config):
     :return:
     params (dict) - validated params
     """
-    validator = Validator(allow_unknown=True)
+    return _validate('template_util_config', _template_util_config_schema, config,
+                     allow_unknown=True)
+
 
-    config_validation_schema = {
+def _template_util_config_schema():
+    return {
         'scratch': {
             'type': 'string',
             'minlength': 2,
@@ -181,10 +368,6 @@ def validate_template_util_config(config):
             'required': True,
         }
     }
-    if not validator.validate(config, config_validation_schema):
-        raise TypeError(_format_errors(validator.errors, config))
-
-    return validator.document
 
 
 def valid_dir_path(field, dir_path, error):
@@ -207,10 +390,20 @@ def valid_file_or_dir(field, path, error):
 
 
 def valid_json(field, string, error):
+    """ ensure a string is valid JSON; the result is passed to the caller of _validate """
+    parsed_json = getattr(_thread_parsed_json, 'values', None)
+    entry = None if parsed_json is None else parsed_json.get(id(string))
+    if entry is not None and entry[0] is string:
+        # already parsed, by the compiled check or while validating report params
+        return
     try:
-        json.loads(string)
+        value = json_codec.loads(string)
     except JSONDecodeError as err:
         error(field, 'Invalid JSON: ' + err.msg + ' ' + str(err.pos))
+        return
+    if parsed_json is not None:
+        # keep the string as well, so that its id is not re-used while the entry exists
+        parsed_json[id(string)] = (string, value)
 
 
 def _require_workspace_id_or_name(params):
@@ -263,7 +456,15 @@ pp = pprint.PrettyPrinter(indent=2, width=100)
 
 
 def _format_errors(errors, params):
-    """ Make human-readable error messages from a cerberus validation instance """
+    """
+    Make human-readable error messages from a cerberus validation instance
+    Large params are shown cut short (see bounded_repr); the bounded copies are made now, so
+    that the message shows the params as they were, but the text is built when it is printed.
+    """
+    return LazyMessage(_error_message, bounded(errors), bounded(params))
+
+
+def _error_message(errors, params):
     # Create a bulleted list of each cerberus error message
     return "".join([
         "KBaseReport parameter validation errors:\n",
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import OrderedDict
+
+"""
+In-process cache of workspace name -> workspace ID lookups
+Workspace names rarely change during a job, but a name can be freed by a rename or delete and
+taken by another workspace, so entries expire after a short TTL
+"""
+
+
+class WorkspaceIdCache:
+    """
+    Bounded, thread-safe TTL cache for DataFileUtil.ws_name_to_id
+    Entries are evicted least-recently-used first once there are more than `max_entries`
+    """
+
+    def __init__(self, max_entries=1000, ttl=300, clock=time.monotonic, shared=None):
+        """
+        :param max_entries: maximum number of workspace names to remember
+        :param ttl: number of seconds an entry stays valid
+        :param clock: function returning the current time in seconds
+        :param shared: SharedCacheNamespace (optional); lookups are shared with other processes
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._shared = shared
+        self._lock = threading.Lock()
+        # workspace name -> (workspace ID, expiry time)
+        self._entries = OrderedDict()
+
+    def get_id(self, dfu, workspace_name):
+        """
+        Get the ID of a workspace, looking it up with DataFileUtil if it is not cached
+        :param dfu: DataFileUtil client instance
+        :param workspace_name: workspace name
+        :return: integer workspace ID
+        """
+        with self._lock:
+            entry = self._entries.get(workspace_name)
+            if entry is not None and entry[1] > self._clock():
+                self.hits += 1
+                self._entries.move_to_end(workspace_name)
+                return entry[0]
+
+        # Look up outside the lock, so other workspaces are not held up by a slow job
+        shared = self._shared.get(workspace_name) if self._shared is not None else None
+        if shared is not None:
+            # another process looked it up; it expires here when it does there
+            (workspace_id, ttl) = (shared['id'], shared['expires'] - time.time())
+        else:
+            workspace_id = dfu.ws_name_to_id(workspace_name)
+            ttl = self.ttl
+            if self._shared is not None:
+                self._shared.set(workspace_name,
+                                 {'id': workspace_id, 'expires': time.time() + ttl}, ttl)
+        with self._lock:
+            if shared is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._entries[workspace_name] = (workspace_id, self._clock() + ttl)
+            self._entries.move_to_end(workspace_name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return workspace_id
+
+    def stats(self):
+        """ Hit and miss counts since this cache was created """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
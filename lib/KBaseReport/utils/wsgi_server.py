@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+import gc
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, WSGIServer, make_server
+
+"""
+Multi-threaded and prefork HTTP servers for the WSGI application, built on wsgiref
+wsgiref's own server handles one request at a time, so one long create_extended_report holds
+up every other caller. Here:
+  'simple'   - the wsgiref server, as before
+  'threaded' - requests are handled by a fixed pool of threads, with HTTP/1.1 keep-alive
+  'prefork'  - the application is loaded once, then several worker processes, each running the
+               threaded server, accept connections from the same socket. gc.freeze() before the
+               fork keeps the objects loaded by then out of garbage collection, so the workers
+               share their memory pages with the parent instead of copying them.
+SIGTERM and SIGINT shut the threaded and prefork servers down gracefully: they stop accepting
+connections and wait, up to a timeout, for the requests in progress.
+"""
+
+MODES = ('simple', 'threaded', 'prefork')
+
+
+class _ServerHandler(ServerHandler):
+    """ ServerHandler for HTTP/1.1 responses """
+
+    http_version = '1.1'
+
+    def close(self):
+        # the headers are cleared on closing
+        if self.headers is None or 'Content-Length' not in self.headers:
+            # the client can only tell where the response ends when the connection closes
+            self.request_handler.close_connection = True
+        super().close()
+
+
+class _KeepAliveRequestHandler(WSGIRequestHandler):
+    """ Request handler that serves requests on a connection until the client closes it """
+
+    protocol_version = 'HTTP/1.1'
+
+    def handle(self):
+        self.close_connection = True
+        self._handle_one_request()
+        while not self.close_connection and not self.server.stopping:
+            self._handle_one_request()
+
+    def _handle_one_request(self):
+        """ As WSGIRequestHandler.handle, but leaving the connection open if the client wants """
+        # wait no longer than the keep-alive timeout for a request, but as long as it takes to
+        # receive one once it has started
+        self.connection.settimeout(self.server.keepalive)
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            self.close_connection = True
+            return
+        finally:
+            self.connection.settimeout(None)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = True
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if not self.parse_request():
+            return
+
+        handler = _ServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+                                 multithread=True, multiprocess=self.server.multiprocess)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """
+    WSGI server that handles connections on a fixed pool of threads
+    A connection that is kept alive holds its thread until it has been idle for `keepalive`
+    seconds.
+    """
+
+    multiprocess = False
+
+    def __init__(self, server_address, threads=8, keepalive=5, bind_and_activate=True):
+        """
+        :param server_address: (host, port)
+        :param threads: number of requests to handle at once
+        :param keepalive: seconds to keep an idle connection open for another request
+        """
+        super().__init__(server_address, _KeepAliveRequestHandler, bind_and_activate)
+        self.threads = threads
+        self.keepalive = keepalive
+        self.stopping = False
+        self._connections = queue.Queue()
+        self._active = 0
+        self._idle = threading.Condition()
+        self._workers = []
+
+    def serve_forever(self, poll_interval=0.5):
+        # threads are started here rather than when the server is created, so that a prefork
+        # parent can create the server without starting threads that would not survive a fork
+        self._workers = [threading.Thread(target=self._work, name='wsgi-' + str(n), daemon=True)
+                         for n in range(self.threads)]
+        for worker in self._workers:
+            worker.start()
+        super().serve_forever(poll_interval)
+
+    def process_request(self, request, client_address):
+        with self._idle:
+            self._active += 1
+        self._connections.put((request, client_address))
+
+    def _work(self):
+        while True:
+            connection = self._connections.get()
+            if connection is None:
+                return
+            (request, client_address) = connection
+            # as ThreadingMixIn.process_request_thread
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self._idle:
+                    self._active -= 1
+                    self._idle.notify_all()
+
+    def stop(self, timeout=30):
+        """
+        Finish serving: stop accepting connections and wait for the ones in progress
+        Call after serve_forever has returned.
+        :param timeout: seconds to wait for requests in progress
+        :return: True if every request finished
+        """
+        self.stopping = True
+        self.server_close()
+        with self._idle:
+            finished = self._idle.wait_for(lambda: self._active == 0, timeout)
+        for _ in self._workers:
+            self._connections.put(None)
+        return finished
+
+
+def make_threaded_server(host, port, app, threads=8, keepalive=5):
+    """ Create a ThreadPoolWSGIServer for app """
+    server = ThreadPoolWSGIServer((host, port), threads, keepalive)
+    server.set_app(app)
+    return server
+
+
+def serve(server, graceful_timeout=30):
+    """
+    Run a server until SIGTERM or SIGINT, then shut it down gracefully
+    :param server: ThreadPoolWSGIServer, or a wsgiref server for the 'simple' mode
+    :param graceful_timeout: seconds to wait for requests in progress
+    """
+    if not isinstance(server, ThreadPoolWSGIServer):
+        server.serve_forever()
+        return
+
+    def shut_down(signum, frame):
+        # shutdown() waits for serve_forever to return, so it cannot be called on this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    previous = {sig: signal.signal(sig, shut_down) for sig in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        server.serve_forever()
+    finally:
+        for (sig, handler) in previous.items():
+            signal.signal(sig, handler)
+    if not server.stop(graceful_timeout):
+        print('Stopped with requests still in progress after ' + str(graceful_timeout) + 's',
+              file=sys.stderr)
+
+
+def serve_prefork(server, workers, graceful_timeout=30):
+    """
+    Serve from several worker processes, restarting any that die, until SIGTERM or SIGINT
+    :param server: ThreadPoolWSGIServer, bound and listening; each worker serves its socket
+    :param workers: number of worker processes; 0 for one per CPU
+    :param graceful_timeout: seconds for the workers to finish requests in progress
+    """
+    workers = workers or os.cpu_count() or 1
+    server.multiprocess = True
+    stopping = []
+    children = set()
+
+    def stop_workers(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            _kill(pid, signal.SIGTERM)
+
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            # a worker: undo the parent's handlers, serve, and never return to the caller
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                serve(server, graceful_timeout)
+            except BaseException:
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)
+        children.add(pid)
+
+    previous = {sig: signal.signal(sig, stop_workers) for sig in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        # everything loaded so far is shared with the workers; keep the collector from
+        # touching it, which would copy its memory pages into each worker
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        for _ in range(workers):
+            start_worker()
+        while children:
+            (pid, _) = os.wait()
+            children.discard(pid)
+            if not stopping:
+                # don't restart in a tight loop if workers die on startup
+                time.sleep(0.1)
+                start_worker()
+    finally:
+        for (sig, handler) in previous.items():
+            signal.signal(sig, handler)
+        server.server_close()
+
+
+def _kill(pid, sig):
+    try:
+        os.kill(pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def run_server(app, host, port, mode='simple', workers=0, threads=8, keepalive=5,
+               graceful_timeout=30, ready=None):
+    """
+    Serve app until interrupted
+    :param mode: one of MODES
+    :param workers: worker processes for the 'prefork' mode; 0 for one per CPU
+    :param threads: threads per process for the 'threaded' and 'prefork' modes
+    :param keepalive: seconds to keep an idle connection open
+    :param graceful_timeout: seconds to wait for requests in progress when shutting down
+    :param ready: function called with the port once the server is listening (optional)
+    """
+    if mode not in MODES:
+        raise ValueError('Unknown server mode ' + repr(mode) + '; use one of ' + ', '.join(MODES))
+    if mode == 'simple':
+        server = make_server(host, port, app)
+    else:
+        server = make_threaded_server(host, port, app, threads, keepalive)
+    if ready is not None:
+        ready(server.server_address[1])
+    if mode == 'prefork':
+        serve_prefork(server, workers, graceful_timeout)
+    else:
+        serve(server, graceful_timeout)
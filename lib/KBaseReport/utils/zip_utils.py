@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import shutil
+import time
+import zipfile
+
+"""
+Utilities for packing files into zip archives in a single streaming pass
+The archive is written sequentially through a non-seekable writer, so zipfile appends a data
+descriptor after each entry instead of seeking back to patch its header. This means that every
+byte is written exactly once and can be hashed on the way out.
+"""
+
+# copy file contents into the archive this many bytes at a time
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class _HashingWriter:
+    """ Write-only, non-seekable file wrapper that calculates the MD5 of everything written """
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._position = 0
+        self.md5 = hashlib.md5()
+
+    def write(self, data):
+        self.md5.update(data)
+        self._position += len(data)
+        return self._fileobj.write(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        self._fileobj.flush()
+
+
+def pack_directory(dir_path, zip_path):
+    """
+    Zip the contents of a directory; paths in the archive are relative to dir_path
+    :param dir_path: directory to pack
+    :param zip_path: path of the zip file to create
+    :return: hex MD5 digest of the zip file
+    """
+    return pack_entries(walk_directory(dir_path), zip_path)
+
+
+def pack_entries(entries, zip_path):
+    """
+    Zip a sequence of files, directories and in-memory contents
+    Memory use does not depend on file sizes; Zip64 extensions are used where needed.
+    :param entries: iterable of (path on disk, name in archive) tuples; in place of a path,
+        an entry may give the contents of a file as bytes
+    :param zip_path: path of the zip file to create
+    :return: hex MD5 digest of the zip file
+    """
+    with open(zip_path, 'wb') as f:
+        writer = _HashingWriter(f)
+        with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            for (path, arcname) in entries:
+                if isinstance(path, bytes):
+                    zinfo = zipfile.ZipInfo(arcname, time.localtime()[:6])
+                    zinfo.compress_type = zipfile.ZIP_DEFLATED
+                    zinfo.external_attr = 0o644 << 16
+                    archive.writestr(zinfo, path)
+                    continue
+                if os.path.isdir(path):
+                    archive.write(path, arcname)
+                    continue
+                zinfo = zipfile.ZipInfo.from_file(path, arcname)
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+                with open(path, 'rb') as src, archive.open(zinfo, 'w') as dest:
+                    shutil.copyfileobj(src, dest, COPY_CHUNK_SIZE)
+    return writer.md5.hexdigest()
+
+
+def walk_directory(dir_path):
+    """ Yield (path, arcname) for everything under dir_path, in a stable order """
+    for (root, dirs, files) in os.walk(dir_path):
+        dirs.sort()
+        for name in dirs + sorted(files):
+            path = os.path.join(root, name)
+            yield (path, os.path.relpath(path, dir_path))
@@ -26,7 +26,8 @@ class DataFileUtil(object):
             auth_svc='https://ci.kbase.us/services/auth/api/legacy/KBase/Sessions/Login',
             service_ver='release',
             async_job_check_time_ms=100, async_job_check_time_scale_percent=150, 
-            async_job_check_max_time_ms=300000):
+            async_job_check_max_time_ms=300000, http_pool_size=10, http_retries=3,
+            json_codec=None):
         if url is None:
             raise ValueError('A url is required')
         self._service_ver = service_ver
@@ -37,7 +38,9 @@ class DataFileUtil(object):
             auth_svc=auth_svc,
             async_job_check_time_ms=async_job_check_time_ms,
             async_job_check_time_scale_percent=async_job_check_time_scale_percent,
-            async_job_check_max_time_ms=async_job_check_max_time_ms)
+            async_job_check_max_time_ms=async_job_check_max_time_ms,
+            http_pool_size=http_pool_size, http_retries=http_retries,
+            json_codec=json_codec)
 
     def shock_to_file(self, params, context=None):
         """
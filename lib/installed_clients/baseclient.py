@@ -7,13 +7,20 @@
 
 from __future__ import print_function
 
+import collections as _collections
+import heapq as _heapq
+import itertools as _itertools
 import json as _json
 import requests as _requests
 import random as _random
 import os as _os
+import threading as _threading
 import traceback as _traceback
+from concurrent.futures import Future as _Future
+from requests.adapters import HTTPAdapter as _HTTPAdapter
 from requests.exceptions import ConnectionError
 from urllib3.exceptions import ProtocolError
+from urllib3.util.retry import Retry as _Retry
 
 try:
     from configparser import ConfigParser as _ConfigParser  # py 3
@@ -30,6 +37,8 @@ _CT = 'content-type'
 _AJ = 'application/json'
 _URL_SCHEME = frozenset(['http', 'https'])
 _CHECK_JOB_RETRYS = 3
+# never wait less than this between job state checks, in seconds
+_MIN_CHECK_TIME = 0.005
 
 
 def _get_token(user_id, password, auth_svc):
@@ -87,14 +96,95 @@ class ServerError(Exception):
             '\n' + self.data
 
 
-class _JSONObjectEncoder(_json.JSONEncoder):
+def _json_default(obj):
+    if isinstance(obj, set):
+        return list(obj)
+    if isinstance(obj, frozenset):
+        return list(obj)
+    raise TypeError('Object of type ' + type(obj).__name__ + ' is not JSON serializable')
 
-    def default(self, obj):
-        if isinstance(obj, set):
-            return list(obj)
-        if isinstance(obj, frozenset):
-            return list(obj)
-        return _json.JSONEncoder.default(self, obj)
+
+def _job_result(job_state):
+    if not job_state['result']:
+        return
+    if len(job_state['result']) == 1:
+        return job_state['result'][0]
+    return job_state['result']
+
+
+class JobStats(object):
+    '''
+    Observed durations and polling metrics for asynchronous jobs, by service
+    method. A job's duration is only known to lie between the last check
+    that found it running and the check that found it finished; the midpoint
+    of that interval is used as the estimate, and the other half of the
+    interval is counted as wasted wait. Expected durations are exponentially
+    weighted moving averages of the estimates.
+
+    The durations of one method can vary widely, e.g. with the size of the
+    file uploaded, so polling starts from the shortest of the last `window`
+    estimates rather than from the average: one long job does not hold up
+    the first check of the short jobs that follow it.
+    '''
+
+    def __init__(self, weight=0.3, window=20):
+        self._weight = weight
+        self._window = window
+        self._lock = _threading.Lock()
+        self._expected = {}
+        self._recent = {}
+        self._metrics = {}
+
+    def expected_duration(self, service_method):
+        '''The expected duration of a job in seconds, or None if unknown.'''
+        with self._lock:
+            return self._expected.get(service_method)
+
+    def shortest_duration(self, service_method):
+        '''
+        The shortest estimated duration of the method's recent jobs in
+        seconds, or None if unknown.
+        '''
+        with self._lock:
+            recent = self._recent.get(service_method)
+            return min(recent) if recent else None
+
+    def record(self, service_method, running_until, finished_by, polls,
+               waited):
+        '''
+        Record a finished job.
+        running_until - seconds from submission to the last check that found
+            the job running (0 if there was none).
+        finished_by - seconds from submission to the check that found the job
+            finished.
+        polls - the number of job state checks.
+        waited - the total time slept between checks, in seconds.
+        '''
+        duration = (running_until + finished_by) / 2.0
+        with self._lock:
+            self._recent.setdefault(service_method, _collections.deque(
+                maxlen=self._window)).append(duration)
+            expected = self._expected.get(service_method)
+            if expected is not None:
+                duration = (self._weight * duration +
+                            (1 - self._weight) * expected)
+            self._expected[service_method] = duration
+            metrics = self._metrics.setdefault(service_method, {
+                'jobs': 0, 'polls': 0, 'wait': 0.0, 'wasted_wait': 0.0})
+            metrics['jobs'] += 1
+            metrics['polls'] += polls
+            metrics['wait'] += waited
+            metrics['wasted_wait'] += (finished_by - running_until) / 2.0
+
+    def metrics(self):
+        '''
+        Per-method totals: jobs, polls, wait and wasted_wait (seconds), plus
+        the current expected_duration.
+        '''
+        with self._lock:
+            return {method: dict(metrics,
+                                 expected_duration=self._expected[method])
+                    for method, metrics in self._metrics.items()}
 
 
 class BaseClient(object):
@@ -118,8 +208,20 @@ class BaseClient(object):
         If you don't understand the implications, leave as the default, False.
     auth_svc - the url of the KBase authorization service.
     lookup_url - set to true when contacting KBase dynamic services.
-    async_job_check_time_ms - the wait time between checking job state for
-        asynchronous jobs run with the run_job method.
+    async_job_check_time_ms - the wait time before first checking job state
+        for asynchronous jobs run with the run_job method, for methods that
+        have not been run by this client before. For other methods the first
+        check is made when the job is expected to finish, based on the
+        durations observed so far (see JobStats).
+    http_pool_size - the maximum number of keep-alive connections to keep open
+        to each host. Should be at least the number of threads sharing the
+        client.
+    http_retries - the number of times to retry a request that could not
+        connect to the server. Requests that reached the server are never
+        retried.
+    json_codec - an object, such as a module, with the functions loads(s),
+        for a str or bytes JSON document, and dumps(obj, default=None), used
+        to encode requests and decode responses. Defaults to the json module.
     '''
     def __init__(
             self, url=None, timeout=30 * 60, user_id=None,
@@ -129,7 +231,10 @@ class BaseClient(object):
             lookup_url=False,
             async_job_check_time_ms=100,
             async_job_check_time_scale_percent=150,
-            async_job_check_max_time_ms=300000):
+            async_job_check_max_time_ms=300000,
+            http_pool_size=10,
+            http_retries=3,
+            json_codec=None):
         if url is None:
             raise ValueError('A url is required')
         scheme, _, _, _, _, _ = _urlparse(url)
@@ -163,6 +268,23 @@ class BaseClient(object):
                         authdata['user_id'], authdata['password'], auth_svc)
         if self.timeout < 1:
             raise ValueError('Timeout value must be at least 1 second')
+        self._session = self._make_session(http_pool_size, http_retries)
+        self._json_codec = json_codec or _json
+        self.job_stats = JobStats()
+
+    def _make_session(self, pool_size, retries):
+        # A session re-uses keep-alive connections between calls. The adapter's
+        # connection pool is thread safe, so one session can be shared by all of
+        # the threads using this client. Headers are passed with each request
+        # rather than stored on the session.
+        retry = _Retry(total=retries, connect=retries, read=0, status=0,
+                       backoff_factor=0.1, raise_on_status=False)
+        adapter = _HTTPAdapter(pool_connections=pool_size,
+                               pool_maxsize=pool_size, max_retries=retry)
+        session = _requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
 
     def _call(self, url, method, params, context=None):
         arg_hash = {'method': method,
@@ -175,10 +297,10 @@ class BaseClient(object):
                 raise ValueError('context is not type dict as required.')
             arg_hash['context'] = context
 
-        body = _json.dumps(arg_hash, cls=_JSONObjectEncoder)
-        ret = _requests.post(url, data=body, headers=self._headers,
-                             timeout=self.timeout,
-                             verify=not self.trust_all_ssl_certificates)
+        body = self._json_codec.dumps(arg_hash, default=_json_default)
+        ret = self._session.post(url, data=body, headers=self._headers,
+                                 timeout=self.timeout,
+                                 verify=not self.trust_all_ssl_certificates)
         ret.encoding = 'utf-8'
         if ret.status_code == 500:
             if ret.headers.get(_CT) == _AJ:
@@ -191,7 +313,7 @@ class BaseClient(object):
                 raise ServerError('Unknown', 0, ret.text)
         if not ret.ok:
             ret.raise_for_status()
-        resp = ret.json()
+        resp = self._json_codec.loads(ret.content)
         if 'result' not in resp:
             raise ServerError('Unknown', 0, 'An unknown server error occurred')
         if not resp['result']:
@@ -239,32 +361,61 @@ class BaseClient(object):
         '''
         mod, _ = service_method.split('.')
         job_id = self._submit_job(service_method, args, service_ver, context)
-        async_job_check_time = self.async_job_check_time
+        submitted = time.time()
+        running_until = 0.0
+        polls = 0
+        waited = 0.0
+        check_times = self._job_check_times(service_method)
         check_job_failures = 0
         while check_job_failures < _CHECK_JOB_RETRYS:
+            async_job_check_time = next(check_times)
             time.sleep(async_job_check_time)
-            async_job_check_time = (async_job_check_time *
-                                    self.async_job_check_time_scale_percent /
-                                    100.0)
-            if async_job_check_time > self.async_job_check_max_time:
-                async_job_check_time = self.async_job_check_max_time
+            waited += async_job_check_time
 
             try:
+                checked = time.time() - submitted
+                polls += 1
                 job_state = self._check_job(mod, job_id)
             except (ConnectionError, ProtocolError):
                 _traceback.print_exc()
                 check_job_failures += 1
                 continue
 
-            if job_state['finished']:
-                if not job_state['result']:
-                    return
-                if len(job_state['result']) == 1:
-                    return job_state['result'][0]
-                return job_state['result']
+            if not job_state['finished']:
+                running_until = checked
+                continue
+            self.job_stats.record(service_method, running_until,
+                                  time.time() - submitted, polls, waited)
+            return _job_result(job_state)
         raise RuntimeError("_check_job failed {} times and exceeded limit".format(
             check_job_failures))
 
+    def _job_check_times(self, service_method):
+        '''
+        Generate the waits between job state checks. The first check is made
+        when the quickest of the method's recent jobs had finished; after
+        that, the wait grows by async_job_check_time_scale_percent from a
+        tenth of that duration, up to async_job_check_max_time.
+        '''
+        shortest = self.job_stats.shortest_duration(service_method)
+        if shortest is None:
+            wait = self.async_job_check_time
+        else:
+            yield min(max(shortest, _MIN_CHECK_TIME),
+                      self.async_job_check_max_time)
+            wait = max(shortest / 10.0, _MIN_CHECK_TIME)
+        while True:
+            wait = min(wait, self.async_job_check_max_time)
+            yield wait
+            wait = wait * self.async_job_check_time_scale_percent / 100.0
+
+    def job_multiplexer(self):
+        '''
+        Get a JobMultiplexer for running many SDK jobs at once through this
+        client.
+        '''
+        return JobMultiplexer(self)
+
     def call_method(self, service_method, args, service_ver=None,
                     context=None):
         '''
@@ -280,3 +431,144 @@ class BaseClient(object):
         url = self._get_service_url(service_method, service_ver)
         context = self._set_up_context(service_ver, context)
         return self._call(url, service_method, args, context)
+
+
+class JobMultiplexer(object):
+    '''
+    Runs many SDK jobs concurrently, tracking them all from one polling
+    thread. Each job is checked on its own schedule, as in
+    BaseClient.run_job, so short jobs are not held up by long ones.
+
+    run_job has the same signature as BaseClient.run_job but returns a
+    concurrent.futures.Future for the job result straight away. A
+    multiplexer can therefore stand in for the BaseClient of a generated SDK
+    client, whose methods then return futures. Cancelling a future stops
+    the job being polled; the job itself keeps running.
+
+    Use as a context manager, or call close() when done, which waits for
+    the jobs that have not been cancelled.
+    '''
+
+    def __init__(self, client):
+        self._client = client
+        self._cond = _threading.Condition()
+        # heap of (next check time, sequence number, job)
+        self._queue = []
+        self._seq = _itertools.count()
+        self._thread = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def run_job(self, service_method, args, service_ver=None, context=None):
+        '''
+        Submit a SDK job; arguments are as for BaseClient.run_job.
+        Returns a concurrent.futures.Future for the job result.
+        '''
+        future = _Future()
+        try:
+            job_id = self._client._submit_job(service_method, args,
+                                              service_ver, context)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        job = {'method': service_method,
+               'module': service_method.split('.')[0],
+               'id': job_id,
+               'future': future,
+               'submitted': time.time(),
+               'check_times': self._client._job_check_times(service_method),
+               'running_until': 0.0,
+               'polls': 0,
+               'waited': 0.0,
+               'failures': 0}
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('JobMultiplexer is closed')
+            self._schedule(job)
+            if self._thread is None:
+                self._thread = _threading.Thread(target=self._poll)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def close(self):
+        '''Wait for all jobs that have not been cancelled to finish.'''
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _schedule(self, job):
+        wait = next(job['check_times'])
+        job['waited'] += wait
+        _heapq.heappush(self._queue,
+                        (time.time() + wait, next(self._seq), job))
+
+    def _poll(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    # don't wait out the schedules of cancelled jobs
+                    self._queue = [entry for entry in self._queue
+                                   if not entry[2]['future'].cancelled()]
+                    _heapq.heapify(self._queue)
+                if not self._queue:
+                    return
+                due = self._queue[0][0] - time.time()
+                if due > 0:
+                    self._cond.wait(due)
+                    continue
+                job = _heapq.heappop(self._queue)[2]
+            if not job['future'].cancelled():
+                self._check(job)
+
+    def _check(self, job):
+        future = job['future']
+        try:
+            checked = time.time() - job['submitted']
+            job['polls'] += 1
+            job_state = self._client._check_job(job['module'], job['id'])
+        except (ConnectionError, ProtocolError):
+            _traceback.print_exc()
+            job['failures'] += 1
+            if job['failures'] >= _CHECK_JOB_RETRYS:
+                _resolve(future, exception=RuntimeError(
+                    "_check_job failed {} times and exceeded limit".format(
+                        job['failures'])))
+                return
+            with self._cond:
+                self._schedule(job)
+            return
+        except Exception as e:
+            _resolve(future, exception=e)
+            return
+
+        if not job_state['finished']:
+            job['running_until'] = checked
+            with self._cond:
+                self._schedule(job)
+            return
+        self._client.job_stats.record(
+            job['method'], job['running_until'],
+            time.time() - job['submitted'], job['polls'], job['waited'])
+        _resolve(future, result=_job_result(job_state))
+
+
+def _resolve(future, result=None, exception=None):
+    # the owner of a future may cancel it at any time
+    if not future.set_running_or_notify_cancel():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
@@ -0,0 +1,26 @@
+import os
+import sys
+from configparser import ConfigParser
+
+from KBaseReport.utils.TemplateUtil import TemplateUtil
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or len(sys.argv) > 3:
+        print("Usage: <program> <deploy_cfg_file> [<template_dir>]")
+        print("Compiles the templates under <template_dir> (default: $TEMPLATE_DIR) into the")
+        print("template-store-dir set in the [KBaseReport] section of <deploy_cfg_file>.")
+        sys.exit(1)
+    config_parser = ConfigParser()
+    config_parser.read(sys.argv[1])
+    config = dict(config_parser.items('KBaseReport'))
+    config['template_toolkit'] = dict(config_parser.items('TemplateToolkitPython'))
+    if not config.get('template-store-dir'):
+        print("template-store-dir is not set in " + sys.argv[1])
+        sys.exit(1)
+    # the scratch directory only needs to exist for the config to validate
+    os.makedirs(config['scratch'], exist_ok=True)
+
+    template_dir = sys.argv[2] if len(sys.argv) == 3 else os.environ['TEMPLATE_DIR']
+    templater = TemplateUtil(config)
+    compiled = templater.precompile_templates(template_dir)
+    print("Compiled %d templates into %s" % (len(compiled), config['template-store-dir']))
@@ -112,7 +112,9 @@ class KBaseReportTest(unittest.TestCase):
         Return:
           object data from created report
         """
-        self.assertEqual(self.getImpl().status(self.getContext())[0]['state'], 'OK')
+        status = self.getImpl().status(self.getContext())[0]
+        self.assertEqual(status['state'], 'OK')
+        self.assertIn('dfu_jobs', status)
         self.assertTrue(len(result[0]['ref']))
         self.assertTrue(len(result[0]['name']))
         obj = self.dfu.get_objects({'object_refs': [result[0]['ref']]})
@@ -472,6 +474,22 @@ class KBaseReportTest(unittest.TestCase):
         })
         self.check_extended_result(result, 'file_links', ['a', 'b'])
 
+    def test_create_extended_report_with_mixed_file_links(self):
+        """ paths and shock IDs can be mixed; link order follows the input order """
+        result = self.getImpl().create_extended_report(self.getContext(), {
+            'workspace_name': self.getWsName(),
+            'report_object_name': 'my_report',
+            'file_links': [
+                {'name': 'a', 'path': self.a_file_path},
+                {'name': 'b', 'shock_id': self.b_file_shock['shock_id']},
+                {'name': 'c', 'path': self.a_html_path},
+                {'name': 'd', 'path': self.b_file_path},
+            ]
+        })
+        obj = self.check_extended_result(result, 'file_links', ['a', 'b', 'c', 'd'])
+        self.assertEqual([f['name'] for f in obj['file_links']], ['a', 'b', 'c', 'd'])
+        self.assertEqual(len(set(f['handle'] for f in obj['file_links'])), 4)
+
     def test_create_extended_report_with_uploaded_html_files(self):
         result = self.getImpl().create_extended_report(self.getContext(), {
             'workspace_name': self.getWsName(),
@@ -571,6 +589,7 @@ class KBaseReportTest(unittest.TestCase):
 
     def test_valid_extended_report_with_html_paths(self):
         """ Test the case where they set a single HTML file as their 'path' """
+        html_dir_contents = sorted(os.listdir(self.a_html_path))
         result = self.getImpl().create_extended_report(self.getContext(), {
             'workspace_name': self.getWsName(),
             'direct_html_link_index': 0,
@@ -582,6 +601,8 @@ class KBaseReportTest(unittest.TestCase):
             ]
         })
         self.check_extended_result(result, 'html_links', ['main.html'])
+        # the file is packed in place; nothing is staged next to it
+        self.assertEqual(sorted(os.listdir(self.a_html_path)), html_dir_contents)
 
     def test_html_direct_link_index_out_of_bounds(self):
         """ Test the case where they pass an out of bounds html index """
@@ -3,14 +3,19 @@ import contextlib
 import json
 import os
 import re
+import threading
+import time
 import unittest
 
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from template import Template
 from template.util import TemplateException
+from unittest import mock
 from uuid import uuid4
 
 from KBaseReport.KBaseReportImpl import KBaseReport
+from KBaseReport.utils import TemplateUtil as TemplateUtil_module
 from KBaseReport.utils.TemplateUtil import TemplateUtil
 from KBaseReport.utils.validation_utils import validate_template_params
 
@@ -277,12 +282,30 @@ class TestTemplateUtils(unittest.TestCase):
 
         tt_config = self.getImpl().config
         tmpl_util = TemplateUtil(tt_config)
-        self.assertIsNone(tmpl_util._template)
+        self.assertEqual(tmpl_util._engines, [])
 
         # init the template engine
         tmpl_engine = tmpl_util.template_engine()
         self.assertIsInstance(tmpl_engine, Template)
 
+        # engines are created as renders need them, then re-used
+        tmpl_util._render_template(TEST_DATA['template'])
+        tmpl_util._render_template(TEST_DATA['template'])
+        self.assertEqual(len(tmpl_util._engines), 1)
+
+    def test_impl_warm_up(self):
+        """ the Impl compiles templates on first use, or all at once when warmed up """
+        impl = KBaseReport(self.cfg)
+        templater = impl.templater
+        self.assertEqual(templater._engines, [])
+        self.assertEqual(templater.template_cache.stats()['entries'], 0)
+
+        with self.assertLogs('KBaseReport.KBaseReportImpl', 'INFO') as logs:
+            result = impl.warm_up_templates()
+        self.assertEqual(len(templater._engines), 1)
+        self.assertEqual(templater.template_cache.stats()['entries'], len(result['compiled']))
+        self.assertRegex(logs.output[0], r'compiled \d+ templates')
+
     def test_validate_template_params_errors(self):
         """ test TemplateUtil input validation errors """
 
@@ -538,6 +561,11 @@ class TestTemplateUtils(unittest.TestCase):
         with self.assertRaisesRegex(ValueError, err_str):
             impl_output = self.getImpl().render_templates({}, args_list)
 
+        # the same path, written differently
+        args_list[1]['output_file'] = os.path.join(self.scratch, '.', 'temp_file.txt')
+        with self.assertRaisesRegex(ValueError, err_str):
+            self.getImpl().render_templates({}, args_list[:2])
+
     def test_impl_render_templates(self):
         """
             full Impl test, multiple template rendering:
@@ -570,6 +598,123 @@ class TestTemplateUtils(unittest.TestCase):
         for output_file in impl_output[0]:
             self.check_file_contents(output_file['path'], expected_content[output_file['path']])
 
+    def test_render_template_list_to_files_pool(self):
+        """ template lists rendered on the process pool: output order, all-or-nothing errors """
+
+        templater = TemplateUtil(dict(self.cfg, **{'template-render-processes': '2'}))
+        output_dir = os.path.join(self.scratch, 'pool-' + str(uuid4()))
+        args_list = [{
+            'template_file': TEST_DATA['template'],
+            'template_data_json': json.dumps({'value': 'item ' + str(n)}),
+            'output_file': os.path.join(output_dir, str(n) + '.txt'),
+        } for n in range(8)]
+
+        with mock.patch.object(TemplateUtil_module, 'MIN_PARALLEL_RENDERS', 4):
+            output = templater.render_template_list_to_files(args_list)
+            self.assertEqual(output, [{'path': args['output_file']} for args in args_list])
+            for (n, args) in enumerate(args_list):
+                with open(args['output_file']) as f:
+                    self.assertIn('item ' + str(n), f.read())
+
+            # a failed render leaves neither outputs nor temporary files behind
+            failed_dir = os.path.join(self.scratch, 'pool-' + str(uuid4()))
+            for (n, args) in enumerate(args_list):
+                args['output_file'] = os.path.join(failed_dir, str(n) + '.txt')
+            args_list[5]['template_file'] = 'does/not/exist.tt'
+            with self.assertRaisesRegex(TemplateException, 'does/not/exist.tt: not found'):
+                templater.render_template_list_to_files(args_list)
+            self.assertEqual(os.listdir(failed_dir), [])
+
+        # workers are not forked from the threaded server
+        self.assertEqual(templater._render_pool._mp_context.get_start_method(), 'forkserver')
+        templater._render_pool.shutdown()
+
+    def test_render_pool_created_once(self):
+        """ concurrent requests share one render pool """
+        templater = TemplateUtil(dict(self.cfg, **{'template-render-processes': '2'}))
+        pools = []
+
+        def make_pool(workers, mp_context):
+            # slow enough for every request to find that there is no pool yet
+            time.sleep(0.05)
+            pools.append(ThreadPoolExecutor(workers))
+            return pools[-1]
+
+        def render(n):
+            output_file = os.path.join(self.scratch, 'pool-' + str(uuid4()) + '.txt')
+            rendered = templater._render_on_pool([{
+                'template_file': TEST_DATA['template'],
+                'template_data_json': json.dumps({'value': 'item ' + str(n)}),
+                'output_file': output_file,
+            }])
+            TemplateUtil_module._remove_temp_files(rendered)
+
+        threads = [threading.Thread(target=render, args=(n,)) for n in range(4)]
+        with mock.patch.object(TemplateUtil_module, 'ProcessPoolExecutor', side_effect=make_pool):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(pools), 1)
+        pools[0].shutdown()
+
+    def test_render_template_batch(self):
+        """ one template, many records: records_json and NDJSON records_file """
+
+        records = [{'name': 'sample_' + str(n), 'value': 'value ' + str(n)} for n in range(5)]
+        output_dir = os.path.join(self.scratch, 'batch-' + str(uuid4()))
+        records_file = os.path.join(output_dir, 'records.ndjson')
+        os.makedirs(output_dir)
+        with open(records_file, 'w') as f:
+            f.write('\n'.join(json.dumps(r) for r in records) + '\n')
+
+        for records_param in [
+            {'records_json': json.dumps(records)},
+            {'records_file': records_file},
+        ]:
+            params = dict(records_param, **{
+                'template_file': TEST_DATA['template'],
+                'output_file_pattern': os.path.join(output_dir, '{index}-{name}.html'),
+            })
+            output = self.getImpl().render_template_batch({}, params)[0]
+            self.assertEqual(output, [
+                {'path': os.path.join(output_dir, str(n) + '-sample_' + str(n) + '.html')}
+                for n in range(5)
+            ])
+            for (n, output_file) in enumerate(output):
+                with open(output_file['path']) as f:
+                    self.assertIn('The value is value ' + str(n), f.read())
+
+    def test_render_template_batch_errors(self):
+        """ batch rendering errors leave no output files behind """
+
+        output_dir = os.path.join(self.scratch, 'batch-' + str(uuid4()))
+        base_params = {
+            'template_file': TEST_DATA['template'],
+            'output_file_pattern': os.path.join(output_dir, '{name}.html'),
+        }
+        err_list = [
+            ({}, TypeError, 'required field'),
+            ({'records_json': '[]', 'records_file': TEST_DATA['template']}, TypeError,
+             "must not be present with 'records_file'"),
+            ({'records_json': '[{"name": "a"'}, TypeError, 'Invalid JSON'),
+            ({'records_json': '[1, 2]'}, TypeError, 'must be a list of JSON objects'),
+            ({'records_json': '[{"name": "a"}, {"value": "b"}]'}, ValueError,
+             'cannot be filled in for record 1'),
+            ({'records_json': '[{"name": "a"}, {"name": "a"}]'}, ValueError,
+             'output_file paths must be unique'),
+            ({'records_json': '[{"name": "a"}, {"name": "./a"}]'}, ValueError,
+             'output_file paths must be unique'),
+            ({'records_json': '[{"name": "a"}, {"name": "../../../b"}]'}, ValueError,
+             'is not in the scratch directory'),
+        ]
+        for (records_param, error_type, err_str) in err_list:
+            with self.subTest(records_param=records_param):
+                with self.assertRaisesRegex(error_type, err_str):
+                    self.getTmpl().render_template_batch(dict(base_params, **records_param))
+                if os.path.isdir(output_dir):
+                    self.assertEqual(os.listdir(output_dir), [])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+import threading
+import unittest
+from unittest import mock
+
+from KBaseReport import authclient
+from KBaseReport.authclient import KBaseAuth, TokenCache
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _response(status_code, body):
+    response = mock.Mock(status_code=status_code, ok=status_code < 400, reason='Reason')
+    response.json.return_value = body
+    return response
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def test_lru(self):
+        """ the least recently used token is evicted first """
+        cache = TokenCache(maxsize=3)
+        for n in range(3):
+            cache.add_valid_token('token' + str(n), 'user' + str(n))
+        self.assertEqual(cache.get_user('token0'), 'user0')
+        cache.add_valid_token('token3', 'user3')
+        self.assertIsNone(cache.get_user('token1'))
+        self.assertEqual([cache.get_user('token' + str(n)) for n in [0, 2, 3]],
+                         ['user0', 'user2', 'user3'])
+
+    def test_ttl(self):
+        """ valid and rejected tokens expire after their own times """
+        clock = FakeClock()
+        cache = TokenCache(clock=clock)
+        cache.add_valid_token('good', 'user')
+        cache.add_invalid_token('bad', 'rejected')
+        self.assertEqual((cache.get_user('good'), cache.get_error('bad')), ('user', 'rejected'))
+        self.assertIsNone(cache.get_user('bad'))
+        self.assertIsNone(cache.get_error('good'))
+
+        clock.now += TokenCache._INVALID_TIME_SEC
+        self.assertEqual(cache.get_user('good'), 'user')
+        self.assertIsNone(cache.get_error('bad'))
+        clock.now += TokenCache._MAX_TIME_SEC
+        self.assertIsNone(cache.get_user('good'))
+
+        with self.assertRaisesRegex(ValueError, 'Must supply user'):
+            cache.add_valid_token('token', None)
+
+
+class TestKBaseAuth(unittest.TestCase):
+
+    def setUp(self):
+        self.auth = KBaseAuth('https://auth.example/login')
+
+    def test_get_user(self):
+        """ valid tokens are looked up once """
+        with mock.patch.object(authclient._requests, 'post',
+                               return_value=_response(200, {'user_id': 'me'})) as post:
+            self.assertEqual(self.auth.get_user('token'), 'me')
+            # tokens cached in this process are returned without taking the in-flight lock
+            with mock.patch.object(self.auth, '_in_flight_lock') as lock:
+                self.assertEqual([self.auth.get_user('token') for _ in range(2)], ['me'] * 2)
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(lock.__enter__.call_count, 0)
+
+    def test_shared_cache(self):
+        """ the shared cache is read outside the in-flight lock """
+        clients = []
+
+        class SharedNamespace:
+
+            def __init__(self):
+                self.entries = {}
+
+            def get(self, key):
+                assert not any(client._in_flight_lock.locked() for client in clients)
+                return self.entries.get(key)
+
+            def set(self, key, value, ttl):
+                self.entries[key] = value
+
+        shared = SharedNamespace()
+        clients.extend(KBaseAuth('https://auth.example/login', shared) for _ in range(2))
+        with mock.patch.object(authclient._requests, 'post',
+                               return_value=_response(200, {'user_id': 'me'})) as post:
+            self.assertEqual(clients[0].get_user('token'), 'me')
+            # another process finds the token in the shared cache
+            self.assertEqual(clients[1].get_user('token'), 'me')
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(len(shared.entries), 1)
+
+    def test_rejected_token(self):
+        """ rejected tokens are cached, but other errors are not """
+        rejected = _response(401, {'error': {'message': 'Invalid token'}})
+        with mock.patch.object(authclient._requests, 'post', return_value=rejected) as post:
+            for _ in range(3):
+                with self.assertRaisesRegex(ValueError, '401 Reason\nInvalid token'):
+                    self.auth.get_user('bad')
+        self.assertEqual(post.call_count, 1)
+
+        for status in [429, 500, 503]:
+            unavailable = _response(status, {'error': {'message': 'Try later'}})
+            with mock.patch.object(authclient._requests, 'post', return_value=unavailable) as post:
+                for _ in range(2):
+                    with self.assertRaisesRegex(ValueError, 'Try later'):
+                        self.auth.get_user('token')
+            self.assertEqual(post.call_count, 2, status)
+
+    def test_coalesced_lookups(self):
+        """ concurrent lookups of the same token share one call to the auth service """
+        release = threading.Event()
+        calls = []
+
+        def post(url, data):
+            calls.append(data['token'])
+            release.wait(5)
+            if data['token'] == 'bad':
+                return _response(401, {'error': {'message': 'Invalid token'}})
+            return _response(200, {'user_id': 'user of ' + data['token']})
+
+        results = []
+
+        def get_user(token):
+            try:
+                results.append(self.auth.get_user(token))
+            except ValueError as err:
+                results.append(str(err).split('\n')[-1])
+
+        tokens = ['a', 'b', 'bad'] * 5
+        threads = [threading.Thread(target=get_user, args=(token,)) for token in tokens]
+        with mock.patch.object(authclient._requests, 'post', side_effect=post):
+            for thread in threads:
+                thread.start()
+            while len(self.auth._in_flight) < 3:
+                release.wait(0.01)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(sorted(calls), ['a', 'b', 'bad'])
+        self.assertEqual(sorted(results),
+                         ['Invalid token'] * 5 + ['user of a'] * 5 + ['user of b'] * 5)
+        self.assertEqual(self.auth._in_flight, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
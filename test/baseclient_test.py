@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+
+from requests.exceptions import ConnectionError
+from urllib3.connection import HTTPConnection
+
+from installed_clients import baseclient
+from installed_clients.baseclient import BaseClient, JobStats, ServerError
+from KBaseReport.utils.concurrency_utils import wait_all
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {'content-type': 'application/json'}
+        self.content = json.dumps(body).encode('utf-8')
+        self.text = self.content.decode('utf-8')
+        self.encoding = None
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class FakeCallbackServer:
+    """
+    Stands in for the session of a BaseClient talking to the SDK callback server
+    A job submitted with params [{'wait': seconds}] finishes that long after it is submitted;
+    [{'fail': message}] fails when it is first checked. Checks are recorded as
+    (job params, seconds since submission).
+    """
+
+    def __init__(self, connection_errors=0):
+        self.connection_errors = connection_errors
+        self.jobs = {}
+        self.checks = []
+        self.finished = []
+        self._lock = threading.Lock()
+
+    def post(self, url, data=None, headers=None, timeout=None, verify=True):
+        request = json.loads(data)
+        (module, method) = request['method'].split('.')
+        with self._lock:
+            if method == '_check_job':
+                return self._check_job(request['params'][0])
+            job_id = str(len(self.jobs))
+            self.jobs[job_id] = (request['params'][0], time.time())
+            return FakeResponse(200, {'result': [job_id]})
+
+    def _check_job(self, job_id):
+        (params, submitted) = self.jobs[job_id]
+        self.checks.append((params, time.time() - submitted))
+        if self.connection_errors:
+            self.connection_errors -= 1
+            raise ConnectionError('Connection refused')
+        if 'fail' in params:
+            return FakeResponse(500, {'error': {'name': 'JSONRPCError', 'code': -32000,
+                                                'message': params['fail']}})
+        if time.time() - submitted < params.get('wait', 0):
+            return FakeResponse(200, {'result': [{'finished': 0}]})
+        self.finished.append(params)
+        return FakeResponse(200, {'result': [{'finished': 1, 'result': [params]}]})
+
+
+class TestBaseClient(unittest.TestCase):
+
+    def make_client(self, server, **kwargs):
+        kwargs.setdefault('async_job_check_time_ms', 5)
+        client = BaseClient('http://localhost:1', token='token', **kwargs)
+        client._session = server
+        return client
+
+    def test_results_in_order(self):
+        """ multiplexed jobs finish in any order, but results are in submission order """
+        server = FakeCallbackServer()
+        client = self.make_client(server)
+        jobs = [{'n': n, 'wait': 0.03 * (4 - n)} for n in range(4)]
+        with client.job_multiplexer() as multiplexer:
+            futures = [multiplexer.run_job('Fake.method', [job]) for job in jobs]
+            self.assertEqual(wait_all(futures), jobs)
+        self.assertEqual([job['n'] for job in server.finished], [3, 2, 1, 0])
+        self.assertEqual(client.job_stats.metrics()['Fake.method']['jobs'], 4)
+
+    def test_error_cancels_batch(self):
+        """ a failed job fails the batch and stops the other jobs in it being polled """
+        server = FakeCallbackServer()
+        client = self.make_client(server)
+        jobs = [{'wait': 5}, {'fail': 'No such file'}, {'wait': 5}]
+        start = time.time()
+        with client.job_multiplexer() as multiplexer:
+            futures = [multiplexer.run_job('Fake.method', [job]) for job in jobs]
+            with self.assertRaisesRegex(ServerError, 'No such file'):
+                wait_all(futures)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual([future.cancelled() for future in futures], [True, False, True])
+        self.assertEqual(server.finished, [])
+        self.assertEqual(client.job_stats.metrics(), {})
+
+    def test_check_job_retry_limit(self):
+        """ checking a job fails after _CHECK_JOB_RETRYS connection errors in a row """
+        for run in ['run_job', 'multiplexer']:
+            server = FakeCallbackServer(connection_errors=10)
+            client = self.make_client(server)
+            with mock.patch.object(baseclient._traceback, 'print_exc'), \
+                    self.assertRaisesRegex(RuntimeError, '_check_job failed 3 times'):
+                if run == 'run_job':
+                    client.run_job('Fake.method', [{}])
+                else:
+                    with client.job_multiplexer() as multiplexer:
+                        wait_all([multiplexer.run_job('Fake.method', [{}])])
+            self.assertEqual(len(server.checks), baseclient._CHECK_JOB_RETRYS, run)
+
+        # a job that can be checked again after fewer errors finishes
+        server = FakeCallbackServer(connection_errors=baseclient._CHECK_JOB_RETRYS - 1)
+        client = self.make_client(server)
+        with mock.patch.object(baseclient._traceback, 'print_exc'):
+            self.assertEqual(client.run_job('Fake.method', [{'n': 1}]), {'n': 1})
+
+    def test_session_retries(self):
+        """ requests that cannot connect are retried http_retries times """
+        client = BaseClient('http://localhost:1', token='token', http_retries=2)
+        retry = client._session.get_adapter('http://localhost:1').max_retries
+        # requests that reached the server are never retried
+        self.assertEqual((retry.read, retry.status), (0, 0))
+
+        new_conn = HTTPConnection._new_conn
+        with mock.patch.object(HTTPConnection, '_new_conn', autospec=True,
+                               side_effect=new_conn) as connect:
+            with self.assertRaises(ConnectionError):
+                client.call_method('Fake.method', [])
+        self.assertEqual(connect.call_count, 3)
+
+    def test_json_codec(self):
+        """ requests and responses go through the client's JSON codec """
+        codec = mock.Mock(loads=mock.Mock(side_effect=json.loads),
+                          dumps=mock.Mock(side_effect=json.dumps))
+        client = self.make_client(FakeCallbackServer(), json_codec=codec)
+        self.assertEqual(client.run_job('Fake.method', [{'n': {1, 2}}]), {'n': [1, 2]})
+        # the submission and one check
+        self.assertEqual((codec.dumps.call_count, codec.loads.call_count), (2, 2))
+
+    def test_poll_schedule(self):
+        """ the first check is made when a job is expected to finish, from observed durations """
+        client = self.make_client(FakeCallbackServer(), async_job_check_time_ms=10,
+                                  async_job_check_time_scale_percent=200,
+                                  async_job_check_max_time_ms=1000)
+
+        def first_waits(count=4):
+            check_times = client._job_check_times('Fake.method')
+            return [round(next(check_times), 2) for _ in range(count)]
+
+        # unknown jobs start from async_job_check_time
+        self.assertEqual(first_waits(), [0.01, 0.02, 0.04, 0.08])
+        client.job_stats.record('Fake.method', 0.9, 1.1, 2, 1.1)
+        self.assertEqual(first_waits(), [1.0, 0.1, 0.2, 0.4])
+        # shorter jobs bring the first check forward
+        for _ in range(10):
+            client.job_stats.record('Fake.method', 0.09, 0.11, 2, 0.11)
+        self.assertLess(first_waits(1)[0], 0.2)
+        # and longer jobs push it back, up to async_job_check_max_time
+        for _ in range(20):
+            client.job_stats.record('Fake.method', 4, 6, 2, 6)
+        self.assertEqual(first_waits(), [1.0, 0.5, 1.0, 1.0])
+
+    def test_poll_schedule_mixed_durations(self):
+        """ one long job does not delay the first check of the short jobs after it """
+        client = self.make_client(FakeCallbackServer(), async_job_check_time_ms=10,
+                                  async_job_check_max_time_ms=300000)
+        for _ in range(5):
+            client.job_stats.record('Fake.method', 0.01, 0.03, 2, 0.03)
+        client.job_stats.record('Fake.method', 59, 61, 2, 61)
+        self.assertEqual(round(next(client._job_check_times('Fake.method')), 3), 0.02)
+        # the long job still counts towards the average
+        self.assertGreater(client.job_stats.expected_duration('Fake.method'), 15)
+
+        # until it has been pushed out of the window by later jobs
+        stats = JobStats(window=3)
+        for duration in [0.02, 60, 30, 40, 50]:
+            stats.record('Fake.method', duration, duration, 1, duration)
+        self.assertEqual(stats.shortest_duration('Fake.method'), 30)
+
+    def test_poll_schedule_adapts(self):
+        """ later jobs of a method are checked fewer times """
+        server = FakeCallbackServer()
+        client = self.make_client(server)
+        client.run_job('Fake.method', [{'wait': 0.2}])
+        first_polls = len(server.checks)
+        client.run_job('Fake.method', [{'wait': 0.2}])
+        self.assertLess(len(server.checks) - first_polls, first_polls)
+
+        metrics = client.job_stats.metrics()['Fake.method']
+        self.assertEqual((metrics['jobs'], metrics['polls']), (2, len(server.checks)))
+        self.assertGreater(metrics['expected_duration'], 0.15)
+
+
+class TestJobStats(unittest.TestCase):
+
+    def test_record(self):
+        """ durations are estimated from the interval in which a job finished """
+        stats = JobStats(weight=0.5)
+        self.assertIsNone(stats.expected_duration('Fake.method'))
+        stats.record('Fake.method', 1.0, 3.0, 3, 3.0)
+        self.assertEqual(stats.expected_duration('Fake.method'), 2.0)
+        stats.record('Fake.method', 5.0, 7.0, 2, 7.0)
+        self.assertEqual(stats.expected_duration('Fake.method'), 4.0)
+        self.assertEqual(stats.metrics(), {'Fake.method': {
+            'jobs': 2, 'polls': 5, 'wait': 10.0, 'wasted_wait': 2.0, 'expected_duration': 4.0}})
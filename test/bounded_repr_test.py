@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import pickle
+import pprint
+import unittest
+
+from KBaseReport.utils.bounded_repr import LazyMessage, bounded
+
+
+class TestBoundedRepr(unittest.TestCase):
+
+    def test_bounded(self):
+        """ small values are copied unchanged; large ones are cut short """
+        small = {'a': [1, 2.5, None, True, 'text'], 'b': {'c': ('x', b'y')}}
+        self.assertEqual(bounded(small), small)
+
+        text = pprint.pformat(bounded({
+            'direct_html': '<p>' * 1000000,
+            'objects_created': [{'ref': '1/2/' + str(i)} for i in range(5000)],
+            'keys': {str(i): i for i in range(100)},
+        }, max_string_chars=30, max_items=5))
+        self.assertIn("'<p><p><p><p><p><p><p><p><p><p>' <+2999970 characters>", text)
+        self.assertRegex(text, r"\{'ref': '1/2/4'\},\s+<4995 more items>")
+        self.assertIn('<95 more keys>: <...>', text)
+        self.assertLess(len(text), 1000)
+
+    def test_bounded_values(self):
+        """ no more than max_values values are copied, however deep they are """
+        nested = [[list(range(10)) for _ in range(10)] for _ in range(10)]
+        copy = bounded(nested, max_items=10, max_values=50)
+        self.assertEqual(copy[0][0], list(range(10)))
+        # 50 values: the outer list, its first item, 4 lists of 10 numbers, a fifth list and
+        # its first 3 numbers; everything after that is elided
+        self.assertEqual(copy[0][4][:3], [0, 1, 2])
+        self.assertEqual(pprint.pformat(copy).count('<...>'), 7 + 5 + 9)
+
+    def test_lazy_message(self):
+        """ the message is built once, when first used, and prints as a string would """
+        calls = []
+
+        def build(*args):
+            calls.append(args)
+            return 'error: ' + ' '.join(args)
+
+        message = LazyMessage(build, 'bad', 'params')
+        self.assertEqual(calls, [])
+        for err in [TypeError(message), KeyError(message)]:
+            expected = type(err)('error: bad params')
+            self.assertEqual(str(err), str(expected))
+            self.assertEqual(repr(err.args[0]), repr(expected.args[0]))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(str(pickle.loads(pickle.dumps(TypeError(message)))), 'error: bad params')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+from functools import partial
+
+from KBaseReport.utils.concurrency_utils import (Stage, gevent_patched, run_blocking, run_pipeline,
+                                                 wait_all)
+
+
+class TestConcurrencyUtils(unittest.TestCase):
+
+    def test_wait_all(self):
+        """ futures are resolved in place and other values passed through """
+        future = Future()
+        threading.Timer(0.01, future.set_result, [2]).start()
+        self.assertEqual(wait_all([1, future, 3]), [1, 2, 3])
+
+        failed = Future()
+        failed.set_exception(ValueError('failed'))
+        pending = Future()
+        with self.assertRaisesRegex(ValueError, 'failed'):
+            wait_all([pending, failed])
+        self.assertTrue(pending.cancelled())
+
+    def test_run_pipeline(self):
+        """ items pass through every stage, and come out in input order """
+        def slow_double(i):
+            time.sleep(0.001 * (i % 3))
+            return i * 2
+
+        batches = []
+
+        def add_one(items):
+            batches.append(len(items))
+            return [i + 1 for i in items]
+
+        stages = [Stage(slow_double, 3), Stage(add_one, batch_size=4)]
+        self.assertEqual(run_pipeline(range(20), stages), [i * 2 + 1 for i in range(20)])
+        self.assertEqual(sum(batches), 20)
+        self.assertLessEqual(max(batches), 4)
+        self.assertEqual(run_pipeline([], stages), [])
+
+    def test_run_pipeline_back_pressure(self):
+        """ a fast stage does not get more than queue_size items ahead of a slow one """
+        lock = threading.Lock()
+        state = {'produced': 0, 'consumed': 0, 'ahead': 0}
+
+        def produce(i):
+            with lock:
+                state['produced'] += 1
+                state['ahead'] = max(state['ahead'], state['produced'] - state['consumed'])
+            return i
+
+        def consume(i):
+            time.sleep(0.002)
+            with lock:
+                state['consumed'] += 1
+            return i
+
+        run_pipeline(range(30), [Stage(produce), Stage(consume)], queue_size=2)
+        # two waiting in the queue, one being consumed and one blocked on the queue
+        self.assertLessEqual(state['ahead'], 4)
+
+    def test_run_pipeline_failure(self):
+        """ a failed stage stops the pipeline, discarding the items still in it """
+        discarded = []
+        processed = []
+
+        def check(i):
+            if i == 3:
+                raise ValueError('item 3 failed')
+            return i
+
+        def finish(i):
+            time.sleep(0.002)
+            processed.append(i)
+            return i
+
+        stages = [Stage(check), Stage(finish, discard=discarded.append)]
+        with self.assertRaisesRegex(ValueError, 'item 3 failed'):
+            run_pipeline(range(50), stages)
+        self.assertNotIn(3, processed + discarded)
+        self.assertLess(len(processed), 50)
+        self.assertEqual(sorted(processed + discarded), [0, 1, 2])
+
+    def test_run_blocking(self):
+        """ without gevent, blocking work runs on the calling thread """
+        self.assertFalse(gevent_patched())
+        self.assertEqual(run_blocking(lambda a, b: (a + b, threading.get_ident()), 1, 2),
+                         (3, threading.get_ident()))
+
+
+if __name__ == '__main__':
+    unittest.main()
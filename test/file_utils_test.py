@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import Future
+
+from installed_clients.baseclient import ServerError
+from KBaseReport.utils.file_utils import _render_link, fetch_or_upload_links
+from KBaseReport.utils.upload_cache import UploadCache
+
+
+class _FakeDFU:
+    """
+    Records the DataFileUtil calls; each upload gets a new shock node named after its path
+    Nodes in `deleted` cannot be owned.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = []
+        self.owned = []
+        self.deleted = set()
+
+    def _shock(self, path):
+        name = os.path.basename(path)
+        return {'shock_id': 'node_' + name,
+                'handle': {'hid': 'hid_' + name, 'url': 'https://shock', 'id': 'node_' + name}}
+
+    def file_to_shock_mass(self, params):
+        with self.lock:
+            self.batches.append([param['file_path'] for param in params])
+        return [self._shock(param['file_path']) for param in params]
+
+    def file_to_shock(self, params):
+        return self.file_to_shock_mass([params])[0]
+
+    def own_shock_node(self, params):
+        with self.lock:
+            self.owned.append(params['shock_id'])
+        if params['shock_id'] in self.deleted:
+            raise ServerError('JSONRPCError', -32000, 'Node not found')
+        return {'shock_id': params['shock_id'],
+                'handle': {'hid': 'hid_' + params['shock_id'], 'url': 'https://shock',
+                           'id': params['shock_id']}}
+
+
+class _FakeTemplater:
+
+    def __init__(self, scratch):
+        self.config = {'scratch': scratch}
+
+    def render_template_to_string(self, template):
+        if 'error' in template['template_data']:
+            raise ValueError(template['template_data']['error'])
+        return template['template_data']['text']
+
+
+class TestFetchOrUploadLinks(unittest.TestCase):
+
+    def setUp(self):
+        self.scratch = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.scratch)
+        self.dfu = _FakeDFU()
+        self.templater = _FakeTemplater(self.scratch)
+
+    def write(self, name, content='content'):
+        path = os.path.join(self.scratch, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_plain_files_in_one_job(self):
+        """ files that need no rendering or packing are uploaded in a single job """
+        paths = [self.write('file_%d.txt' % n) for n in range(300)]
+        (file_links, html_links) = fetch_or_upload_links(
+            self.dfu, [{'path': path, 'name': os.path.basename(path)} for path in paths], [],
+            self.templater, max_workers=8)
+        self.assertEqual(self.dfu.batches, [paths])
+        self.assertEqual([link['handle'] for link in file_links],
+                         ['hid_file_%d.txt' % n for n in range(300)])
+        self.assertEqual(html_links, [])
+
+    def test_mixed_links(self):
+        """ links of every kind come back in input order """
+        self.write('dir/a.txt')
+        file_links = [
+            {'path': self.write('plain.txt'), 'name': 'plain.txt'},
+            {'template': {'template_file': 'x.tt', 'template_data': {'text': 'hello'}},
+             'name': 'rendered.txt'},
+            {'shock_id': 'existing', 'name': 'existing'},
+            {'path': os.path.join(self.scratch, 'dir'), 'name': 'dir'},
+        ]
+        html_links = [{'path': self.write('index.html'), 'name': 'index.html'}]
+        (out_files, out_html) = fetch_or_upload_links(self.dfu, file_links, html_links,
+                                                      self.templater)
+        self.assertEqual([link['name'] for link in out_files],
+                         ['plain.txt', 'rendered.txt', 'existing', 'dir'])
+        self.assertEqual(out_files[0]['handle'], 'hid_plain.txt')
+        self.assertEqual(out_files[2]['handle'], 'hid_existing')
+        self.assertEqual(out_files[3]['handle'], 'hid_dir.zip')
+        self.assertEqual(out_html[0]['handle'], 'hid_index.zip')
+        self.assertEqual(self.dfu.owned, ['existing'])
+        # the plain file went out on its own, ahead of the links that had to be packed
+        self.assertEqual(self.dfu.batches[0], [file_links[0]['path']])
+        self.assertEqual(sum(len(batch) for batch in self.dfu.batches), 4)
+        # archives and rendered files are removed from scratch afterwards
+        self.assertEqual(sorted(os.listdir(self.scratch)), ['dir', 'index.html', 'plain.txt'])
+
+    def test_failure_cancels_jobs(self):
+        """ jobs that are still running when a report fails are no longer waited for """
+        pending = []
+
+        def own_shock_node(params):
+            pending.append(Future())
+            return pending[-1]
+
+        self.dfu.own_shock_node = own_shock_node
+        self.dfu.file_to_shock_mass = lambda params: own_shock_node(None)
+        file_links = [
+            {'shock_id': 'existing', 'name': 'existing'},
+            {'path': self.write('plain.txt'), 'name': 'plain.txt'},
+            {'template': {'template_file': 'x.tt', 'template_data': {'error': 'bad template'}},
+             'name': 'rendered.txt'},
+        ]
+        with self.assertRaisesRegex(ValueError, 'bad template'):
+            fetch_or_upload_links(self.dfu, file_links, [], self.templater)
+        self.assertEqual(len(pending), 2)
+        self.assertTrue(all(future.cancelled() for future in pending))
+
+
+    def test_upload_cache(self):
+        """ files whose contents were uploaded before re-use the shock node """
+        cache_dir = os.path.join(self.scratch, 'upload_cache')
+
+        def upload(name):
+            # a new cache each time, as in a new process: the index is saved after each report
+            upload_cache = UploadCache(cache_dir, min_file_size=10)
+            path = self.write(name, 'the same large contents')
+            file_links = [{'path': path, 'name': name}, {'path': self.write('small.txt', 'x')}]
+            (out_files, _) = fetch_or_upload_links(self.dfu, file_links, [], self.templater,
+                                                   upload_cache=upload_cache)
+            return (out_files[0]['handle'], upload_cache.stats())
+
+        self.assertEqual(upload('first.bin'), ('hid_first.bin', {'hits': 0, 'misses': 1,
+                                                                 'entries': 1}))
+        # small files are uploaded directly, large ones on their own
+        self.assertEqual(len(self.dfu.batches), 2)
+        self.assertEqual(upload('copy.bin'), ('hid_node_first.bin', {'hits': 1, 'misses': 0,
+                                                                     'entries': 1}))
+        self.assertEqual(self.dfu.owned, ['node_first.bin'])
+        self.assertEqual(len(self.dfu.batches), 3)
+
+        # a node that has gone is discarded, and the file uploaded again
+        self.dfu.deleted.add('node_first.bin')
+        self.assertEqual(upload('again.bin'), ('hid_again.bin', {'hits': 1, 'misses': 0,
+                                                                 'entries': 1}))
+        self.assertEqual(self.dfu.batches[-1], [os.path.join(self.scratch, 'again.bin')])
+        saved = UploadCache(cache_dir)._entries
+        self.assertEqual([entry['shock_id'] for entry in saved.values()], ['node_again.bin'])
+
+
+    def test_render_spill(self):
+        """ rendered output larger than spill_bytes, as UTF-8, is written to a file """
+        work_dir = os.path.join(self.scratch, 'work')
+
+        def render(text, spill_bytes):
+            link = {'file': {'template': {'template_file': 'x.tt',
+                                          'template_data': {'text': text}}}}
+            return _render_link(self.templater, spill_bytes, work_dir, link)
+
+        link = render('abcd', 4)
+        self.assertEqual(link['content'], b'abcd')
+        self.assertNotIn('path', link['file'])
+
+        # four characters, but twelve bytes
+        link = render('\u00e9\u00e8\u20ac\u20ac', 8)
+        self.assertNotIn('content', link)
+        self.assertEqual(os.path.dirname(link['file']['path']), work_dir)
+        with open(link['file']['path'], encoding='utf-8') as f:
+            self.assertEqual(f.read(), '\u00e9\u00e8\u20ac\u20ac')
+
+        # spilled files are uploaded like any other
+        file_links = [{'template': {'template_file': 'x.tt', 'template_data': {'text': 'x' * 20}},
+                       'name': 'big.txt'}]
+        self.templater.config['render-spill-bytes'] = '10'
+        (out_files, _) = fetch_or_upload_links(self.dfu, file_links, [], self.templater)
+        self.assertEqual(len(self.dfu.batches), 1)
+        self.assertEqual(out_files[0]['name'], 'big.txt')
+
+if __name__ == '__main__':
+    unittest.main()
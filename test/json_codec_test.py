@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import json
+import unittest
+
+from KBaseReport.utils import json_codec
+
+# documents that the fast backend handles differently from json, and some that it does not
+DOCUMENTS = [
+    '{"a": [1, 2.5, "three", null, true, false, {"b": {}}]}',
+    '"caf\\u00e9 \\ud83d\\ude00"',
+    '[NaN, Infinity, -Infinity]',
+    '[123456789012345678901234567890, -98765432109876543210]',
+    '18446744073709551616',
+    b'[-9223372036854775809, 9223372036854775807]',
+    '{"id": "12345678901234567890", "n": 1}',
+    '"\\ud800 lone surrogate"',
+    '{"a": 1, "a": 2}',
+    '  [1.0, 1e400, -0.0, 5e-324]  ',
+]
+INVALID_DOCUMENTS = ['', '[1', '{"a": }', '["this",{"is":"not"},{"valid":"json"]', '[1] x']
+
+
+class TestJsonCodec(unittest.TestCase):
+
+    def tearDown(self):
+        json_codec.use_backend()
+
+    def test_backends(self):
+        self.assertEqual(json_codec.available_backends()[-1], 'json')
+        self.assertEqual(json_codec.use_backend(), json_codec.available_backends()[0])
+        self.assertEqual(json_codec.use_backend('json'), 'json')
+        self.assertEqual(json_codec.backend(), 'json')
+        with self.assertRaisesRegex(ValueError, 'Unknown JSON backend'):
+            json_codec.use_backend('yaml')
+
+    def test_loads(self):
+        """ every backend decodes documents as json does, and raises the same errors """
+        for backend in json_codec.available_backends():
+            json_codec.use_backend(backend)
+            for doc in DOCUMENTS:
+                with self.subTest(backend=backend, doc=doc):
+                    expected = json.loads(doc)
+                    other = doc.decode('utf-8') if isinstance(doc, bytes) else doc.encode('utf-8')
+                    for value in [json_codec.loads(doc), json_codec.loads(other)]:
+                        # NaN != NaN, so compare encoded values
+                        self.assertEqual(repr(value), repr(expected))
+            for doc in INVALID_DOCUMENTS:
+                with self.subTest(backend=backend, doc=doc):
+                    with self.assertRaises(json.JSONDecodeError) as expected:
+                        json.loads(doc)
+                    with self.assertRaises(json.JSONDecodeError) as context:
+                        json_codec.loads(doc)
+                    self.assertEqual(str(context.exception), str(expected.exception))
+
+    def test_dumps(self):
+        """ every backend encodes values to JSON that decodes to the same value """
+        values = [
+            {'a': [1, 2.5, 'three', None, True, False, {'b': {}}], 'c': (1, 2)},
+            {1: 'integer key'},
+            [2 ** 70, 'café', '😀'],
+        ]
+        for backend in json_codec.available_backends():
+            json_codec.use_backend(backend)
+            for value in values:
+                with self.subTest(backend=backend, value=value):
+                    self.assertEqual(json.loads(json_codec.dumps(value)),
+                                     json.loads(json.dumps(value)))
+            self.assertEqual(json.loads(json_codec.dumps({'s': {1}}, default=list)), {'s': [1]})
+            with self.assertRaises(TypeError):
+                json_codec.dumps({'s': {1}})
+            self.assertIsInstance(json_codec.dumps([]), str)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from KBaseReport.authclient import TokenCache
+from KBaseReport.utils.shared_cache import SharedCache
+from KBaseReport.utils.upload_cache import UploadCache
+from KBaseReport.utils.workspace_cache import WorkspaceIdCache
+
+
+class _FakeDFU:
+    def __init__(self):
+        self.lookups = []
+
+    def ws_name_to_id(self, workspace_name):
+        self.lookups.append(workspace_name)
+        return len(workspace_name)
+
+
+def _write_entries(path, worker, count):
+    namespace = SharedCache(path, timeout=10).namespace('test', max_entries=50)
+    for n in range(count):
+        namespace.set('%d-%d' % (worker, n), {'worker': worker, 'n': n})
+
+
+def _keys(path, namespace):
+    """ Keys in a namespace, read without marking them as used """
+    with sqlite3.connect(path) as conn:
+        return sorted(key for (key,) in conn.execute(
+            'SELECT key FROM entries WHERE namespace = ?', (namespace,)))
+
+
+class TestSharedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.cache_dir, 'cache', 'shared.sqlite')
+        self.now = 1000.0
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def clock(self):
+        return self.now
+
+    def test_get_set(self):
+        cache = SharedCache(self.path, clock=self.clock)
+        (first, second) = (cache.namespace('first'), cache.namespace('second'))
+        first.set('key', {'a': [1, 2]})
+        first.set('temporary', 'value', ttl=10)
+        self.assertEqual(first.get('key'), {'a': [1, 2]})
+        self.assertIsNone(second.get('key'))
+        self.assertEqual(first.get('temporary'), 'value')
+        self.now += 10
+        self.assertIsNone(first.get('temporary'))
+        first.delete('key')
+        self.assertIsNone(first.get('key'))
+        self.assertEqual(first.stats(), {'entries': 0, 'bytes': 0})
+
+    def test_limits(self):
+        """ least recently used entries are evicted to keep within the entry and byte limits """
+        cache = SharedCache(self.path, clock=self.clock)
+        namespace = cache.namespace('test', max_entries=3, max_bytes=100)
+        for key in ['a', 'b', 'c']:
+            self.now += 10
+            namespace.set(key, key * 10)
+        self.now += 10
+        # 'a' is used, so 'b' is the least recently used
+        self.assertEqual(namespace.get('a'), 'a' * 10)
+        self.now += 10
+        namespace.set('d', 'd' * 10)
+        self.assertEqual(_keys(self.path, 'test'), ['a', 'c', 'd'])
+        # replacing a value does not add an entry
+        self.now += 10
+        namespace.set('d', 'D' * 20)
+        self.assertEqual(namespace.stats(), {'entries': 3, 'bytes': 12 + 12 + 22})
+
+        self.now += 10
+        namespace.set('e', 'e' * 60)
+        self.assertEqual(_keys(self.path, 'test'), ['a', 'd', 'e'])
+        self.assertEqual(namespace.stats(), {'entries': 3, 'bytes': 12 + 22 + 62})
+        # over both limits: 'a' goes to keep 3 entries, and 'd' to keep within 100 bytes
+        self.now += 10
+        namespace.set('f', 'f' * 30)
+        self.assertEqual(_keys(self.path, 'test'), ['e', 'f'])
+        self.assertEqual(namespace.stats(), {'entries': 2, 'bytes': 62 + 32})
+
+    def test_processes(self):
+        """ processes writing at once see each other's entries and share the limits """
+        SharedCache(self.path)
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=_write_entries, args=(self.path, worker, 40))
+                   for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        namespace = SharedCache(self.path).namespace('test')
+        self.assertEqual(namespace.stats()['entries'], 50)
+        with sqlite3.connect(self.path) as conn:
+            (entries, total_bytes) = conn.execute(
+                "SELECT count(*), sum(length(value)) FROM entries WHERE namespace = 'test'"
+            ).fetchone()
+        self.assertEqual(namespace.stats(), {'entries': entries, 'bytes': total_bytes})
+
+    def test_locked(self):
+        """ an update that cannot get the lock is skipped """
+        namespace = SharedCache(self.path, timeout=0.01).namespace('test')
+        namespace.set('a', 1)
+        with sqlite3.connect(self.path, isolation_level=None) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            namespace.set('b', 2)
+            self.assertEqual(namespace.get('a'), 1)
+            conn.execute('ROLLBACK')
+        self.assertIsNone(namespace.get('b'))
+
+    def test_shared_caches(self):
+        """ the auth, workspace ID and upload caches find each other's entries """
+        cache = SharedCache(self.path)
+        tokens = [TokenCache(shared=cache.namespace('tokens')) for _ in range(2)]
+        tokens[0].add_valid_token('token', 'user')
+        tokens[0].add_invalid_token('bad', 'rejected')
+        self.assertEqual((tokens[1].get_user('token'), tokens[1].get_error('bad')),
+                         ('user', 'rejected'))
+
+        dfu = _FakeDFU()
+        workspace_ids = [WorkspaceIdCache(shared=cache.namespace('workspace_ids'))
+                         for _ in range(2)]
+        self.assertEqual([c.get_id(dfu, 'ws') for c in workspace_ids], [2, 2])
+        self.assertEqual(dfu.lookups, ['ws'])
+
+        uploads = [UploadCache(os.path.join(self.cache_dir, str(n)),
+                               shared=cache.namespace('uploads')) for n in range(2)]
+        uploads[0].add('digest', {'shock_id': 'node', 'handle': {'hid': 'KBH_1'}})
+        self.assertEqual(uploads[1].get('digest')['shock_id'], 'node')
+        uploads[1].discard('digest')
+        self.assertIsNone(UploadCache(self.cache_dir, shared=cache.namespace('uploads'))
+                          .get('digest'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from KBaseReport.utils.template_cache import CompiledTemplateStore, TemplateCache, file_signature
+from KBaseReport.utils.TemplateUtil import TemplateUtil
+
+
+class TestTemplateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.write('page.tt', '[% INCLUDE header.tt %]<p>[% text %]</p>')
+        self.write('header.tt', '<h1>[% title %]</h1>')
+        self.store_dir = os.path.join(self.tmp_dir, 'store')
+        self.templater = self.make_templater()
+
+    def make_templater(self, **config):
+        return TemplateUtil(dict({
+            'scratch': self.tmp_dir,
+            'template_toolkit': {'ABSOLUTE': 1, 'RELATIVE': 1, 'INCLUDE_PATH': self.tmp_dir},
+        }, **config))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, content, mtime=None):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def render(self, templater=None):
+        return (templater or self.templater)._render_template(
+            os.path.join(self.tmp_dir, 'page.tt'), {'title': 'T', 'text': 'x'})
+
+    def test_render_from_cache(self):
+        """ the page and its include are compiled once, then rendered from the cache """
+        self.assertEqual(self.render(), '<h1>T</h1><p>x</p>')
+        self.assertEqual(self.render(), '<h1>T</h1><p>x</p>')
+        stats = self.templater.template_cache.stats()
+        self.assertEqual((stats['misses'], stats['hits'], stats['entries']), (2, 2, 2))
+
+    def test_include_invalidation(self):
+        """ changing an include recompiles the include, but not the page that uses it """
+        self.render()
+        self.write('header.tt', '<h2>[% title %]</h2>', mtime=1)
+        self.assertEqual(self.render(), '<h2>T</h2><p>x</p>')
+        stats = self.templater.template_cache.stats()
+        self.assertEqual((stats['invalidations'], stats['hits']), (1, 1))
+
+    def test_warm_up(self):
+        """ templates are compiled under the names renders use, so the first render is cached """
+        self.write('broken.tt', '[% IF %]')
+        os.makedirs(os.path.join(self.tmp_dir, 'views'))
+        self.write(os.path.join('views', 'item.tt'), '<li>[% text %]</li>')
+        result = self.templater.warm_up()
+        self.assertEqual(result['compiled'], ['header.tt', 'page.tt', 'views/item.tt'])
+        self.assertEqual(list(result['failed']), ['broken.tt'])
+        self.assertEqual(len(self.templater._engines), 1)
+
+        misses = self.templater.template_cache.stats()['misses']
+        self.assertEqual(self.templater._render_template('page.tt', {'title': 'T', 'text': 'x'}),
+                         '<h1>T</h1><p>x</p>')
+        self.assertEqual(self.templater.template_cache.stats()['misses'], misses)
+
+    def test_concurrent_renders(self):
+        """ renders run at the same time, each with its own engine, and keep their data apart """
+        page = self.write('wait.tt', '[% wait() %][% INCLUDE header.tt %][% text %]')
+        # every render waits here until all four are running
+        barrier = threading.Barrier(4, timeout=10)
+
+        def wait():
+            barrier.wait()
+            return ''
+
+        def render(n):
+            return self.templater._render_template(
+                page, {'title': n, 'text': n * 2, 'wait': wait})
+
+        with ThreadPoolExecutor(4) as executor:
+            self.assertEqual(list(executor.map(render, range(8))),
+                             ['<h1>%d</h1>%d' % (n, n * 2) for n in range(8)])
+        self.assertEqual(len(self.templater._engines), 4)
+
+    def test_lru_bounds(self):
+        cache = TemplateCache(max_entries=2, max_bytes=10)
+        cache.put('a', (1, 4), 'A', 4)
+        cache.put('b', (1, 4), 'B', 4)
+        # 'a' is now the most recently used, so 'b' is evicted
+        self.assertEqual(cache.get('a', (1, 4)), 'A')
+        cache.put('c', (1, 4), 'C', 4)
+        self.assertIsNone(cache.get('b', (1, 4)))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        # too many bytes
+        cache.put('d', (1, 8), 'D', 8)
+        self.assertEqual((cache.stats()['entries'], cache.stats()['bytes']), (1, 8))
+        self.assertEqual(cache.get('d', (1, 8)), 'D')
+        # never cached, as it is bigger than the whole cache
+        cache.put('e', (1, 20), 'E', 20)
+        self.assertIsNone(cache.get('e', (1, 20)))
+
+    def test_file_signature(self):
+        path = self.write('sig.tt', 'abc', mtime=1)
+        self.assertEqual(file_signature(path), (1000000000, 3))
+        self.assertIsNone(file_signature(os.path.join(self.tmp_dir, 'missing.tt')))
+
+    def test_store(self):
+        """ a new TemplateUtil loads compiled templates from the store instead of parsing them """
+        config = {'template-store-dir': self.store_dir}
+        templater = self.make_templater(**config)
+        self.assertEqual(self.render(templater), '<h1>T</h1><p>x</p>')
+        self.assertEqual(templater.template_store.stats(), {'hits': 0, 'misses': 2, 'writes': 2})
+
+        templater = self.make_templater(**config)
+        self.assertEqual(self.render(templater), '<h1>T</h1><p>x</p>')
+        self.assertEqual(templater.template_store.stats(), {'hits': 2, 'misses': 0, 'writes': 0})
+
+        # the page is requested by a different name, but re-uses the same stored code
+        templater = self.make_templater(**config)
+        self.write('named.tt', '[% template.name %]')
+        templater._render_template(os.path.join(self.tmp_dir, 'named.tt'))
+        self.assertEqual(templater._render_template('named.tt'), 'named.tt')
+        self.assertEqual(templater.template_store.stats()['hits'], 1)
+
+        # a changed template is compiled again
+        self.write('header.tt', '<h2>[% title %]</h2>')
+        templater = self.make_templater(**config)
+        self.assertEqual(self.render(templater), '<h2>T</h2><p>x</p>')
+        self.assertEqual(templater.template_store.stats(), {'hits': 1, 'misses': 1, 'writes': 1})
+
+    def test_store_include_path_only(self):
+        """ templates outside the INCLUDE_PATH are cached in memory, but not stored """
+        other_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_dir)
+        page = os.path.join(other_dir, 'report.tt')
+        with open(page, 'w') as f:
+            f.write('[% INCLUDE header.tt %]')
+        templater = self.make_templater(**{'template-store-dir': self.store_dir})
+        self.assertEqual(templater._render_template(page, {'title': 'T'}), '<h1>T</h1>')
+        self.assertEqual(templater._render_template(page, {'title': 'T'}), '<h1>T</h1>')
+        # only the include is stored
+        self.assertEqual(templater.template_store.stats(), {'hits': 0, 'misses': 1, 'writes': 1})
+        self.assertEqual(len(os.listdir(self.store_dir)), 1)
+        self.assertEqual(templater.template_cache.stats()['entries'], 2)
+
+    def test_store_unreadable(self):
+        """ corrupt or outdated files in the store are ignored """
+        store = CompiledTemplateStore(self.store_dir)
+        code = compile('x = 1', 'test', 'exec')
+        store.save('key', b'source', code)
+        self.assertIsNotNone(store.load('key', b'source'))
+        self.assertIsNone(store.load('key', b'changed source'))
+        for name in os.listdir(self.store_dir):
+            with open(os.path.join(self.store_dir, name), 'wb') as f:
+                f.write(b'not a compiled template')
+        self.assertIsNone(store.load('key', b'source'))
+
+    def test_precompile_templates(self):
+        templater = self.make_templater(**{'template-store-dir': self.store_dir})
+        compiled = templater.precompile_templates(self.tmp_dir)
+        self.assertEqual([os.path.basename(path) for path in compiled], ['header.tt', 'page.tt'])
+        self.assertEqual(len(os.listdir(self.store_dir)), 2)
+
+        templater = self.make_templater(**{'template-store-dir': self.store_dir})
+        self.render(templater)
+        self.assertEqual(templater.template_store.stats()['misses'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from template import Template
+from template.util import TemplateException
+
+from KBaseReport.utils.template_stream import can_stream, process_to_file
+
+TEMPLATES = {
+    'include.tt': '<i>[% name %]</i>',
+    'wrapper.tt': '<div>[% content %]</div>',
+    'table.tt': """<table>
+[% FOREACH row IN rows %]<tr>[% FOREACH cell IN row %]<td>[% cell | html %]</td>[% END %]</tr>
+[% END %]</table>
+[% INCLUDE include.tt name='included' %]
+[% WRAPPER wrapper.tt %]wrapped [% rows.size %][% END %]
+[% BLOCK local %]block [% n %][% END %][% PROCESS local n=1 %]
+[% FILTER upper %]filtered[% END %]
+[% TRY %][% THROW oops 'message' %][% CATCH %]caught [% error.type %][% END %]
+[% template.name %]
+[% RETURN %]after return""",
+    'clear.tt': 'discarded [% CLEAR %]kept [% value %]',
+    'error.tt': 'before [% THROW broken "bad template" %] after',
+}
+
+
+class _RecordingFile(io.StringIO):
+    """ StringIO that records how many writes it has had """
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        return super().write(s)
+
+
+class TestTemplateStream(unittest.TestCase):
+
+    def setUp(self):
+        self.template_dir = tempfile.mkdtemp()
+        for (name, content) in TEMPLATES.items():
+            with open(os.path.join(self.template_dir, name), 'w') as f:
+                f.write(content)
+        self.engine = Template({'INCLUDE_PATH': self.template_dir})
+        self.data = {'rows': [['a<%d' % i, 'b%d' % i] for i in range(50)]}
+
+    def tearDown(self):
+        shutil.rmtree(self.template_dir)
+
+    def test_can_stream(self):
+        self.assertTrue(can_stream({'INCLUDE_PATH': self.template_dir, 'ABSOLUTE': 1}))
+        for option in ['WRAPPER', 'PRE_PROCESS', 'POST_PROCESS', 'PROCESS', 'ERROR', 'TRIM']:
+            self.assertFalse(can_stream({option: 'x.tt'}))
+
+    def test_process_to_file(self):
+        """ streamed output matches Template.process, and is written as it is produced """
+        expected = self.engine.process('table.tt', dict(self.data))
+        fileobj = _RecordingFile()
+        process_to_file(self.engine, 'table.tt', dict(self.data), fileobj)
+        self.assertEqual(fileobj.getvalue(), expected)
+        self.assertNotIn('after return', expected)
+        self.assertGreater(fileobj.writes, len(self.data['rows']))
+
+        # compiled templates can be streamed as well
+        document = self.engine.context().template('table.tt')
+        fileobj = io.StringIO()
+        process_to_file(self.engine, document, dict(self.data), fileobj)
+        self.assertEqual(fileobj.getvalue(), expected)
+
+    def test_process_to_file_clear(self):
+        """ a template that CLEARs its output is processed again, without streaming """
+        fileobj = io.StringIO()
+        process_to_file(self.engine, 'clear.tt', {'value': 1}, fileobj)
+        self.assertEqual(fileobj.getvalue(), 'kept 1')
+
+    def test_process_to_file_error(self):
+        with self.assertRaisesRegex(TemplateException, 'bad template'):
+            process_to_file(self.engine, 'error.tt', {}, io.StringIO())
+        # the engine is still usable afterwards
+        fileobj = io.StringIO()
+        process_to_file(self.engine, 'include.tt', {'name': 'x'}, fileobj)
+        self.assertEqual(fileobj.getvalue(), '<i>x</i>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from KBaseReport.utils.upload_cache import UploadCache, file_sha256
+
+
+def _shock(n):
+    return {'shock_id': 'node' + str(n), 'handle': {'hid': 'KBH_' + str(n), 'id': 'node' + str(n)}}
+
+
+class TestUploadCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_file_sha256(self):
+        """ chunked, memory-mapped hashing gives the same digest as hashlib """
+        content = os.urandom(100000)
+        file_path = os.path.join(self.cache_dir, 'file.bin')
+        with open(file_path, 'wb') as f:
+            f.write(content)
+        expected = hashlib.sha256(content).hexdigest()
+        self.assertEqual(file_sha256(file_path), expected)
+        self.assertEqual(file_sha256(file_path, chunk_size=4096), expected)
+
+        empty_path = os.path.join(self.cache_dir, 'empty.bin')
+        open(empty_path, 'w').close()
+        self.assertEqual(file_sha256(empty_path), hashlib.sha256(b'').hexdigest())
+
+    def test_get_add_stats(self):
+        cache = UploadCache(self.cache_dir)
+        self.assertIsNone(cache.get('abc'))
+        cache.add('abc', _shock(1))
+        self.assertEqual(cache.get('abc'), _shock(1))
+        cache.discard('abc')
+        self.assertIsNone(cache.get('abc'))
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'entries': 0})
+
+    def test_lru_eviction(self):
+        cache = UploadCache(self.cache_dir, max_entries=2)
+        cache.add('a', _shock(1))
+        cache.add('b', _shock(2))
+        # 'a' is now the most recently used, so 'b' is evicted
+        cache.get('a')
+        cache.add('c', _shock(3))
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('c'))
+
+    def test_persistence(self):
+        cache = UploadCache(self.cache_dir)
+        cache.add('a', _shock(1))
+        cache.save()
+        self.assertEqual(UploadCache(self.cache_dir).get('a'), _shock(1))
+
+        # an unreadable index is treated as empty
+        with open(os.path.join(self.cache_dir, UploadCache.INDEX_FILE), 'w') as f:
+            f.write('{not json')
+        self.assertIsNone(UploadCache(self.cache_dir).get('a'))
+
+    def test_accepts(self):
+        cache = UploadCache(self.cache_dir, min_file_size=10)
+        small = os.path.join(self.cache_dir, 'small.txt')
+        large = os.path.join(self.cache_dir, 'large.txt')
+        with open(small, 'w') as f:
+            f.write('x')
+        with open(large, 'w') as f:
+            f.write('x' * 10)
+        self.assertFalse(cache.accepts(small))
+        self.assertTrue(cache.accepts(large))
+        self.assertFalse(cache.accepts(self.cache_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+import copy
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from cerberus import Validator
+
+from KBaseReport.utils import json_codec, validation_utils
+from KBaseReport.utils.fast_validation import compile_check
+from KBaseReport.utils.validation_utils import (validate_extended_report_params,
+                                                validate_template_params)
+
+SPEC_FILE = os.path.join(os.path.dirname(__file__), '..', 'KBaseReport.spec')
+
+# values that each field is set to when making invalid versions of valid params
+MUTATIONS = [None, 0, -1, 1, True, 1.5, '', 'x', 'ab', [], ['x'], [{}], {}, {'x': 1}]
+# field names to add to params
+EXTRA_FIELDS = ['unknown', 'path', 'shock_id', 'template', 'direct_html', 'html_links',
+                'direct_html_link_index', 'records_json', 'records_file', 'output_file']
+
+
+def _variants(doc):
+    """ Yield copies of doc with one field removed, replaced or added, at any depth """
+    for (field, value) in doc.items():
+        yield {k: v for (k, v) in doc.items() if k != field}
+        for mutation in MUTATIONS:
+            yield dict(doc, **{field: copy.deepcopy(mutation)})
+        if isinstance(value, dict):
+            for variant in _variants(value):
+                yield dict(doc, **{field: variant})
+        if isinstance(value, list) and value:
+            items = [value[0]] if not isinstance(value[0], dict) else _variants(value[0])
+            for item in list(items) + MUTATIONS:
+                yield dict(doc, **{field: value + [copy.deepcopy(item)]})
+    for field in EXTRA_FIELDS:
+        if field not in doc:
+            for mutation in ['x', 1, None, {}, [], {'template_file': 'abc'}]:
+                yield dict(doc, **{field: mutation})
+
+
+def _spec_typedefs():
+    """ Field names of each structure typedef in KBaseReport.spec """
+    with open(SPEC_FILE) as f:
+        spec = f.read()
+    return {name: re.findall(r'(\w+);', body)
+            for (body, name) in re.findall(r'typedef structure \{([^}]*)\}\s*(\w+);', spec)}
+
+
+def _params(n, ref='1/2/3'):
+    return {
+        'workspace_id': 1,
+        'message': 'message',
+        'objects_created': [{'ref': ref, 'description': 'object ' + str(i)} for i in range(n)],
+    }
+
+
+class TestValidationUtils(unittest.TestCase):
+
+    def test_validators_reused(self):
+        """ each thread creates a validator for a schema once, and then re-uses it """
+        validator = validation_utils._get_validator('extended_report',
+                                                    validation_utils._extended_report_schema)
+        validate_extended_report_params(_params(2))
+        self.assertIs(validation_utils._get_validator('extended_report', None), validator)
+
+        other_threads = []
+        thread = threading.Thread(target=lambda: other_threads.append(
+            validation_utils._get_validator('extended_report',
+                                            validation_utils._extended_report_schema)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other_threads[0], validator)
+
+    def test_concurrent_validation(self):
+        """ validations running in different threads do not see each other's documents """
+        results = {}
+
+        def validate(n):
+            outcomes = []
+            for _ in range(20):
+                try:
+                    validate_extended_report_params(_params(50, ref='' if n % 2 else '1/2/3'))
+                    outcomes.append('valid')
+                except TypeError as err:
+                    outcomes.append('min length is 1' in str(err))
+            results[n] = outcomes
+
+        threads = [threading.Thread(target=validate, args=(n,)) for n in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for (n, outcomes) in results.items():
+            self.assertEqual(outcomes, [True if n % 2 else 'valid'] * 20)
+
+    def test_large_params_error(self):
+        """ errors for large params are short, and show where the params were cut short """
+        params = dict(_params(100, ref=''), direct_html='<p>' * 10000000)
+        with self.assertRaises(TypeError) as context:
+            validate_extended_report_params(params)
+        message = str(context.exception)
+        self.assertIn('min length is 1', message)
+        self.assertIn('<+29999500 characters>', message)
+        self.assertIn('<80 more items>', message)
+        self.assertLess(len(message), 20000)
+
+    def test_template_data_parsed_once(self):
+        """ template data is parsed once between validating a report and rendering its links """
+        scratch = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scratch)
+        config = {'scratch': scratch, 'template_toolkit': {}}
+        data = {'rows': [[i, 'row ' + str(i)] for i in range(100)]}
+        for use_fast_checks in [True, False]:
+            validation_utils.USE_FAST_CHECKS = use_fast_checks
+            params = {
+                'workspace_id': 1,
+                'file_links': [
+                    {'name': 'page' + str(i) + '.html',
+                     'template': {'template_file': 'views/page.tt',
+                                  'template_data_json': json.dumps(dict(data, page=i))}}
+                    for i in range(3)
+                ],
+            }
+            try:
+                with mock.patch.object(json_codec, 'loads', wraps=json_codec.loads) as loads:
+                    validated = validate_extended_report_params(params)
+                    rendered = [validate_template_params(link['template'], config)
+                                for link in validated['file_links']]
+            finally:
+                validation_utils.USE_FAST_CHECKS = True
+            self.assertEqual(loads.call_count, 3)
+            self.assertEqual([r['template_data'] for r in rendered],
+                             [dict(data, page=i) for i in range(3)])
+
+            # the params passed in are left as they were
+            self.assertEqual(params['file_links'][0]['template'],
+                             {'template_file': 'views/page.tt',
+                              'template_data_json': json.dumps(dict(data, page=0))})
+
+        # invalid JSON is still reported
+        with self.assertRaisesRegex(TypeError, 'Invalid JSON'):
+            validate_template_params({'template_file': 'page.tt', 'template_data_json': '[1'},
+                                     config)
+        # a template whose JSON was not parsed by report validation is parsed once
+        with mock.patch.object(json_codec, 'loads', wraps=json_codec.loads) as loads:
+            self.assertEqual(validate_template_params(
+                {'template_file': 'page.tt', 'template_data_json': '{"a": [1]}'}, config
+            )['template_data'], {'a': [1]})
+        self.assertEqual(loads.call_count, 1)
+
+
+class TestFastValidation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.scratch = tempfile.mkdtemp()
+        cls.file_path = os.path.join(cls.scratch, 'file.txt')
+        with open(cls.file_path, 'w') as f:
+            f.write('file')
+        template = {'template_file': 'views/page.tt', 'template_data_json': '{"a": [1, 2]}'}
+        links = [
+            {'name': 'a.txt', 'path': cls.file_path, 'label': 'A', 'description': None},
+            {'name': 'b.txt', 'shock_id': 'node'},
+            {'name': 'c.html', 'template': dict(template)},
+        ]
+        scratch = cls.scratch
+        cls.cases = [
+            ('simple_report', validation_utils._simple_report_schema, {}, {
+                'workspace_name': 'ws',
+                'report': {
+                    'text_message': 'message',
+                    'warnings': ['warning'],
+                    'objects_created': [{'ref': '1/2/3', 'description': 'object'}],
+                    'template': dict(template),
+                },
+            }),
+            ('extended_report', validation_utils._extended_report_schema, {}, {
+                'workspace_id': 1,
+                'message': 'message',
+                'objects_created': [{'ref': '1/2/3'}],
+                'warnings': ['warning'],
+                'file_links': copy.deepcopy(links),
+                'html_links': copy.deepcopy(links),
+                'direct_html_link_index': 0,
+                'report_object_name': None,
+                'html_window_height': 100,
+            }),
+            ('extended_report', validation_utils._extended_report_schema, {}, {
+                'workspace_name': 'ws',
+                'direct_html': '<p>report</p>',
+                'summary_window_height': None,
+            }),
+            ('template', lambda: validation_utils._template_schema(scratch, True),
+             {'purge_unknown': True}, dict(template, output_file=scratch + '/out.html')),
+            ('template_batch', lambda: validation_utils._template_batch_schema(scratch),
+             {'purge_unknown': True}, {
+                 'template_file': 'views/page.tt',
+                 'output_file_pattern': scratch + '/{index}.html',
+                 'records_json': '[{}]',
+             }),
+            ('template_util_config', validation_utils._template_util_config_schema,
+             {'allow_unknown': True}, {'scratch': scratch, 'template_toolkit': {}}),
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.scratch)
+
+    def test_compiled_checks_match_cerberus(self):
+        """ compiled checks accept exactly the params that cerberus accepts """
+        for (name, make_schema, options, params) in self.cases:
+            check = compile_check(make_schema(), **options)
+            validator = Validator(make_schema(), **options)
+            variants = [params] + list(_variants(params))
+            accepted = 0
+            for variant in variants:
+                try:
+                    expected = validator.validate(copy.deepcopy(variant))
+                except Exception:
+                    expected = False
+                with self.subTest(schema=name, params=variant):
+                    self.assertEqual(check(variant), expected)
+                accepted += expected
+            # the variants include plenty of valid and invalid params
+            self.assertGreater(accepted, 5)
+            self.assertGreater(len(variants) - accepted, 20)
+
+    def test_error_messages(self):
+        """ errors are reported by cerberus, with or without compiled checks """
+        config = {'scratch': self.scratch, 'template_toolkit': {}}
+        invalid = [
+            {'template_file': 'ab'},
+            {'template_data_json': '{}', 'output_file': '/elsewhere/x'},
+            {'template_file': 'views/page.tt', 'template_data_json': '{"a": ',
+             'output_file': self.scratch + '/x'},
+        ]
+        for params in invalid:
+            messages = []
+            for use_fast_checks in [True, False]:
+                validation_utils.USE_FAST_CHECKS = use_fast_checks
+                try:
+                    with self.assertRaises(TypeError) as context:
+                        validate_template_params(dict(params), config, with_output_file=True)
+                finally:
+                    validation_utils.USE_FAST_CHECKS = True
+                messages.append(str(context.exception))
+            self.assertEqual(messages[0], messages[1])
+
+    def test_validated_params(self):
+        """ params accepted by the compiled check are returned as cerberus would return them """
+        config = {'scratch': self.scratch, 'template_toolkit': {}}
+        params = {'template_file': 'views/page.tt', 'template_data_json': json.dumps({'a': 1}),
+                  'output_file': self.scratch + '/x.html', 'unknown': 'purged'}
+        results = []
+        for use_fast_checks in [True, False]:
+            validation_utils.USE_FAST_CHECKS = use_fast_checks
+            try:
+                results.append(validate_template_params(dict(params), config, True))
+            finally:
+                validation_utils.USE_FAST_CHECKS = True
+        self.assertEqual(results[0], results[1])
+        self.assertNotIn('unknown', results[0])
+
+    def test_schemas_match_spec(self):
+        """ the schemas have the fields of the KIDL types they validate """
+        typedefs = _spec_typedefs()
+        schemas = [
+            ('CreateExtendedReportParams', validation_utils._extended_report_schema()),
+            ('SimpleReport', validation_utils._simple_report_schema()['report']['schema']),
+            ('File', validation_utils.extended_file_schema['schema']),
+            ('WorkspaceObject', validation_utils.object_created_schema['schema']),
+            ('TemplateParams', validation_utils.template_schema),
+            ('RenderTemplateParams', validation_utils._template_schema(self.scratch, True)),
+            ('RenderTemplateBatchParams', validation_utils._template_batch_schema(self.scratch)),
+        ]
+        for (typedef, schema) in schemas:
+            with self.subTest(typedef=typedef):
+                self.assertEqual(sorted(schema), sorted(typedefs[typedef]))
+
+
+if __name__ == '__main__':
+    unittest.main()
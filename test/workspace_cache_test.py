@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from KBaseReport.utils.workspace_cache import WorkspaceIdCache
+
+
+class _FakeDFU:
+    def __init__(self):
+        self.lookups = []
+
+    def ws_name_to_id(self, workspace_name):
+        self.lookups.append(workspace_name)
+        return len(workspace_name)
+
+
+class TestWorkspaceIdCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dfu = _FakeDFU()
+        self.now = 0
+
+    def clock(self):
+        return self.now
+
+    def test_get_id(self):
+        cache = WorkspaceIdCache(clock=self.clock)
+        self.assertEqual(cache.get_id(self.dfu, 'ws'), 2)
+        self.assertEqual(cache.get_id(self.dfu, 'ws'), 2)
+        self.assertEqual(cache.get_id(self.dfu, 'other'), 5)
+        self.assertEqual(self.dfu.lookups, ['ws', 'other'])
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'entries': 2})
+
+    def test_ttl(self):
+        cache = WorkspaceIdCache(ttl=10, clock=self.clock)
+        cache.get_id(self.dfu, 'ws')
+        self.now = 9
+        cache.get_id(self.dfu, 'ws')
+        self.now = 10
+        cache.get_id(self.dfu, 'ws')
+        self.assertEqual(self.dfu.lookups, ['ws', 'ws'])
+
+    def test_lru_eviction(self):
+        cache = WorkspaceIdCache(max_entries=2, clock=self.clock)
+        cache.get_id(self.dfu, 'a')
+        cache.get_id(self.dfu, 'b')
+        # 'a' is now the most recently used, so 'b' is evicted
+        cache.get_id(self.dfu, 'a')
+        cache.get_id(self.dfu, 'c')
+        cache.get_id(self.dfu, 'a')
+        cache.get_id(self.dfu, 'b')
+        self.assertEqual(self.dfu.lookups, ['a', 'b', 'c', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import http.client
+import multiprocessing
+import os
+import threading
+import time
+import unittest
+
+from KBaseReport.utils.wsgi_server import make_threaded_server, run_server
+
+
+def _app(environ, start_response):
+    """ Responds with the process ID, after sleeping for the number of seconds in the path """
+    delay = float(environ['PATH_INFO'].strip('/') or 0)
+    time.sleep(delay)
+    body = str(os.getpid()).encode('utf-8')
+    start_response('200 OK', [('Content-Type', 'text/plain'),
+                              ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def _get(port, path='/', connection=None):
+    connection = connection or http.client.HTTPConnection('localhost', port, timeout=10)
+    connection.request('GET', path)
+    response = connection.getresponse()
+    return response.read().decode('utf-8')
+
+
+class TestThreadedServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = make_threaded_server('localhost', 0, _app, threads=4, keepalive=2)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        if not self.server.stopping:
+            self.server.shutdown()
+            self.server.stop(5)
+        self.thread.join()
+
+    def test_concurrent_requests(self):
+        """ a slow request does not hold up other requests """
+        finished = []
+        slow = threading.Thread(target=lambda: finished.append(_get(self.port, '/1') and 'slow'))
+        slow.start()
+        time.sleep(0.1)
+        for _ in range(3):
+            _get(self.port)
+        finished.append('fast')
+        slow.join()
+        self.assertEqual(finished, ['fast', 'slow'])
+
+    def test_keep_alive(self):
+        """ a connection is re-used for several requests """
+        connection = http.client.HTTPConnection('localhost', self.port, timeout=10)
+        _get(self.port, connection=connection)
+        sock = connection.sock
+        self.assertIsNotNone(sock)
+        _get(self.port, connection=connection)
+        self.assertIs(connection.sock, sock)
+        connection.close()
+
+    def test_graceful_stop(self):
+        """ stopping waits for requests in progress """
+        results = []
+        slow = threading.Thread(target=lambda: results.append(_get(self.port, '/0.5')))
+        slow.start()
+        time.sleep(0.1)
+        self.server.shutdown()
+        self.assertTrue(self.server.stop(5))
+        slow.join()
+        self.assertEqual(results, [str(os.getpid())])
+        with self.assertRaises(OSError):
+            _get(self.port)
+
+
+class TestPreforkServer(unittest.TestCase):
+
+    def test_prefork(self):
+        """ worker processes serve requests, and all stop on SIGTERM """
+        context = multiprocessing.get_context('fork')
+        ports = context.Queue()
+        server = context.Process(target=run_server, args=(_app, 'localhost', 0), kwargs={
+            'mode': 'prefork', 'workers': 2, 'threads': 2, 'ready': ports.put})
+        server.start()
+        port = ports.get(timeout=10)
+        pids = set(int(_get(port)) for _ in range(10))
+        self.assertTrue(pids)
+        self.assertNotIn(server.pid, pids)
+        self.assertNotIn(os.getpid(), pids)
+
+        server.terminate()
+        server.join(10)
+        self.assertEqual(server.exitcode, 0)
+        for pid in pids:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
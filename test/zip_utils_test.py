@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from KBaseReport.utils import zip_utils
+from KBaseReport.utils.zip_utils import pack_directory, pack_entries
+
+
+class TestZipUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.src_dir = os.path.join(self.tmp_dir, 'html')
+        self.contents = {
+            'index.html': b'<html>index</html>',
+            os.path.join('css', 'style.css'): b'body { color: red }',
+            os.path.join('data', 'table.bin'): os.urandom(300000),
+        }
+        for (name, content) in self.contents.items():
+            path = os.path.join(self.src_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+        os.makedirs(os.path.join(self.src_dir, 'empty'))
+        self.zip_path = os.path.join(self.tmp_dir, 'html.zip')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_archive(self):
+        with zipfile.ZipFile(self.zip_path) as archive:
+            self.assertIsNone(archive.testzip())
+            for (name, content) in self.contents.items():
+                self.assertEqual(archive.read(name), content)
+            self.assertIn('empty/', archive.namelist())
+
+    def test_pack_directory(self):
+        """ the archive holds the directory contents and the MD5 matches the file on disk """
+        md5 = pack_directory(self.src_dir, self.zip_path)
+        with open(self.zip_path, 'rb') as f:
+            self.assertEqual(md5, hashlib.md5(f.read()).hexdigest())
+        self.check_archive()
+
+        # entries are written in a single pass, with data descriptors after each file
+        with zipfile.ZipFile(self.zip_path) as archive:
+            for zinfo in archive.infolist():
+                if not zinfo.is_dir():
+                    self.assertTrue(zinfo.flag_bits & 0x08)
+
+    def test_pack_directory_zip64(self):
+        """ Zip64 extensions are used for entries that need them """
+        zip64_limit = zipfile.ZIP64_LIMIT
+        zipfile.ZIP64_LIMIT = 1000
+        try:
+            pack_directory(self.src_dir, self.zip_path)
+        finally:
+            zipfile.ZIP64_LIMIT = zip64_limit
+        self.check_archive()
+
+    def test_pack_entries_chunked(self):
+        """ small copy chunks give the same archive contents """
+        chunk_size = zip_utils.COPY_CHUNK_SIZE
+        zip_utils.COPY_CHUNK_SIZE = 1024
+        try:
+            pack_directory(self.src_dir, self.zip_path)
+        finally:
+            zip_utils.COPY_CHUNK_SIZE = chunk_size
+        self.check_archive()
+
+    def test_pack_entries_renamed_file(self):
+        """ a single file can be packed under a different name, without staging a copy """
+        md5 = pack_entries([(os.path.join(self.src_dir, 'index.html'), 'main.html')],
+                           self.zip_path)
+        with open(self.zip_path, 'rb') as f:
+            self.assertEqual(md5, hashlib.md5(f.read()).hexdigest())
+        with zipfile.ZipFile(self.zip_path) as archive:
+            self.assertEqual(archive.namelist(), ['main.html'])
+            self.assertEqual(archive.read('main.html'), self.contents['index.html'])
+        self.assertEqual(sorted(os.listdir(self.src_dir)), ['css', 'data', 'empty', 'index.html'])
+
+    def test_pack_entries_in_memory(self):
+        """ file contents given as bytes are packed without being written to disk first """
+        content = b'<html>rendered</html>' * 1000
+        md5 = pack_entries([(content, 'report.html'),
+                            (os.path.join(self.src_dir, 'index.html'), 'index.html')],
+                           self.zip_path)
+        with open(self.zip_path, 'rb') as f:
+            self.assertEqual(md5, hashlib.md5(f.read()).hexdigest())
+        with zipfile.ZipFile(self.zip_path) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['report.html', 'index.html'])
+            self.assertEqual(archive.read('report.html'), content)
+            self.assertEqual(archive.getinfo('report.html').compress_type, zipfile.ZIP_DEFLATED)
+
+
+if __name__ == '__main__':
+    unittest.main()